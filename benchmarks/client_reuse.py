@@ -0,0 +1,90 @@
+"""Benchmark per-call overhead of constructing Google clients vs reusing them.
+
+Runs `google_speech.convert_text_to_speech` against a local gRPC stand-in,
+first constructing a new client (and channel) per call, as the code used to,
+then with the shared client from `voicebots.google_clients`.
+
+The stand-in is plaintext on localhost, so this understates the savings in
+production, where each new channel also pays DNS, TLS and auth token setup.
+
+Usage:
+    python -m benchmarks.client_reuse --num-calls 200
+"""
+import statistics
+import time
+from typing import Callable, Dict, List
+
+import click
+import grpc
+from google.cloud import texttospeech
+
+from benchmarks.grpc_standins import start_tts_standin
+from voicebots import google_clients
+from voicebots.speech import google_speech
+
+
+def _summarize(latencies: List[float]) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    return {
+        "mean_ms": round(statistics.mean(latencies) * 1000, 3),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+    }
+
+
+def _time_calls(fn: Callable, num_calls: int) -> List[float]:
+    latencies = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+@click.command()
+@click.option("--num-calls", default=200, show_default=True)
+def main(num_calls: int):
+    """Compare per-call and shared client latency against a local stand-in."""
+    server, address = start_tts_standin()
+    transport_cls = texttospeech.TextToSpeechClient.get_transport_class("grpc")
+
+    def per_call_client():
+        channel = grpc.insecure_channel(address)
+        client = texttospeech.TextToSpeechClient(
+            transport=transport_cls(host=address, channel=channel)
+        )
+        client.synthesize_speech(
+            input=texttospeech.SynthesisInput(text="Hello"),
+            voice=texttospeech.VoiceSelectionParams(language_code="en-GB"),
+            audio_config=texttospeech.AudioConfig(
+                audio_encoding=texttospeech.AudioEncoding.LINEAR16
+            ),
+        )
+        channel.close()
+
+    google_clients.set_default_registry(
+        google_clients.GoogleClientRegistry(tts_endpoint=address, insecure=True)
+    )
+
+    def shared_client():
+        google_speech.convert_text_to_speech(text="Hello")
+
+    try:
+        # Warm up imports, server threads, etc.
+        _time_calls(per_call_client, 5)
+        _time_calls(shared_client, 5)
+
+        before = _summarize(_time_calls(per_call_client, num_calls))
+        after = _summarize(_time_calls(shared_client, num_calls))
+    finally:
+        server.stop(grace=None)
+
+    click.echo(f"New client per call: {before}")
+    click.echo(f"Shared client:       {after}")
+    click.echo(
+        f"Per-call overhead saved: {before['mean_ms'] - after['mean_ms']:.3f}ms (mean)"
+    )
+
+
+if __name__ == "__main__":
+    main()
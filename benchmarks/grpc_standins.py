@@ -0,0 +1,57 @@
+"""Local gRPC stand-ins for Google Cloud APIs.
+
+These servers speak the real wire protocol, so the real client libraries
+(and their channel setup costs) can be exercised without network access,
+credentials or spend.
+
+Usage:
+    server, address = start_tts_standin()
+    ...
+    server.stop(grace=None)
+"""
+import time
+from concurrent import futures
+from typing import Tuple
+
+import grpc
+from google.cloud import texttospeech
+
+TTS_SERVICE = "google.cloud.texttospeech.v1.TextToSpeech"
+
+# 100ms of 24kHz LINEAR16 silence
+FAKE_AUDIO_BYTES = b"\x00" * 4800
+
+
+def start_tts_standin(
+    port: int = 0, latency_sec: float = 0, max_workers: int = 16
+) -> Tuple[grpc.Server, str]:
+    """Start a local Text-to-Speech server that returns silence.
+
+    Args:
+        port: Port to listen on. 0 picks a free port.
+        latency_sec: Simulated synthesis time per request.
+        max_workers: Server threads.
+
+    Returns:
+        The running server, and its "host:port" address.
+    """
+
+    def synthesize_speech(request, context):
+        time.sleep(latency_sec)
+        return texttospeech.SynthesizeSpeechResponse(audio_content=FAKE_AUDIO_BYTES)
+
+    handler = grpc.method_handlers_generic_handler(
+        TTS_SERVICE,
+        {
+            "SynthesizeSpeech": grpc.unary_unary_rpc_method_handler(
+                synthesize_speech,
+                request_deserializer=texttospeech.SynthesizeSpeechRequest.deserialize,
+                response_serializer=texttospeech.SynthesizeSpeechResponse.serialize,
+            )
+        },
+    )
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers))
+    server.add_generic_rpc_handlers((handler,))
+    port = server.add_insecure_port(f"localhost:{port}")
+    server.start()
+    return server, f"localhost:{port}"
@@ -0,0 +1,446 @@
+"""End-to-end latency benchmark of the voice turn loop.
+
+Drives full turns against local stand-ins (see `voicebots.backends`):
+
+    audio in -> transcript -> prompt build -> completion -> TTS -> first audio out
+
+Replies go through `chat_utils.chat_prompt_stream`, like `cli chat
+--stream` and the server: the intent router and response cache (if
+enabled), then a Conversation's token-budgeted prompt, then the LLM. Each
+sentence is sent to TTS as soon as it is generated, so synthesis overlaps
+with generation. Reports
+p50/p95/p99 per stage, time to first audio (TTFA, from the end of the
+user's speech), and turn throughput with N concurrent sessions.
+
+Stages:
+    asr: End of user audio -> final transcript.
+    prompt: Routing, response cache lookup and prompt build, until the LLM
+        request. Only for turns that go to the LLM, as are the llm_* stages.
+    llm_first_sentence: Request -> first complete sentence.
+    tts_first_sentence: Synthesis of the first sentence.
+    time_to_first_audio: End of user audio -> first audio ready to play.
+    llm_total: Request -> end of the completion stream.
+    turn_total: End of user audio -> all audio of the reply ready.
+
+With `--tts standin`, TTS goes through the real Google client to a local
+gRPC stand-in, which also measures client overhead.
+
+Usage:
+    python -m benchmarks.turn_latency --sessions 1 --sessions 8 --sessions 32
+    python -m benchmarks.turn_latency --time-scale 0.1 --output results.json
+    python -m benchmarks.turn_latency --intents --response-cache
+"""
+import json
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Union
+
+import click
+import numpy as np
+
+from voicebots import chat_utils, google_clients
+from voicebots.asr.audio_sources import ArraySource
+from voicebots.asr.transcriber import FAKE_ENDPOINTING_LATENCY, FakeTranscriber
+from voicebots.completer import (
+    FAKE_FIRST_TOKEN_LATENCY,
+    FAKE_TOKEN_SEC,
+    Completer,
+    FakeCompleter,
+)
+from voicebots.conversation import DEFAULT_MAX_PROMPT_TOKENS, Conversation
+from voicebots.intent_router import DEFAULT_INTENTS, IntentRouter
+from voicebots.response_cache import ResponseCache
+from voicebots.simulation import Latency
+from voicebots.speech.synthesizer import (
+    FAKE_SYNTHESIS_LATENCY,
+    FakeSynthesizer,
+    GoogleSynthesizer,
+    Synthesizer,
+)
+
+STAGES = [
+    "asr",
+    "prompt",
+    "llm_first_sentence",
+    "tts_first_sentence",
+    "time_to_first_audio",
+    "llm_total",
+    "turn_total",
+]
+PERCENTILES = [50, 95, 99]
+
+# Length of the (silent) user audio per turn
+UTTERANCE_SEC = 2.0
+AUDIO_RATE = 16000
+
+USER_UTTERANCES = [
+    "hi there how are you doing today",
+    "can you help me plan a trip to the mountains",
+    "what should I pack for a week of hiking",
+    "how cold does it get at night",
+    "thank you",
+]
+
+PROMPT_CONFIG = {"temperature": 0.7, "max_tokens": 128}
+
+# Sentences synthesized ahead of playback, as in `cli.speak_sentences`
+TTS_WORKERS = 2
+
+
+def _scaled(latency: Latency, scale: float) -> Latency:
+    p95_sec = latency.p95_sec * scale if latency.p95_sec is not None else None
+    return Latency(latency.median_sec * scale, p95_sec)
+
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    """Mean and percentiles (nearest rank) of latencies, in milliseconds."""
+    if not latencies:
+        return {}
+    latencies = np.asarray(latencies) * 1000
+    summary = {"mean_ms": round(float(latencies.mean()), 1)}
+    for p in PERCENTILES:
+        summary[f"p{p}_ms"] = round(
+            float(np.percentile(latencies, p, method="inverted_cdf")), 1
+        )
+    return summary
+
+
+class _TimedCompleter(Completer):
+    """Records when the LLM request of the turn is made."""
+
+    def __init__(self, completer: Completer):
+        self.completer = completer
+        self.request_time: Union[float, None] = None
+
+    def complete_stream(self, prompt: str, **params) -> Iterator[str]:
+        self.request_time = time.perf_counter()
+        return self.completer.complete_stream(prompt, **params)
+
+
+def run_turn(
+    transcriber: FakeTranscriber,
+    completer: FakeCompleter,
+    synthesizer: Synthesizer,
+    turns: List[Dict],
+    prompt_text: str,
+    conversation: Conversation,
+    router: Union[IntentRouter, None] = None,
+    response_cache: Union[ResponseCache, None] = None,
+) -> Dict[str, float]:
+    """Run one turn, and return the duration of each stage in seconds."""
+    timings = {}
+    audio = np.zeros(int(UTTERANCE_SEC * AUDIO_RATE), dtype=np.int16)
+    source = ArraySource(audio, AUDIO_RATE)
+
+    # The user has finished talking once all their audio is sent
+    start = time.perf_counter()
+    user_text = " ".join(t.text for t in transcriber.transcribe(source))
+    timings["asr"] = time.perf_counter() - start
+    turns.append({"speaker": "user", "text": user_text})
+
+    def _synthesize(sentence: str, is_first: bool) -> bytes:
+        tts_start = time.perf_counter()
+        audio_bytes = synthesizer.synthesize(sentence)
+        if is_first:
+            now = time.perf_counter()
+            timings["tts_first_sentence"] = now - tts_start
+            timings["time_to_first_audio"] = now - start
+        return audio_bytes
+
+    reply_start = time.perf_counter()
+    timed_completer = _TimedCompleter(completer)
+    sentences = []
+    with ThreadPoolExecutor(max_workers=TTS_WORKERS) as executor:
+        futures = []
+        for sentence in chat_utils.chat_prompt_stream(
+            turns=turns,
+            user_name="User",
+            agent_name="Assistant",
+            prompt_text=prompt_text,
+            prompt_config=PROMPT_CONFIG,
+            oai_client=timed_completer,
+            response_cache=response_cache,
+            conversation=conversation,
+            router=router,
+        ):
+            if not sentences and timed_completer.request_time is not None:
+                llm_start = timed_completer.request_time
+                timings["prompt"] = llm_start - reply_start
+                timings["llm_first_sentence"] = time.perf_counter() - llm_start
+            sentences.append(sentence)
+            futures.append(executor.submit(_synthesize, sentence, not futures))
+        if timed_completer.request_time is not None:
+            timings["llm_total"] = time.perf_counter() - timed_completer.request_time
+        for future in futures:
+            future.result()
+    timings["turn_total"] = time.perf_counter() - start
+    turns.append({"speaker": "agent", "text": " ".join(sentences)})
+    return timings
+
+
+def run_session(
+    session_id: int,
+    num_turns: int,
+    prompt_text: str,
+    time_scale: float,
+    error_rate: float,
+    make_synthesizer,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+    router: Union[IntentRouter, None] = None,
+    response_cache: Union[ResponseCache, None] = None,
+) -> Dict:
+    """Run one simulated call.
+
+    Each session has its own (seeded) backends and Conversation. The router
+    and response cache are shared, like in the server.
+    """
+    transcriber = FakeTranscriber(
+        utterances=[
+            USER_UTTERANCES[i % len(USER_UTTERANCES)] for i in range(num_turns)
+        ],
+        endpointing_latency=_scaled(FAKE_ENDPOINTING_LATENCY, time_scale),
+        error_rate=error_rate,
+        seed=session_id,
+    )
+    completer = FakeCompleter(
+        first_token_latency=_scaled(FAKE_FIRST_TOKEN_LATENCY, time_scale),
+        token_sec=FAKE_TOKEN_SEC * time_scale,
+        error_rate=error_rate,
+        seed=session_id,
+    )
+    synthesizer = make_synthesizer(session_id)
+    conversation = Conversation(
+        prompt_text, "User", "Assistant", max_prompt_tokens=max_prompt_tokens
+    )
+    turns = []
+    timings, num_failed = [], 0
+    for _ in range(num_turns):
+        try:
+            timings.append(
+                run_turn(
+                    transcriber,
+                    completer,
+                    synthesizer,
+                    turns,
+                    prompt_text,
+                    conversation,
+                    router=router,
+                    response_cache=response_cache,
+                )
+            )
+        except Exception:
+            num_failed += 1
+    return {"timings": timings, "num_failed": num_failed}
+
+
+def run_benchmark(
+    num_sessions: int,
+    num_turns: int,
+    prompt_text: str,
+    time_scale: float = 1.0,
+    error_rate: float = 0.0,
+    make_synthesizer=None,
+    max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+    intents: bool = False,
+    response_cache: bool = False,
+) -> Dict:
+    """Run `num_sessions` concurrent sessions of `num_turns` turns each.
+
+    With `intents` and `response_cache`, the sessions share a fresh
+    IntentRouter and (in-memory) ResponseCache.
+
+    Returns:
+        Dict with per-stage latency summaries and throughput.
+    """
+    if make_synthesizer is None:
+        make_synthesizer = lambda session_id: FakeSynthesizer(
+            latency=_scaled(FAKE_SYNTHESIS_LATENCY, time_scale),
+            error_rate=error_rate,
+            seed=session_id,
+        )
+    router = IntentRouter(DEFAULT_INTENTS, seed=0) if intents else None
+    reply_cache = ResponseCache() if response_cache else None
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_sessions) as executor:
+        sessions = list(
+            executor.map(
+                lambda session_id: run_session(
+                    session_id,
+                    num_turns,
+                    prompt_text,
+                    time_scale,
+                    error_rate,
+                    make_synthesizer,
+                    max_prompt_tokens=max_prompt_tokens,
+                    router=router,
+                    response_cache=reply_cache,
+                ),
+                range(num_sessions),
+            )
+        )
+    elapsed_sec = time.perf_counter() - start
+
+    timings = [t for session in sessions for t in session["timings"]]
+    return {
+        "sessions": num_sessions,
+        "turns": len(timings),
+        "failed_turns": sum(session["num_failed"] for session in sessions),
+        "elapsed_sec": round(elapsed_sec, 3),
+        "throughput_turns_per_sec": round(len(timings) / elapsed_sec, 3),
+        "llm_turns": sum("llm_total" in t for t in timings),
+        "stages": {
+            stage: summarize([t[stage] for t in timings if stage in t])
+            for stage in STAGES
+        },
+    }
+
+
+def _git_commit() -> Union[str, None]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _print_result(result: Dict):
+    click.echo(
+        f"\n{result['sessions']} sessions: {result['turns']} turns "
+        f"({result['failed_turns']} failed) in {result['elapsed_sec']}s, "
+        f"{result['throughput_turns_per_sec']} turns/sec, "
+        f"{result['llm_turns']} went to the LLM"
+    )
+    columns = ["mean_ms"] + [f"p{p}_ms" for p in PERCENTILES]
+    click.echo(f"  {'stage':<22}" + "".join(f"{c:>10}" for c in columns))
+    for stage, summary in result["stages"].items():
+        values = [summary.get(c, "-") for c in columns]
+        click.echo(f"  {stage:<22}" + "".join(f"{v:>10}" for v in values))
+
+
+@click.command()
+@click.option(
+    "--sessions",
+    multiple=True,
+    type=int,
+    default=[1, 8, 32],
+    show_default=True,
+    help="Number of concurrent sessions. Can be repeated.",
+)
+@click.option("--turns", default=10, show_default=True, help="Turns per session.")
+@click.option(
+    "--time-scale",
+    default=1.0,
+    show_default=True,
+    help="Multiply all simulated latencies, e.g. 0.1 for a quick run.",
+)
+@click.option(
+    "--error-rate",
+    default=0.0,
+    show_default=True,
+    help="Fraction of requests to each backend that fail.",
+)
+@click.option(
+    "--tts",
+    type=click.Choice(["fake", "standin"]),
+    default="fake",
+    show_default=True,
+    help="In-process fake TTS, or the Google client against a local gRPC stand-in.",
+)
+@click.option(
+    "--max-prompt-tokens",
+    default=DEFAULT_MAX_PROMPT_TOKENS,
+    show_default=True,
+    help="Token budget of each session's prompt window.",
+)
+@click.option(
+    "--intents/--no-intents",
+    default=False,
+    show_default=True,
+    help="Route common turns to canned replies, see voicebots/intent_router.py.",
+)
+@click.option(
+    "--response-cache/--no-response-cache",
+    default=False,
+    show_default=True,
+    help="Share a response cache across sessions.",
+)
+@click.option("--prompt-file", default="examples/assistant.txt", show_default=True)
+@click.option("--output", help="Write the results to this JSON file.")
+def main(
+    sessions: List[int],
+    turns: int,
+    time_scale: float,
+    error_rate: float,
+    tts: str,
+    max_prompt_tokens: int,
+    intents: bool,
+    response_cache: bool,
+    prompt_file: str,
+    output: str,
+):
+    """Benchmark end-to-end turn latency against local stand-ins."""
+    _, prompt_text = chat_utils.get_prompt_text(prompt_file, "User", "Assistant")
+
+    server = None
+    make_synthesizer = None
+    if tts == "standin":
+        from benchmarks.grpc_standins import start_tts_standin
+
+        median_sec = FAKE_SYNTHESIS_LATENCY.median_sec * time_scale
+        server, address = start_tts_standin(
+            latency_sec=median_sec, max_workers=max(sessions) * TTS_WORKERS
+        )
+        google_clients.set_default_registry(
+            google_clients.GoogleClientRegistry(tts_endpoint=address, insecure=True)
+        )
+        make_synthesizer = lambda session_id: GoogleSynthesizer("en-GB-Neural2-D")
+
+    results = []
+    try:
+        for num_sessions in sessions:
+            result = run_benchmark(
+                num_sessions,
+                turns,
+                prompt_text,
+                time_scale=time_scale,
+                error_rate=error_rate,
+                make_synthesizer=make_synthesizer,
+                max_prompt_tokens=max_prompt_tokens,
+                intents=intents,
+                response_cache=response_cache,
+            )
+            _print_result(result)
+            results.append(result)
+    finally:
+        if server is not None:
+            server.stop(grace=None)
+
+    if output:
+        report = {
+            "benchmark": "turn_latency",
+            "commit": _git_commit(),
+            "timestamp": time.time(),
+            "config": {
+                "turns_per_session": turns,
+                "time_scale": time_scale,
+                "error_rate": error_rate,
+                "tts": tts,
+                "utterance_sec": UTTERANCE_SEC,
+                "max_prompt_tokens": max_prompt_tokens,
+                "intents": intents,
+                "response_cache": response_cache,
+            },
+            "results": results,
+        }
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        click.echo(f"\nWrote {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,49 @@
 """Voice bot CLI.
 
 Usage:
-    python -m cli --user-name Brendan --prompt-file chatbots/assistant.txt
+    python -m cli chat --user-name Brendan --prompt-file chatbots/assistant.txt
+    python -m cli prewarm --prompt-file chatbots/assistant.txt --user-name Brendan
+    python -m cli transcribe recordings/ --output transcripts.jsonl
 
 Say "exit" or "goodbye" to end the chat.
 """
+import dataclasses
+import json
+import queue
 import sys
+import threading
 import time
 import traceback
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, List
 
 import click
-import diskcache
 from prompt_toolkit import print_formatted_text as print
 
-from voicebots import audio_utils
+from examples.text2speech import LINES_TEXT
+from voicebots import audio_codecs, audio_utils
+from voicebots.asr import batch
 from voicebots.asr.google_transcriber import GoogleTranscriber
+from voicebots.backends import BACKENDS, get_backends, get_transcriber
+from voicebots.completion_cache import CachePolicy, CompletionCache
+from voicebots.conversation import Conversation, get_summarizer
+from voicebots.intent_router import DEFAULT_INTENTS, IntentRouter, load_intents
+from voicebots.phrase_matcher import PhraseMatcher
+from voicebots.response_cache import ResponseCache
 from voicebots.speech import google_speech
+from voicebots.speech.tts_cache import TTSCache
 from voicebots.settings import Settings
-from voicebots.oai_client import OAIClient
-from voicebots import chat_utils
+from voicebots import chat_utils, server, tracing
+from voicebots.speculation import SpeculativeResponder
+from voicebots.turn_engine import TurnEngine
 
 DEFAULT_VOICE_NAME = "en-IN-Wavenet-A"  # "en-GB-Neural2-C"
 DEFAULT_VOICE_NAME = "en-GB-Neural2-D"
 DEFAULT_GENDER = "male"
 POST_SPEECH_SLEEP_TIME_SEC = 0
+# Number of sentences to synthesize ahead of the one currently playing
+TTS_WORKERS = 2
 # List of common phrases we expect. Used to "prime" speech rec provider
 # and improve results
 SUPPORTED_PHRASES = []
@@ -50,44 +69,129 @@ def get_prompt_config(user_name: str, agent_name: str) -> Dict:
     return params
 
 
-def user_desires_call_end(text: str) -> bool:
-    # TODO(bfortuner): Replace with regex / fuzzy match
-    clean_text = (
-        text.strip().lower().replace(".", "").replace("?", "").replace("!", ".")
-    )
+# Utterances that are commands to end the call (allow deterministic exit)
+END_CALL_COMMANDS = PhraseMatcher(["exit", "end call"])
+# Phrases that end the call anywhere in an utterance. Tolerates ASR typos,
+# e.g. "goodby".
+END_CALL_PHRASES = PhraseMatcher(["goodbye", "good bye", "bye now"], max_edits=1)
+
 
-    # Direct commands (allow deterministic exit)
-    if clean_text in ["exit", "end call"]:
+def user_desires_call_end(text: str) -> bool:
+    if END_CALL_COMMANDS.fullmatch(text):
         return True
+    return END_CALL_PHRASES.search(text) is not None
 
-    end_call_phrases = [
-        "goodbye",
-        "good bye",
-        "bye now",
-    ]
-    for phrase in end_call_phrases:
-        if phrase in clean_text:
-            return True
-    return False
 
+def play_audio(audio_bytes: bytes, sink=None):
+    """Play WAV bytes, through the streaming sink if given. Blocks until played."""
+    with tracing.span("playback", bytes=len(audio_bytes)):
+        if sink is None:
+            audio_utils.play_audio_bytes(audio_bytes)
+        else:
+            sink.write_wav(audio_bytes)
+            sink.flush()
 
 
-def _get_transcriber():
-    return GoogleTranscriber(
-        supported_phrases=SUPPORTED_PHRASES, single_utterance=False
-    )
+def speak_text(
+    text: str,
+    synthesize: Callable[[str], bytes],
+    enable=True,
+    sink=None,
+):
+    if enable:
+        audio_bytes = synthesize(text)
+        play_audio(audio_bytes, sink=sink)
+        time.sleep(POST_SPEECH_SLEEP_TIME_SEC)
+
 
+def speak_streamed_audio(
+    sentences: Iterable[str], voice_name: str, sink: audio_utils.AudioSink
+) -> str:
+    """Speak sentences with streaming TTS, as they arrive.
+
+    Sentences are sent on one bidirectional TTS stream, and its audio is
+    played as soon as each chunk comes back. The voice must support
+    streaming, see `google_speech.stream_text_to_speech`.
+
+    Returns:
+        The full text that was spoken.
+    """
+    spoken = []
+
+    def _texts():
+        for sentence in sentences:
+            spoken.append(sentence)
+            yield sentence
+
+    audio_format = audio_utils.AudioFormat(rate=google_speech.STREAMING_SAMPLE_RATE)
+    with tracing.span("tts_stream", voice=voice_name):
+        chunks = google_speech.stream_text_to_speech(_texts(), voice_name)
+        sink.write_chunks(chunks, audio_format)
+    sink.flush()
+    return " ".join(spoken)
+
+
+def speak_sentences(
+    sentences: Iterable[str],
+    synthesize: Callable[[str], bytes],
+    enable=True,
+    sink=None,
+) -> str:
+    """Speak sentences as they arrive from a (streaming) iterable.
+
+    Each sentence is sent to TTS as soon as it arrives and played in order
+    on a background thread, so the first sentence starts playing while
+    later sentences are still being generated and synthesized. With a
+    streaming sink, sentences are queued back to back without reopening
+    the output device in between.
+
+    Returns:
+        The full text that was spoken.
+    """
+    spoken = []
+    audio_futures = queue.Queue()
+
+    def _play_audio():
+        while True:
+            future = audio_futures.get()
+            if future is None:
+                return
+            try:
+                audio_bytes = future.result()
+                if sink is None:
+                    play_audio(audio_bytes)
+                else:
+                    # Only measures queueing, playback continues in the background
+                    with tracing.span("playback", bytes=len(audio_bytes), queued=True):
+                        sink.write_wav(audio_bytes)
+            except Exception:
+                traceback.print_exc(file=sys.stdout)
 
-def speak_text(text=None, ssml=None, enable=True, voice=DEFAULT_VOICE_NAME):
+    player = threading.Thread(target=_play_audio, daemon=True)
+    player.start()
+    try:
+        with ThreadPoolExecutor(max_workers=TTS_WORKERS) as executor:
+            for sentence in sentences:
+                spoken.append(sentence)
+                if enable:
+                    audio_futures.put(executor.submit(synthesize, sentence))
+    finally:
+        audio_futures.put(None)
+        player.join()
+    if sink is not None:
+        sink.flush()
     if enable:
-        audio_bytes = google_speech.load_or_convert_text_to_speech(
-            text=text, ssml=ssml, voice_name=voice
-        )
-        audio_utils.play_audio_bytes(audio_bytes)
         time.sleep(POST_SPEECH_SLEEP_TIME_SEC)
+    return " ".join(spoken)
+
+
+@click.group()
+def cli():
+    """Voice bot CLI."""
+    pass
 
 
-@click.command()
+@cli.command()
 @click.option(
     "--prompt-file",
     default="chatbots/assistant.txt",
@@ -117,6 +221,80 @@ def speak_text(text=None, ssml=None, enable=True, voice=DEFAULT_VOICE_NAME):
     default="test_chat",
     help="Unique-ish name for the chat (allows loading/testing historical chat). Not required if chat_id is provided.",
 )
+@click.option(
+    "--speculate",
+    type=click.Choice(["off", "llm", "tts"]),
+    default="off",
+    help="Start the completion ('llm'), or the completion and speech synthesis ('tts'), on stable interim transcripts.",
+)
+@click.option(
+    "--response-cache/--no-response-cache",
+    default=False,
+    help="Reuse replies to common utterances (e.g. 'hi') in the same context, instead of calling the LLM.",
+)
+@click.option(
+    "--response-cache-threshold",
+    type=float,
+    help="With --response-cache, also reuse replies to utterances at least this similar (0-1).",
+)
+@click.option(
+    "--intents/--no-intents",
+    default=False,
+    help="Answer common turns (e.g. greetings, thanks, 'repeat that', goodbye) with canned replies, instead of calling the LLM.",
+)
+@click.option(
+    "--intents-file",
+    help="JSON file with the intents for --intents. Defaults to intent_router.DEFAULT_INTENTS.",
+)
+@click.option(
+    "--summarize-history/--no-summarize-history",
+    default=False,
+    help="Summarize turns trimmed from long chats with the LLM, instead of dropping them.",
+)
+@click.option(
+    "--continuous-asr/--no-continuous-asr",
+    default=False,
+    help="Keep the microphone and recognition stream open for the whole chat, so the start of the user's turn isn't clipped (use headphones, or the bot may hear itself).",
+)
+@click.option(
+    "--vad/--no-vad",
+    default=False,
+    help="Detect the end of the user's utterance locally, and only stream speech to the recognizer.",
+)
+@click.option(
+    "--duplex/--no-duplex",
+    default=False,
+    help="Keep listening while the agent speaks, so the user can interrupt (barge-in).",
+)
+@click.option(
+    "--stream/--no-stream",
+    default=False,
+    help="Stream the completion and speak each sentence as soon as it is generated.",
+)
+@click.option(
+    "--streaming-tts-voice",
+    help="With --stream, synthesize the reply on one streaming TTS request with this voice (e.g. en-US-Chirp3-HD-Charon), and play audio as it arrives. Live backend only.",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default="live",
+    help="Use the live ASR, TTS and LLM services, or local stand-ins with simulated latency ('fake').",
+)
+@click.option(
+    "--fake-error-rate",
+    default=0.0,
+    help="Fraction of requests that fail, with the fake backend.",
+)
+@click.option(
+    "--trace-file",
+    help="Append per-turn latency spans (ASR, LLM, TTS, playback) to this JSONL file.",
+)
+@click.option(
+    "--metrics-port",
+    type=int,
+    help="Serve Prometheus metrics of the latency spans at localhost:<port>/metrics.",
+)
 def chat(
     prompt_file: str,
     secrets_file: str,
@@ -124,18 +302,73 @@ def chat(
     agent_name: str,
     chat_id: str,
     chat_name: str,
+    stream: bool,
+    streaming_tts_voice: str,
+    duplex: bool,
+    speculate: str,
+    response_cache: bool,
+    response_cache_threshold: float,
+    intents: bool,
+    intents_file: str,
+    summarize_history: bool,
+    continuous_asr: bool,
+    vad: bool,
+    backend: str,
+    fake_error_rate: float,
+    trace_file: str,
+    metrics_port: int,
 ):
     """Run a chat session with the Agent."""
-    ctx = Settings.from_env_file(secrets_file)
-
-    listener = _get_transcriber()
+    ctx = Settings.from_env_file(
+        secrets_file,
+        backend=backend,
+        fake_error_rate=fake_error_rate,
+        trace_file=trace_file,
+        metrics_port=metrics_port,
+        response_cache_threshold=response_cache_threshold,
+        asr_continuous=continuous_asr,
+    )
+    if streaming_tts_voice and ctx.backend != "live":
+        raise click.UsageError("--streaming-tts-voice requires the live backend")
+    tracing.configure(jsonl_path=ctx.trace_file, metrics_port=ctx.metrics_port)
 
-    cache = diskcache.Cache(directory=ctx.disk_cache_dir)
-    oai_client = OAIClient(
-        ctx.openai_api_key,
-        organization_id=ctx.openai_org_id,
-        cache=cache,
+    cache = CompletionCache.open(
+        ctx.disk_cache_dir,
+        CachePolicy(
+            mode=ctx.llm_cache_mode,
+            ttl_sec=ctx.llm_cache_ttl_sec,
+            size_limit=ctx.llm_cache_size_limit,
+            max_temperature=ctx.llm_cache_max_temperature,
+        ),
+    )
+    tts_cache = TTSCache(
+        ctx.tts_cache_dir,
+        size_limit=ctx.tts_cache_size_limit,
+        memory_size_limit=ctx.tts_memory_cache_size_limit,
     )
+    reply_cache = None
+    if response_cache:
+        reply_cache = ResponseCache(
+            num_turns=ctx.response_cache_turns,
+            similarity_threshold=ctx.response_cache_threshold,
+            directory=ctx.response_cache_dir,
+        )
+    backends = get_backends(
+        ctx,
+        voice_name=DEFAULT_VOICE_NAME,
+        tts_cache=tts_cache,
+        llm_cache=cache,
+        supported_phrases=SUPPORTED_PHRASES,
+        vad=vad,
+    )
+    listener = backends.transcriber
+    synthesize = backends.synthesizer
+    oai_client = backends.completer
+    if ctx.backend == "fake":
+        # No audio device needed, e.g. capacity tests on a CI box
+        sink = audio_utils.NullAudioSink()
+    else:
+        sink = audio_utils.AudioSink()
     prompt_config = get_prompt_config(
         user_name=user_name, agent_name=agent_name
     )
@@ -156,14 +389,92 @@ def chat(
     else:
         chat_id = chat_utils.make_chat_id(chat_name)
         click.echo(f"Chat Id: {chat_id}")
-        speak_text(opening_line)
+        tracing.set_turn(f"{chat_id}:{len(turns)}")
+        speak_text(opening_line, synthesize, sink=sink)
         agent_text_fn(opening_line)
         turns.append({"speaker": "agent", "text": opening_line})
 
-    exit_loop = False
+    conversation = Conversation(
+        prompt_text,
+        user_name=user_name,
+        agent_name=agent_name,
+        max_prompt_tokens=ctx.max_prompt_tokens,
+        summarize=get_summarizer(oai_client) if summarize_history else None,
+    )
+    router = None
+    if intents:
+        router = IntentRouter(
+            load_intents(intents_file) if intents_file else DEFAULT_INTENTS,
+            user_name=user_name,
+            agent_name=agent_name,
+        )
+        # Synthesize the canned replies while the call gets going
+        threading.Thread(
+            target=router.prewarm, args=(synthesize,), daemon=True
+        ).start()
+
+    def should_end_call(user_text: str) -> bool:
+        # The user's turn has already been added
+        return user_desires_call_end(user_text) or (
+            router is not None and router.ends_call(turns)
+        )
+
+    if duplex:
+
+        def on_user_text(text: str):
+            # The engine has already added the user's turn
+            tracing.set_turn(f"{chat_id}:{len(turns) - 1}")
+            user_text_fn(text)
+
+        engine = TurnEngine(
+            transcriber=listener,
+            respond=lambda turns: chat_utils.chat_prompt_stream(
+                turns=turns,
+                user_name=user_name,
+                agent_name=agent_name,
+                prompt_text=prompt_text,
+                prompt_config=prompt_config,
+                oai_client=oai_client,
+                response_cache=reply_cache,
+                conversation=conversation,
+                router=router,
+            ),
+            synthesize=synthesize,
+            play=partial(play_audio, sink=sink),
+            stop_playback=sink.stop,
+            turns=turns,
+            should_end_call=should_end_call,
+            on_user_text=on_user_text,
+            on_agent_text=agent_text_fn,
+        )
+        if getattr(listener, "vad", None) is not None:
+            # Interrupt the agent as soon as the user starts talking
+            listener.vad.on_speech_start = engine.barge_in
+        engine.run()
+
+    speculator = None
+    if speculate != "off":
+        speculator = SpeculativeResponder(
+            complete=partial(
+                chat_utils.chat_complete,
+                user_name=user_name,
+                agent_name=agent_name,
+                prompt_text=prompt_text,
+                prompt_config=prompt_config,
+                oai_client=oai_client,
+                response_cache=reply_cache,
+                conversation=conversation,
+                router=router,
+            ),
+            synthesize=synthesize if speculate == "tts" else None,
+        )
+
+    # The turn engine runs the whole call, so skip the sequential loop
+    exit_loop = duplex
     while not exit_loop:
         # Begin transcribing microphone audio stream
         # TODO(bfortuner): Handle transcriber error (retry/backoff)
+        tracing.set_turn(f"{chat_id}:{len(turns)}")
         transcripts = listener.listen()
         for transcript in transcripts:
 
@@ -175,13 +486,49 @@ def chat(
             # Only a partial, continue
             user_text = transcript.text.strip()
             if not transcript.is_final or not user_text:
+                if speculator is not None:
+                    speculator.on_interim(turns, transcript)
                 continue
                 
             try:
                 user_text_fn(user_text)
                 turns.append({"speaker": "user", "text": user_text})
-                if user_desires_call_end(user_text):
+                if should_end_call(user_text):
                     exit_loop = True
+                    farewell = router.route(turns) if router is not None else None
+                    if farewell is not None:
+                        speak_text(farewell.text, synthesize, sink=sink)
+                        agent_text_fn(farewell.text)
+                        turns.append({"speaker": "agent", "text": farewell.text})
+                elif speculator is not None:
+                    result, audio_bytes = speculator.resolve(turns)
+                    agent_text = result["top_answer_text"].strip()
+                    if audio_bytes is not None:
+                        play_audio(audio_bytes, sink=sink)
+                    else:
+                        speak_text(agent_text, synthesize, sink=sink)
+                    agent_text_fn(agent_text)
+                    turns.append({"speaker": "agent", "text": agent_text})
+                elif stream:
+                    sentences = chat_utils.chat_prompt_stream(
+                        turns=turns,
+                        user_name=user_name,
+                        agent_name=agent_name,
+                        prompt_text=prompt_text,
+                        prompt_config=prompt_config,
+                        oai_client=oai_client,
+                        response_cache=reply_cache,
+                        conversation=conversation,
+                        router=router,
+                    )
+                    if streaming_tts_voice:
+                        agent_text = speak_streamed_audio(
+                            sentences, streaming_tts_voice, sink
+                        )
+                    else:
+                        agent_text = speak_sentences(sentences, synthesize, sink=sink)
+                    agent_text_fn(agent_text)
+                    turns.append({"speaker": "agent", "text": agent_text})
                 else:
                     agent_text = chat_utils.chat_prompt(
                         turns=turns,
@@ -190,14 +537,37 @@ def chat(
                         prompt_text=prompt_text,
                         prompt_config=prompt_config,
                         oai_client=oai_client,
+                        response_cache=reply_cache,
+                        conversation=conversation,
+                        router=router,
                     )
-                    speak_text(text=agent_text)
+                    speak_text(agent_text, synthesize, sink=sink)
                     agent_text_fn(agent_text)
                     turns.append({"speaker": "agent", "text": agent_text})
             except Exception as e:
                 click.echo(e)
                 traceback.print_exc(file=sys.stdout)
 
+    if speculator is not None:
+        speculator.close()
+        click.echo(
+            f"Speculation: {speculator.stats}, hit rate {speculator.stats.hit_rate:.0%}"
+        )
+
+    listener.close()
+    sink.close()
+    click.echo(f"TTS cache: {tts_cache.stats}")
+    click.echo(f"LLM cache: {cache.stats}, hit rate {cache.stats.hit_rate:.0%}")
+    if reply_cache is not None:
+        click.echo(
+            f"Response cache: {reply_cache.stats}, "
+            f"hit rate {reply_cache.stats.hit_rate:.0%}"
+        )
+    if router is not None:
+        click.echo(
+            f"Intent router: {router.stats}, hit rate {router.stats.hit_rate:.0%}"
+        )
+
     chat_utils.save_turns(
         chat_id=chat_id,
         turns=turns,
@@ -207,5 +577,297 @@ def chat(
     )
 
 
+def _read_phrases(phrases_file: str) -> List[str]:
+    with open(phrases_file) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+@cli.command()
+@click.option(
+    "--prompt-file",
+    multiple=True,
+    help="Prompt file whose opening line should be pre-synthesized. Can be repeated.",
+)
+@click.option(
+    "--phrases-file",
+    multiple=True,
+    help="Text file with one phrase per line (e.g. canned responses). Can be repeated.",
+)
+@click.option(
+    "--voice",
+    multiple=True,
+    default=[DEFAULT_VOICE_NAME],
+    show_default=True,
+    help="Voice to synthesize each phrase with. Can be repeated.",
+)
+@click.option(
+    "--user-name",
+    multiple=True,
+    default=["Human"],
+    help="User name(s) to fill into opening lines. Can be repeated.",
+)
+@click.option(
+    "--agent-name",
+    default="Assistant",
+    help="First name of agent.",
+)
+@click.option(
+    "--canned-lines/--no-canned-lines",
+    default=True,
+    help="Include the canned opening/closing lines from examples/text2speech.py.",
+)
+@click.option(
+    "--intents/--no-intents",
+    default=False,
+    help="Include the canned replies of the intent router (see chat --intents).",
+)
+@click.option(
+    "--intents-file",
+    help="JSON file with the intents for --intents. Defaults to intent_router.DEFAULT_INTENTS.",
+)
+@click.option(
+    "--workers",
+    default=google_speech.DEFAULT_PREWARM_WORKERS,
+    show_default=True,
+    help="Number of concurrent synthesis requests.",
+)
+@click.option(
+    "--secrets-file",
+    default=".env.secret",
+    help="Path to .env.secrets file with env variables"
+)
+def prewarm(
+    prompt_file: List[str],
+    phrases_file: List[str],
+    voice: List[str],
+    user_name: List[str],
+    agent_name: str,
+    canned_lines: bool,
+    intents: bool,
+    intents_file: str,
+    workers: int,
+    secrets_file: str,
+):
+    """Pre-synthesize known phrases into the TTS cache."""
+    ctx = Settings.from_env_file(secrets_file)
+
+    texts = []
+    for name in user_name:
+        for fpath in prompt_file:
+            opening_line, _ = chat_utils.get_prompt_text(
+                prompt_file=fpath, user_name=name, agent_name=agent_name
+            )
+            texts.append(opening_line)
+        if canned_lines:
+            texts.extend(
+                line.format(user_name=name, agent_name=agent_name)
+                for line in LINES_TEXT.values()
+            )
+        if intents:
+            router = IntentRouter(
+                load_intents(intents_file) if intents_file else DEFAULT_INTENTS,
+                user_name=name,
+                agent_name=agent_name,
+            )
+            texts.extend(router.static_responses())
+    for fpath in phrases_file:
+        texts.extend(_read_phrases(fpath))
+    # Dedupe, preserving order
+    texts = list(dict.fromkeys(texts))
+
+    tts_cache = TTSCache(
+        ctx.tts_cache_dir,
+        size_limit=ctx.tts_cache_size_limit,
+        memory_size_limit=ctx.tts_memory_cache_size_limit,
+    )
+    click.echo(f"Pre-synthesizing {len(texts)} phrases x {len(voice)} voices...")
+    report = google_speech.prewarm_text_to_speech(
+        texts,
+        voice_names=voice,
+        cache=tts_cache,
+        max_workers=workers,
+        # Same encoding as the synthesizer, see `get_backends`
+        encoding=google_speech.AudioEncoding[ctx.tts_encoding],
+    )
+    click.echo(
+        f"Synthesized {report.num_synthesized}, already cached {report.num_cached}, "
+        f"failed {report.num_failed} in {report.elapsed_sec}s "
+        f"({report.throughput:.1f} phrases/sec). "
+        f"Cache size: {report.cache_bytes / 2**20:.1f}MB"
+    )
+
+
+@cli.command()
+@click.argument("paths", nargs=-1, required=True)
+@click.option(
+    "--workers",
+    default=batch.DEFAULT_BATCH_WORKERS,
+    show_default=True,
+    help="Number of files transcribed at once.",
+)
+@click.option(
+    "--output",
+    help="Write one JSON result per file to this .jsonl file.",
+)
+@click.option(
+    "--encoding",
+    type=click.Choice(audio_codecs.ASR_CODECS),
+    default="linear16",
+    show_default=True,
+    help="Compress the audio before uploading it (flac, ogg_opus). Requires ffmpeg.",
+)
+def transcribe(paths: List[str], workers: int, output: str, encoding: str):
+    """Transcribe WAV files, or directories of WAV files."""
+    transcriber = GoogleTranscriber(
+        supported_phrases=SUPPORTED_PHRASES, encoding=encoding
+    )
+    report = batch.transcribe_files(paths, transcriber, max_workers=workers)
+    for result in report.results:
+        if result.error is not None:
+            click.echo(f"{result.path}: ERROR {result.error}")
+        else:
+            click.echo(f"{result.path} (RTF {result.rtf:.2f}): {result.text}")
+    if output:
+        with open(output, "w") as f:
+            for result in report.results:
+                f.write(json.dumps(dataclasses.asdict(result)) + "\n")
+    click.echo(
+        f"Transcribed {len(report.results)} files ({report.audio_sec:.1f}s of audio), "
+        f"failed {report.num_failed} in {report.elapsed_sec}s. "
+        f"Batch RTF {report.rtf:.3f}, mean file RTF {report.mean_file_rtf:.3f}"
+    )
+
+
+@cli.command()
+@click.option(
+    "--prompt-file",
+    default="examples/assistant.txt",
+    show_default=True,
+    help="Path to file containing prompt text.",
+)
+@click.option(
+    "--secrets-file",
+    default=".env.secret",
+    help="Path to .env.secrets file with env variables",
+)
+@click.option("--user-name", default="User", help="Name of callers in the prompt.")
+@click.option("--agent-name", default="Assistant", help="First name of agent.")
+@click.option("--host", default="localhost", show_default=True)
+@click.option("--port", default=server.DEFAULT_PORT, show_default=True)
+@click.option(
+    "--max-sessions",
+    default=server.DEFAULT_MAX_SESSIONS,
+    show_default=True,
+    help="Callers beyond this are turned away.",
+)
+@click.option(
+    "--backend",
+    type=click.Choice(BACKENDS),
+    default="live",
+    help="Use the live ASR, TTS and LLM services, or local stand-ins with simulated latency ('fake').",
+)
+@click.option(
+    "--fake-error-rate",
+    default=0.0,
+    help="Fraction of requests that fail, with the fake backend.",
+)
+@click.option(
+    "--response-cache/--no-response-cache",
+    default=False,
+    help="Reuse replies to common utterances (e.g. 'hi') in the same context, instead of calling the LLM.",
+)
+@click.option(
+    "--intents/--no-intents",
+    default=False,
+    help="Answer common turns (e.g. greetings, thanks, 'repeat that', goodbye) with canned replies, instead of calling the LLM.",
+)
+@click.option(
+    "--intents-file",
+    help="JSON file with the intents for --intents. Defaults to intent_router.DEFAULT_INTENTS.",
+)
+def serve(
+    prompt_file: str,
+    secrets_file: str,
+    user_name: str,
+    agent_name: str,
+    host: str,
+    port: int,
+    max_sessions: int,
+    backend: str,
+    fake_error_rate: float,
+    response_cache: bool,
+    intents: bool,
+    intents_file: str,
+):
+    """Serve the voice loop to many callers over WebSocket."""
+    ctx = Settings.from_env_file(
+        secrets_file, backend=backend, fake_error_rate=fake_error_rate
+    )
+    cache = CompletionCache.open(
+        ctx.disk_cache_dir,
+        CachePolicy(
+            mode=ctx.llm_cache_mode,
+            ttl_sec=ctx.llm_cache_ttl_sec,
+            size_limit=ctx.llm_cache_size_limit,
+            max_temperature=ctx.llm_cache_max_temperature,
+        ),
+    )
+    tts_cache = TTSCache(
+        ctx.tts_cache_dir,
+        size_limit=ctx.tts_cache_size_limit,
+        memory_size_limit=ctx.tts_memory_cache_size_limit,
+    )
+    backends = get_backends(
+        ctx,
+        voice_name=DEFAULT_VOICE_NAME,
+        tts_cache=tts_cache,
+        llm_cache=cache,
+    )
+    opening_line, prompt_text = chat_utils.get_prompt_text(
+        prompt_file=prompt_file, user_name=user_name, agent_name=agent_name
+    )
+    voice_server = server.VoiceServer(
+        make_transcriber=partial(
+            get_transcriber, ctx, supported_phrases=SUPPORTED_PHRASES
+        ),
+        synthesizer=backends.synthesizer,
+        completer=backends.completer,
+        prompt_text=prompt_text,
+        opening_line=opening_line,
+        prompt_config=get_prompt_config(user_name=user_name, agent_name=agent_name),
+        user_name=user_name,
+        agent_name=agent_name,
+        should_end_call=user_desires_call_end,
+        response_cache=(
+            ResponseCache(
+                num_turns=ctx.response_cache_turns,
+                similarity_threshold=ctx.response_cache_threshold,
+                directory=ctx.response_cache_dir,
+            )
+            if response_cache
+            else None
+        ),
+        router=(
+            IntentRouter(
+                load_intents(intents_file) if intents_file else DEFAULT_INTENTS,
+                user_name=user_name,
+                agent_name=agent_name,
+            )
+            if intents
+            else None
+        ),
+        max_prompt_tokens=ctx.max_prompt_tokens,
+        max_sessions=max_sessions,
+    )
+    server.run_server(voice_server, host=host, port=port)
+    click.echo(f"Served {voice_server.stats}")
+    click.echo(f"TTS cache: {tts_cache.stats}")
+    click.echo(f"LLM cache: {cache.stats}, hit rate {cache.stats.hit_rate:.0%}")
+    click.echo(f"TTS requests coalesced: {google_speech.get_synthesis_coalesce_stats()}")
+    llm_coalesce_stats = getattr(backends.completer, "coalesce_stats", None)
+    if llm_coalesce_stats is not None:
+        click.echo(f"LLM requests coalesced: {llm_coalesce_stats}")
+
+
 if __name__ == "__main__":
-    chat()
+    cli()
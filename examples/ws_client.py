@@ -0,0 +1,100 @@
+"""Example caller for the WebSocket voice server.
+
+Sends each WAV file as one utterance, and prints the agent's replies. With
+no WAV files, sends a few utterances of silence, which is enough to drive
+the fake backend.
+
+python -m cli serve --backend fake
+python -m examples.ws_client --wav-file hello.wav --output-dir /tmp/replies
+"""
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+import aiohttp
+import click
+import numpy as np
+
+from voicebots.asr.audio_sources import ArraySource, WavFileSource
+
+SILENCE_SEC = 1.0
+RATE = 16000
+
+
+async def call(url: str, wav_files: List[str], turns: int, output_dir: str):
+    sources = [WavFileSource(path) for path in wav_files] or [
+        ArraySource(np.zeros(int(SILENCE_SEC * RATE), dtype=np.int16), RATE)
+        for _ in range(turns)
+    ]
+    async with aiohttp.ClientSession() as session:
+        async with session.ws_connect(f"{url}?rate={sources[0].rate}") as ws:
+            # The opening line, then one reply per utterance
+            start = None
+            for i in range(len(sources) + 1):
+                if i > 0:
+                    for chunk in sources[i - 1].chunks():
+                        await ws.send_bytes(bytes(chunk))
+                    await ws.send_json({"type": "end_of_utterance"})
+                    start = time.perf_counter()
+                if not await _receive_reply(ws, i, output_dir, start):
+                    return
+            await ws.send_json({"type": "hangup"})
+
+
+async def _receive_reply(ws, turn: int, output_dir: str, start) -> bool:
+    """Print one reply. Returns False if the call ended."""
+    num_sentences = 0
+    async for message in ws:
+        if message.type == aiohttp.WSMsgType.BINARY:
+            if num_sentences == 1 and start is not None:
+                click.echo(
+                    f"  (first audio after {time.perf_counter() - start:.3f}s)"
+                )
+            if output_dir:
+                path = os.path.join(output_dir, f"turn{turn}_{num_sentences}.wav")
+                with open(path, "wb") as f:
+                    f.write(message.data)
+            continue
+        if message.type != aiohttp.WSMsgType.TEXT:
+            return False
+        event = json.loads(message.data)
+        if event["type"] == "transcript":
+            click.echo(f"User: {event['text']}")
+        elif event["type"] == "agent_text":
+            num_sentences += 1
+            click.echo(f"Agent: {event['text']}")
+        elif event["type"] == "agent_done":
+            return True
+        elif event["type"] == "error":
+            click.echo(f"Error: {event['message']}")
+            return True
+        elif event["type"] == "end_call":
+            return False
+    return False
+
+
+@click.command()
+@click.option("--url", default="ws://localhost:8765/ws", show_default=True)
+@click.option(
+    "--wav-file",
+    multiple=True,
+    help="16-bit WAV file to send as one utterance. Can be repeated.",
+)
+@click.option(
+    "--turns",
+    default=3,
+    show_default=True,
+    help="Utterances of silence to send, if no WAV files are given.",
+)
+@click.option("--output-dir", help="Save the agent's audio to this directory.")
+def main(url: str, wav_file: List[str], turns: int, output_dir: str):
+    """Call the voice server."""
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    asyncio.run(call(url, list(wav_file), turns, output_dir))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import threading
+from typing import Dict, List
+
+from voicebots.conversation import TRIM_TARGET, Conversation, render_turn
+
+PROMPT = "Chat with {user_name}.\n\n{transcript}\n{agent_name}:"
+
+
+def count_words(text: str) -> int:
+    return len(text.split())
+
+
+def make_turns(num_turns: int) -> List[Dict]:
+    speakers = ["user", "agent"]
+    return [
+        {"speaker": speakers[i % 2], "text": f"turn {i} has some words in it"}
+        for i in range(num_turns)
+    ]
+
+
+def expected_prompt(conversation: Conversation, turns: List[Dict]) -> str:
+    lines = [render_turn(turn) for turn in turns[conversation.num_dropped_turns :]]
+    if conversation.summary:
+        lines.insert(0, f"(Summary of the conversation so far: {conversation.summary})")
+    return PROMPT.format(transcript="\n".join(lines), user_name="User", agent_name="Bot")
+
+
+def test_same_prompt_as_full_render_within_budget():
+    conversation = Conversation(PROMPT, "User", "Bot", 10000, count_tokens=count_words)
+    turns = []
+    for turn in make_turns(10):
+        turns.append(turn)
+        prompt = conversation.build_prompt(turns)
+        assert prompt == expected_prompt(conversation, turns)
+    assert conversation.num_dropped_turns == 0
+    assert conversation.num_tokens == count_words(prompt) + len(turns)
+
+
+def test_trims_oldest_turns_within_budget():
+    max_tokens = 100
+    conversation = Conversation(PROMPT, "User", "Bot", max_tokens, count_words)
+    turns = []
+    dropped = [0]
+    for turn in make_turns(50):
+        turns.append(turn)
+        prompt = conversation.build_prompt(turns)
+        assert prompt == expected_prompt(conversation, turns)
+        assert conversation.num_tokens <= max_tokens
+        assert render_turn(turn) in prompt
+        dropped.append(conversation.num_dropped_turns)
+    assert dropped == sorted(dropped)
+    # Trimmed to the target, so the window start moves every few turns
+    assert 1 < len(set(dropped)) < 50 / 2
+    assert conversation.num_tokens > max_tokens * TRIM_TARGET / 2
+
+
+def test_keeps_last_turn_over_budget():
+    conversation = Conversation(PROMPT, "User", "Bot", 10, count_words)
+    turns = make_turns(3)
+    turns[-1] = {"speaker": "user", "text": "word " * 50}
+    prompt = conversation.build_prompt(turns)
+    assert conversation.num_dropped_turns == 2
+    assert prompt == expected_prompt(conversation, turns)
+
+
+def test_rerenders_changed_turns():
+    conversation = Conversation(PROMPT, "User", "Bot", 100, count_words)
+    turns = make_turns(30)
+    conversation.build_prompt(turns)
+    start = conversation.num_dropped_turns
+    assert start > 0
+
+    # E.g. the final transcript after a speculative prompt for an interim one
+    turns[-1] = {"speaker": "user", "text": "the final transcript"}
+    assert conversation.build_prompt(turns) == expected_prompt(conversation, turns)
+    # A turn inside the window changed, and the turns after it were removed
+    turns = turns[: start + 2]
+    turns[start + 1] = {"speaker": "agent", "text": "edited"}
+    assert conversation.build_prompt(turns) == expected_prompt(conversation, turns)
+    assert conversation.num_dropped_turns == start
+
+
+def test_resets_window_when_dropped_turns_change():
+    conversation = Conversation(PROMPT, "User", "Bot", 100, count_words)
+    turns = make_turns(30)
+    conversation.build_prompt(turns)
+    assert conversation.num_dropped_turns > 0
+
+    turns = [{"speaker": "user", "text": "a new chat"}]
+    prompt = conversation.build_prompt(turns)
+    assert conversation.num_dropped_turns == 0
+    assert prompt == expected_prompt(conversation, turns)
+
+
+def test_summarizes_dropped_turns_in_background():
+    calls = []
+    release = threading.Event()
+
+    def summarize(summary: str, turns: List[Dict]) -> str:
+        release.wait(5)
+        calls.append((summary, [turn["text"] for turn in turns]))
+        return f"summary {len(calls)}"
+
+    conversation = Conversation(PROMPT, "User", "Bot", 100, count_words, summarize)
+    turns = make_turns(30)
+    # Doesn't wait for the summary
+    prompt = conversation.build_prompt(turns)
+    assert "Summary" not in prompt
+    start = conversation.num_dropped_turns
+
+    release.set()
+    conversation.wait_for_summary(timeout=5)
+    assert conversation.summary == "summary 1"
+    assert calls == [("", [turn["text"] for turn in turns[:start]])]
+    prompt = conversation.build_prompt(turns)
+    assert prompt == expected_prompt(conversation, turns)
+    assert "summary 1" in prompt
+    assert conversation.num_tokens <= 100
+
+
+def test_summary_failure_drops_turns():
+    def summarize(summary: str, turns: List[Dict]) -> str:
+        raise RuntimeError("LLM is down")
+
+    conversation = Conversation(PROMPT, "User", "Bot", 100, count_words, summarize)
+    turns = make_turns(30)
+    conversation.build_prompt(turns)
+    conversation.wait_for_summary(timeout=5)
+    assert conversation.summary == ""
+    assert conversation.build_prompt(turns) == expected_prompt(conversation, turns)
@@ -0,0 +1,114 @@
+import random
+from typing import List, Union
+
+import pytest
+
+from voicebots.phrase_matcher import MIN_FUZZY_TOKEN_CHARS, PhraseMatcher, tokenize
+
+# Few, overlapping words, so random phrases share prefixes and suffixes
+WORDS = ["a", "go", "end", "call", "stop", "bye", "good", "goodbye", "that"]
+# Transcript words, including some within one edit of a phrase word
+NOISY_WORDS = WORDS + ["cal", "calls", "stpo", "goodby", "thta", "en", "xyz"]
+
+
+def within_one_edit(a: str, b: str) -> bool:
+    """One insertion, deletion, substitution or adjacent transposition."""
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        i, j = diffs[0], diffs[-1]
+        return len(diffs) == 2 and j == i + 1 and a[i] == b[j] and a[j] == b[i]
+    shorter, longer = sorted([a, b], key=len)
+    return any(longer[:i] + longer[i + 1 :] == shorter for i in range(len(longer)))
+
+
+def canonical_tokens(text: str, vocab: List[str], max_edits: int) -> List[str]:
+    tokens = []
+    for token in tokenize(text):
+        if token not in vocab and max_edits and len(token) >= MIN_FUZZY_TOKEN_CHARS:
+            close = [
+                word
+                for word in vocab
+                if len(word) >= MIN_FUZZY_TOKEN_CHARS and within_one_edit(token, word)
+            ]
+            token = min(close) if close else token
+        tokens.append(token)
+    return tokens
+
+
+class BruteForceMatcher:
+    """Compares every phrase at every position."""
+
+    def __init__(self, phrases: List[str], max_edits: int):
+        self.max_edits = max_edits
+        # First of duplicate phrases, as tokens
+        self.phrases = {}
+        for phrase in phrases:
+            tokens = tuple(tokenize(phrase))
+            if tokens and tokens not in self.phrases:
+                self.phrases[tokens] = phrase
+        self.vocab = sorted({token for tokens in self.phrases for token in tokens})
+
+    def fullmatch(self, text: str) -> Union[str, None]:
+        tokens = tuple(canonical_tokens(text, self.vocab, self.max_edits))
+        return self.phrases.get(tokens)
+
+    def findall(self, text: str) -> List[str]:
+        tokens = canonical_tokens(text, self.vocab, self.max_edits)
+        found = []
+        for end in range(1, len(tokens) + 1):
+            # Longest first among the phrases that end here
+            for length in range(end, 0, -1):
+                phrase = self.phrases.get(tuple(tokens[end - length : end]))
+                if phrase is not None:
+                    found.append(phrase)
+        return found
+
+
+def random_text(rng: random.Random, words: List[str], max_words: int) -> str:
+    return " ".join(rng.choice(words) for _ in range(rng.randint(0, max_words)))
+
+
+@pytest.mark.parametrize("max_edits", [0, 1])
+def test_matches_brute_force(max_edits):
+    rng = random.Random(max_edits)
+    for _ in range(200):
+        phrases = [
+            random_text(rng, WORDS, 3) for _ in range(rng.randint(1, 8))
+        ]
+        matcher = PhraseMatcher(phrases, max_edits=max_edits)
+        expected = BruteForceMatcher(phrases, max_edits)
+        for _ in range(20):
+            text = random_text(rng, NOISY_WORDS, 8)
+            found = expected.findall(text)
+            assert matcher.findall(text) == found, (phrases, text)
+            assert matcher.search(text) == (found[0] if found else None)
+            assert matcher.fullmatch(text) == expected.fullmatch(text), (phrases, text)
+        for phrase in phrases:
+            assert matcher.fullmatch(phrase) == expected.fullmatch(phrase)
+
+
+def test_normalizes_text():
+    matcher = PhraseMatcher(["End call", "don't stop"])
+    assert matcher.fullmatch("  end CALL. ") == "End call"
+    assert matcher.search("Please, dont stop!") == "don't stop"
+    assert matcher.fullmatch("end call now") is None
+
+
+def test_fuzzy_tokens():
+    matcher = PhraseMatcher(["goodbye", "end call"], max_edits=1)
+    assert matcher.fullmatch("goodby") == "goodbye"
+    assert matcher.fullmatch("end calll") == "end call"
+    # Short tokens are only matched exactly
+    assert matcher.fullmatch("and call") is None
+    assert PhraseMatcher(["goodbye"]).fullmatch("goodby") is None
+
+
+def test_rejects_max_edits():
+    with pytest.raises(ValueError):
+        PhraseMatcher(["goodbye"], max_edits=2)
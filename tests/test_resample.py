@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from voicebots.asr.resample import Resampler
+
+RATES = [(44100, 16000), (48000, 16000), (16000, 24000), (22050, 16000)]
+
+
+def random_pcm(num_samples: int, seed: int = 0) -> bytes:
+    rng = np.random.default_rng(seed)
+    return rng.integers(-20000, 20000, num_samples, dtype=np.int16).tobytes()
+
+
+def tone(freq: float, rate: int, seconds: float, amplitude: float = 10000) -> bytes:
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16).tobytes()
+
+
+def rms(pcm: bytes) -> float:
+    samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float64)
+    return float(np.sqrt(np.mean(samples**2)))
+
+
+@pytest.mark.parametrize("in_rate,out_rate", RATES)
+def test_chunked_matches_whole_signal(in_rate, out_rate):
+    pcm = random_pcm(in_rate // 2)
+    whole = Resampler(in_rate, out_rate).resample(pcm)
+
+    rng = np.random.default_rng(1)
+    resampler = Resampler(in_rate, out_rate)
+    chunks, start = [], 0
+    while start < len(pcm):
+        # Random chunk sizes, including single samples, in whole samples
+        end = start + 2 * int(rng.integers(1, 2000))
+        chunks.append(pcm[start:end])
+        start = end
+    assert b"".join(resampler.resample_stream(chunks)) == whole
+
+
+@pytest.mark.parametrize("in_rate,out_rate", RATES)
+def test_output_length(in_rate, out_rate):
+    num_samples = in_rate  # One second
+    resampled = Resampler(in_rate, out_rate).resample(random_pcm(num_samples))
+    assert len(resampled) // 2 == out_rate
+
+
+def test_reset():
+    resampler = Resampler(44100, 16000)
+    first = resampler.resample(random_pcm(4410, seed=2))
+    resampler.resample(random_pcm(4410, seed=3))
+    resampler.reset()
+    assert resampler.resample(random_pcm(4410, seed=2)) == first
+
+
+def test_same_rate_is_passthrough():
+    pcm = random_pcm(1000)
+    assert Resampler(16000, 16000).resample(pcm) == pcm
+
+
+def test_keeps_speech_band_and_filters_aliases():
+    resampler = Resampler(44100, 16000)
+    # Skip the filter's warm-up
+    passband = resampler.resample(tone(1000, 44100, 1.0))[2000:]
+    assert rms(passband) == pytest.approx(rms(tone(1000, 44100, 1.0)), rel=0.02)
+
+    resampler.reset()
+    # Above the output Nyquist frequency, would alias to 4kHz
+    stopband = resampler.resample(tone(12000, 44100, 1.0))[2000:]
+    assert rms(stopband) < rms(tone(12000, 44100, 1.0)) / 100
@@ -0,0 +1,100 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from voicebots.single_flight import SingleFlight
+
+NUM_CALLERS = 4
+
+
+def test_coalesces_concurrent_calls():
+    flights = SingleFlight()
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def fn(x):
+        calls.append(x)
+        started.set()
+        release.wait(5)
+        return x * 2
+
+    with ThreadPoolExecutor(NUM_CALLERS) as executor:
+        leader = executor.submit(flights.do, "key", fn, 21)
+        started.wait(5)
+        followers = [
+            executor.submit(flights.do, "key", fn, 21) for _ in range(NUM_CALLERS - 1)
+        ]
+        while flights.stats.calls < NUM_CALLERS:
+            time.sleep(0.001)
+        release.set()
+        results = [leader.result()] + [f.result() for f in followers]
+
+    assert results == [42] * NUM_CALLERS
+    assert calls == [21]
+    assert flights.stats.coalesced == NUM_CALLERS - 1
+    # Forgotten once done
+    assert flights.do("key", fn, 1) == 2
+
+
+def test_shares_exception():
+    flights = SingleFlight()
+    with pytest.raises(ValueError):
+        flights.do("key", int, "not a number")
+    assert flights.do("key", int, "7") == 7
+
+
+def test_stream_replays_items_to_late_callers():
+    flights = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def fn(n):
+        calls.append(n)
+        yield 0
+        release.wait(5)
+        yield from range(1, n)
+
+    first = flights.do_stream("key", fn, 5)
+    assert next(first) == 0
+    second = flights.do_stream("key", fn, 5)
+    release.set()
+    assert list(first) == [1, 2, 3, 4]
+    assert list(second) == [0, 1, 2, 3, 4]
+    assert calls == [5]
+    assert flights.stats.coalesced == 1
+
+
+def test_stream_raises_error():
+    flights = SingleFlight()
+
+    def fn():
+        yield 1
+        raise RuntimeError("stream broke")
+
+    items = []
+    with pytest.raises(RuntimeError):
+        for item in flights.do_stream("key", fn):
+            items.append(item)
+    assert items == [1]
+
+
+def test_stream_stops_when_abandoned():
+    flights = SingleFlight()
+    closed = threading.Event()
+
+    def fn():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    stream = flights.do_stream("key", fn)
+    assert next(stream) == 0
+    stream.close()
+    assert closed.wait(5)
@@ -0,0 +1,247 @@
+"""Audio sources for transcribers.
+
+A transcriber reads 16-bit mono PCM from an AudioSource, so the same code
+path transcribes the live microphone, pre-recorded WAV files (e.g. call
+recordings), in-memory arrays (e.g. regression tests without a mic), or
+audio pushed from the network (e.g. WebSocket callers).
+
+Usage:
+    transcriber = GoogleTranscriber()
+    for transcript in transcriber.transcribe(WavFileSource("call.wav")):
+        print(transcript.text)
+"""
+import queue
+import time
+import wave
+from typing import Iterator, Union
+
+import numpy as np
+
+SAMPLE_WIDTH = 2  # 16 bit
+
+# Length of each chunk read from files and arrays
+CHUNK_MS = 100
+
+
+class AudioSource:
+    """Base class for all audio sources.
+
+    Sources are context managers. Live sources (e.g. the microphone) capture
+    audio while open, and `chunks()` ends once the source is closed.
+
+    Attributes:
+        rate (int): Sample rate of the audio.
+        name (str): Used for logging and reports, e.g. the file path.
+    """
+
+    rate: int
+    name: str = ""
+
+    @property
+    def duration_sec(self) -> Union[float, None]:
+        """Length of the audio, or None if unknown (e.g. live audio)."""
+        return None
+
+    def open(self) -> "AudioSource":
+        return self
+
+    def close(self):
+        pass
+
+    def chunks(self) -> Iterator[bytes]:
+        """Yield 16-bit mono PCM chunks until the audio ends.
+
+        Chunks may be memoryviews over a reused buffer. Copy them to keep them.
+        """
+        raise NotImplementedError
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+
+class MicrophoneSource(AudioSource):
+    """Live audio from the default input device."""
+
+    def __init__(self, rate: int, chunk: Union[int, None] = None):
+        """Instantiate the MicrophoneSource.
+
+        Args:
+            rate: Sample rate to capture at.
+            chunk: Optional; Frames per chunk. Defaults to 100ms.
+        """
+        self.rate = rate
+        self.chunk = chunk or int(rate * CHUNK_MS / 1000)
+        self.name = "microphone"
+        self._stream = None
+
+    def open(self) -> "MicrophoneSource":
+        # Imported here so file and array sources work without pyaudio,
+        # e.g. batch transcription on a server.
+        from voicebots.microphone import MicrophoneStream
+
+        self._stream = MicrophoneStream(rate=self.rate, chunk=self.chunk)
+        self._stream.open_stream()
+        return self
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.close_stream()
+            self._stream = None
+
+    def chunks(self) -> Iterator[bytes]:
+        if self._stream is None:
+            raise RuntimeError("MicrophoneSource must be opened before reading")
+        yield from self._stream.generator()
+
+
+class ArraySource(AudioSource):
+    """In-memory audio, e.g. synthesized speech or test fixtures."""
+
+    def __init__(
+        self,
+        samples: Union[np.ndarray, bytes],
+        rate: int,
+        chunk_ms: int = CHUNK_MS,
+        realtime: bool = False,
+        name: str = "array",
+    ):
+        """Instantiate the ArraySource.
+
+        Args:
+            samples: int16 PCM bytes, an int16 array, or a float array in [-1, 1].
+                2D arrays of shape (num_samples, channels) are mixed down to mono.
+            rate: Sample rate of the audio.
+            chunk_ms: Optional; Length of each chunk.
+            realtime: Optional; Yield chunks no faster than real time, like a microphone.
+            name: Optional; Used for logging and reports.
+        """
+        self.samples = _to_int16_mono(samples)
+        self.rate = rate
+        self.chunk_ms = chunk_ms
+        self.realtime = realtime
+        self.name = name
+
+    @property
+    def duration_sec(self) -> float:
+        return len(self.samples) / self.rate
+
+    def chunks(self) -> Iterator[bytes]:
+        chunk = int(self.rate * self.chunk_ms / 1000)
+        pcm = memoryview(self.samples.tobytes())
+        pacer = _Pacer(self.realtime)
+        for start in range(0, len(self.samples), chunk):
+            data = pcm[start * SAMPLE_WIDTH : (start + chunk) * SAMPLE_WIDTH]
+            pacer.pace(len(data) / SAMPLE_WIDTH / self.rate)
+            yield data
+
+
+class WavFileSource(AudioSource):
+    """Audio streamed from a 16-bit PCM WAV file."""
+
+    def __init__(self, path: str, chunk_ms: int = CHUNK_MS, realtime: bool = False):
+        """Instantiate the WavFileSource.
+
+        Args:
+            path: Path to the WAV file. Multi-channel audio is mixed down to mono.
+            chunk_ms: Optional; Length of each chunk.
+            realtime: Optional; Yield chunks no faster than real time, like a microphone.
+        """
+        self.path = str(path)
+        self.name = self.path
+        self.chunk_ms = chunk_ms
+        self.realtime = realtime
+        with wave.open(self.path, "rb") as f:
+            if f.getsampwidth() != SAMPLE_WIDTH:
+                raise ValueError(
+                    f"Only 16-bit WAV files are supported: {path}"
+                )
+            self.rate = f.getframerate()
+            self.channels = f.getnchannels()
+            self.num_frames = f.getnframes()
+
+    @property
+    def duration_sec(self) -> float:
+        return self.num_frames / self.rate
+
+    def chunks(self) -> Iterator[bytes]:
+        chunk = int(self.rate * self.chunk_ms / 1000)
+        pacer = _Pacer(self.realtime)
+        with wave.open(self.path, "rb") as f:
+            while True:
+                data = f.readframes(chunk)
+                if not data:
+                    return
+                if self.channels > 1:
+                    samples = np.frombuffer(data, dtype=np.int16)
+                    samples = samples.reshape(-1, self.channels)
+                    data = _to_int16_mono(samples).tobytes()
+                pacer.pace(len(data) / SAMPLE_WIDTH / self.rate)
+                yield data
+
+
+class QueueSource(AudioSource):
+    """Live audio pushed by another thread, e.g. frames from a network caller.
+
+    `write()` audio as it arrives, and `close()` at the end of the audio,
+    which ends `chunks()` once the queued audio has been read.
+    """
+
+    def __init__(self, rate: int, name: str = "queue"):
+        """Instantiate the QueueSource.
+
+        Args:
+            rate: Sample rate of the audio.
+            name: Optional; Used for logging and reports.
+        """
+        self.rate = rate
+        self.name = name
+        self._queue: "queue.Queue[Union[bytes, None]]" = queue.Queue()
+        self._closed = False
+
+    def write(self, data: bytes):
+        """Add 16-bit mono PCM audio. Ignored once the source is closed."""
+        if not self._closed and data:
+            self._queue.put(bytes(data))
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+
+    def chunks(self) -> Iterator[bytes]:
+        while True:
+            data = self._queue.get()
+            if data is None:
+                return
+            yield data
+
+
+def _to_int16_mono(samples: Union[np.ndarray, bytes]) -> np.ndarray:
+    if isinstance(samples, (bytes, bytearray, memoryview)):
+        return np.frombuffer(samples, dtype=np.int16)
+    samples = np.asarray(samples)
+    if samples.dtype.kind == "f":
+        samples = samples * 32767  # Floats are in [-1, 1]
+    if samples.ndim == 2:
+        samples = samples.mean(axis=1)
+    if samples.dtype == np.int16:
+        return samples
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+class _Pacer:
+    """Sleeps between chunks to keep them in real time, if enabled."""
+
+    def __init__(self, realtime: bool):
+        self.realtime = realtime
+        self.start = time.monotonic()
+        self.audio_sec = 0.0
+
+    def pace(self, chunk_sec: float):
+        # Like a microphone, a chunk is available once it has been "recorded"
+        self.audio_sec += chunk_sec
+        if self.realtime:
+            time.sleep(max(0.0, self.start + self.audio_sec - time.monotonic()))
@@ -0,0 +1,137 @@
+"""Batch transcription of recorded audio.
+
+Transcribes many WAV files concurrently through a worker pool, e.g. to
+reprocess call recordings, or to regression-test ASR without a microphone.
+Reports the real-time factor (RTF), processing time / audio duration, per
+file and for the whole batch. An RTF below 1 is faster than real time.
+
+Usage:
+    transcriber = GoogleTranscriber()
+    report = transcribe_files(["recordings/"], transcriber, max_workers=8)
+    for result in report.results:
+        print(result.path, result.text)
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, List, Union
+
+from voicebots.asr.audio_sources import WavFileSource
+from voicebots.asr.transcriber import Transcriber
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_WORKERS = 8
+
+
+@dataclass
+class FileTranscription:
+    """Transcription of one file.
+
+    Attributes:
+        path (str): Path to the audio file.
+        text (str): Final transcripts of all utterances, joined by spaces.
+        audio_sec (float): Duration of the audio.
+        elapsed_sec (float): Time taken to transcribe the file.
+        error (str): Error message, if transcription failed.
+    """
+
+    path: str
+    text: str = ""
+    audio_sec: float = 0.0
+    elapsed_sec: float = 0.0
+    error: Union[str, None] = None
+
+    @property
+    def rtf(self) -> float:
+        return self.elapsed_sec / self.audio_sec if self.audio_sec else 0.0
+
+
+@dataclass
+class BatchReport:
+    """Summary of a batch transcription.
+
+    Attributes:
+        results (List[FileTranscription]): One result per file, in input order.
+        elapsed_sec (float): Wall time for the whole batch.
+    """
+
+    results: List[FileTranscription]
+    elapsed_sec: float
+
+    @property
+    def audio_sec(self) -> float:
+        return sum(r.audio_sec for r in self.results)
+
+    @property
+    def num_failed(self) -> int:
+        return sum(r.error is not None for r in self.results)
+
+    @property
+    def rtf(self) -> float:
+        """Batch wall time / total audio duration. Improves with more workers."""
+        return self.elapsed_sec / self.audio_sec if self.audio_sec else 0.0
+
+    @property
+    def mean_file_rtf(self) -> float:
+        """Mean per-file real-time factor, i.e. latency of a single file."""
+        rtfs = [r.rtf for r in self.results if r.error is None]
+        return sum(rtfs) / len(rtfs) if rtfs else 0.0
+
+
+def find_audio_files(paths: Iterable[str], pattern: str = "*.wav") -> List[str]:
+    """Expand directories (recursively) into the audio files they contain."""
+    files = []
+    for path in paths:
+        path = Path(path)
+        if path.is_dir():
+            files.extend(str(p) for p in sorted(path.rglob(pattern)))
+        else:
+            files.append(str(path))
+    return files
+
+
+def transcribe_file(path: str, transcriber: Transcriber) -> FileTranscription:
+    """Transcribe one WAV file. Errors are recorded in the result, not raised."""
+    result = FileTranscription(path=path)
+    start = time.perf_counter()
+    try:
+        source = WavFileSource(path)
+        result.audio_sec = source.duration_sec
+        texts = [t.text for t in transcriber.transcribe(source) if t.text]
+        result.text = " ".join(texts)
+    except Exception as e:
+        logger.exception(f"Failed to transcribe {path}")
+        result.error = f"{type(e).__name__}: {e}"
+    result.elapsed_sec = round(time.perf_counter() - start, 3)
+    return result
+
+
+def transcribe_files(
+    paths: Iterable[str],
+    transcriber: Transcriber,
+    max_workers: int = DEFAULT_BATCH_WORKERS,
+) -> BatchReport:
+    """Transcribe WAV files concurrently.
+
+    Args:
+        paths: WAV files, or directories to search for WAV files.
+        transcriber: Shared by all workers, so it must be thread-safe.
+            GoogleTranscriber is, as long as it has no VAD.
+        max_workers: Optional; Number of files transcribed at once.
+
+    Returns:
+        BatchReport with one result per file, in input order.
+    """
+    files = find_audio_files(paths)
+    logger.info(f"Transcribing {len(files)} files with {max_workers} workers")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(
+            executor.map(lambda path: transcribe_file(path, transcriber), files)
+        )
+    return BatchReport(
+        results=results, elapsed_sec=round(time.perf_counter() - start, 3)
+    )
@@ -0,0 +1,299 @@
+"""Transcribe the whole conversation with one capture stream.
+
+`GoogleTranscriber.listen()` opens the microphone and a new recognition
+stream for every turn, and closes both after the final result, so each turn
+pays device open and RPC setup, and the start of the user's utterance is
+clipped if they talk right after the bot.
+
+ContinuousGoogleTranscriber opens the audio source once and keeps a
+recognition stream running in the background. Google limits streams to ~5
+minutes, so streams are rotated before the limit, as in Google's "infinite
+streaming" sample: audio after the last final result is kept, and replayed
+at the start of the next stream, so no speech is lost at the seam. At most
+the last `MAX_REPLAY_SEC` are kept, so long silences (no final results)
+don't make the replay grow without bound.
+
+NOTE: The microphone is open while the bot speaks, so with speakers (rather
+than headphones) the bot's own voice can be transcribed as the user's turn.
+Use headphones.
+
+Usage:
+    with ContinuousGoogleTranscriber(supported_phrases=[...]) as transcriber:
+        for transcript in transcriber.listen():
+            ...
+"""
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterator, List, Union
+
+from google.cloud import speech
+
+from voicebots import tracing
+from voicebots.asr.audio_sources import SAMPLE_WIDTH, AudioSource, MicrophoneSource
+from voicebots.asr.google_transcriber import (
+    SILENCE_TIMEOUT_SEC,
+    GoogleTranscriber,
+    _encode_stream,
+)
+from voicebots.asr.resample import Resampler
+from voicebots.asr.transcriber import Transcript
+
+logger = logging.getLogger(__name__)
+
+# Rotate recognition streams before Google's ~5 minute limit
+STREAM_LIMIT_SEC = 240
+# Max unfinalized audio replayed at the start of the next stream. Longer
+# than an utterance, much shorter than the stream limit.
+MAX_REPLAY_SEC = 5
+
+# Marks the end of the transcripts, e.g. the source closed
+_END = object()
+
+
+class ContinuousGoogleTranscriber(GoogleTranscriber):
+    """GoogleTranscriber that keeps the audio source and a recognition stream open.
+
+    Recognition runs on a background thread from the first `listen()` until
+    `close()`. Each `listen()` yields the interim and final results of the
+    next utterance. Local VAD and early exit on supported phrases are not
+    used: Google endpoints the utterances.
+    """
+
+    def __init__(
+        self,
+        *args,
+        stream_limit_sec: float = STREAM_LIMIT_SEC,
+        silence_timeout_sec: float = SILENCE_TIMEOUT_SEC,
+        discard_early: bool = True,
+        max_replay_sec: float = MAX_REPLAY_SEC,
+        **kwargs,
+    ):
+        """Instantiate the ContinuousGoogleTranscriber.
+
+        Args:
+            args, kwargs: See `GoogleTranscriber`.
+            stream_limit_sec: Optional; Start a new recognition stream after
+                this long.
+            silence_timeout_sec: Optional; `listen()` reports a deadline
+                exceeded if the user says nothing for this long.
+            discard_early: Optional; Drop utterances finalized before
+                `listen()` was called, e.g. the bot's own voice picked up by
+                the microphone while it was speaking. Utterances still in
+                progress are kept.
+            max_replay_sec: Optional; Unfinalized audio kept to replay at the
+                start of the next stream. Older audio is dropped.
+        """
+        super().__init__(*args, **kwargs)
+        self.stream_limit_sec = stream_limit_sec
+        self.silence_timeout_sec = silence_timeout_sec
+        self.discard_early = discard_early
+        self.max_replay_sec = max_replay_sec
+        self.num_streams = 0
+        self._streaming_config = speech.StreamingRecognitionConfig(
+            config=self._config.config,
+            interim_results=True,
+            single_utterance=False,
+        )
+        self._transcripts: "queue.Queue" = queue.Queue()
+        self._thread: Union[threading.Thread, None] = None
+        self._source: Union[AudioSource, None] = None
+        self._closed = False
+        # Audio is added by the gRPC request thread, and finalized by ours
+        self._lock = threading.Lock()
+        # PCM at the recognition rate that Google hasn't finalized yet, and
+        # the Unix time each chunk was captured
+        self._unfinalized: deque = deque()
+        self._capture_times: deque = deque()
+        self._unfinalized_bytes = 0
+        self._unfinalized_start = 0  # Offset of the first byte, in the whole audio
+        self._stream_start = 0  # Offset of the current stream's first byte
+
+    def start(self) -> "ContinuousGoogleTranscriber":
+        """Open the audio source and start recognizing. Called by `listen()`."""
+        if self._thread is None:
+            self._source = self.source or MicrophoneSource(self.capture_rate)
+            self._source.open()
+            self._thread = threading.Thread(
+                target=self._recognize, name="continuous-asr", daemon=True
+            )
+            self._thread.start()
+        return self
+
+    def close(self):
+        """Close the audio source, which ends the recognition stream."""
+        self._closed = True
+        if self._source is not None:
+            self._source.close()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def listen(self) -> Iterator[Transcript]:
+        """Yield the interim and final results of the next utterance."""
+        self.start()
+        if self.discard_early:
+            self._discard_finals()
+        deadline = time.monotonic() + self.silence_timeout_sec
+        # As in GoogleTranscriber, "listen" includes waiting for the user, and
+        # "asr" is from the end of their speech to the final result
+        with tracing.span("listen", source=self._source.name, continuous=True) as span:
+            heard_speech = False
+            while True:
+                try:
+                    if heard_speech:
+                        transcript = self._transcripts.get()
+                    else:
+                        timeout = max(deadline - time.monotonic(), 0)
+                        transcript = self._transcripts.get(timeout=timeout)
+                except queue.Empty:
+                    logger.info("No utterance detected for awhile..")
+                    span.set(deadline_exceeded=True)
+                    yield Transcript(None, True, deadline_exceeded=True)
+                    return
+                if transcript is _END:
+                    # Keep ending subsequent listens too
+                    self._transcripts.put(_END)
+                    span.set(deadline_exceeded=True)
+                    yield Transcript(None, True, deadline_exceeded=True)
+                    return
+                if isinstance(transcript, Exception):
+                    raise transcript
+                heard_speech = True
+                if isinstance(transcript, tuple):
+                    transcript, speech_end = transcript
+                    tracing.record_span(
+                        "asr",
+                        speech_end,
+                        time.time(),
+                        source=self._source.name,
+                        continuous=True,
+                    )
+                yield transcript
+                if transcript.is_final:
+                    span.set(deadline_exceeded=False, streams=self.num_streams)
+                    return
+
+    def _discard_finals(self):
+        """Drop queued utterances, but keep the interims of one in progress."""
+        pending = []
+        while True:
+            try:
+                transcript = self._transcripts.get_nowait()
+            except queue.Empty:
+                break
+            if transcript is _END or isinstance(transcript, Exception):
+                pending = [transcript]
+                break
+            # Finals are queued with the time their speech ended
+            pending = [] if isinstance(transcript, tuple) else pending + [transcript]
+        if pending:
+            self._transcripts.put(pending[-1])
+
+    def _recognize(self):
+        audio = self._source.chunks()
+        if self._source.rate != self.recognition_rate:
+            resampler = Resampler(self._source.rate, self.recognition_rate)
+            audio = resampler.resample_stream(audio)
+        try:
+            while not self._closed:
+                if not self._run_stream(audio):
+                    break
+        except Exception as e:
+            if not self._closed:
+                logger.exception("Continuous recognition failed")
+                self._transcripts.put(e)
+        finally:
+            self._transcripts.put(_END)
+
+    def _run_stream(self, audio: Iterator[bytes]) -> bool:
+        """Run one recognition stream until its time limit.
+
+        Returns:
+            False if the audio ended.
+        """
+        self.num_streams += 1
+        with self._lock:
+            self._stream_start = self._unfinalized_start
+            replay = list(self._unfinalized)
+        state = {"audio_ended": True}
+        requests = self._stream_requests_until(
+            audio, replay, time.monotonic() + self.stream_limit_sec, state
+        )
+        responses = self._client.streaming_recognize(self._streaming_config, requests)
+        for response in responses:
+            if not response.results:
+                continue
+            result = response.results[0]
+            if not result.alternatives:
+                continue
+            text = result.alternatives[0].transcript
+            if result.is_final:
+                speech_end = self._finalize(result.result_end_time.total_seconds())
+                self._transcripts.put((Transcript(text.strip(), True), speech_end))
+            else:
+                self._transcripts.put(
+                    Transcript(text, False, stability=result.stability)
+                )
+        return not state["audio_ended"]
+
+    def _stream_requests_until(
+        self,
+        audio: Iterator[bytes],
+        replay: List[bytes],
+        deadline: float,
+        state: Dict,
+    ) -> Iterator[speech.StreamingRecognizeRequest]:
+        def _pcm():
+            # Replay the audio the previous stream didn't finalize
+            yield from replay
+            for chunk in audio:
+                chunk = bytes(chunk)
+                with self._lock:
+                    self._unfinalized.append(chunk)
+                    self._capture_times.append(time.time())
+                    self._unfinalized_bytes += len(chunk)
+                    max_bytes = int(self.max_replay_sec * self.recognition_rate)
+                    while self._unfinalized_bytes > max_bytes * SAMPLE_WIDTH:
+                        self._drop_oldest()
+                yield chunk
+                if time.monotonic() > deadline or self._closed:
+                    state["audio_ended"] = self._closed
+                    return
+
+        chunks = _pcm()
+        if self.encoding != "linear16":
+            chunks = _encode_stream(chunks, self.encoding, self.recognition_rate)
+        for content in chunks:
+            yield speech.StreamingRecognizeRequest(audio_content=content)
+
+    def _finalize(self, end_sec: float) -> float:
+        """Forget the audio up to the end of a final result.
+
+        Returns:
+            Unix time the end of the result was captured.
+        """
+        end = self._stream_start + int(end_sec * self.recognition_rate) * SAMPLE_WIDTH
+        speech_end = time.time()
+        with self._lock:
+            while self._unfinalized:
+                chunk_end = self._unfinalized_start + len(self._unfinalized[0])
+                speech_end = self._capture_times[0]
+                if chunk_end > end:
+                    break
+                self._drop_oldest()
+        return speech_end
+
+    def _drop_oldest(self):
+        """Forget the oldest unfinalized chunk. Call with the lock held."""
+        chunk = self._unfinalized.popleft()
+        self._capture_times.popleft()
+        self._unfinalized_start += len(chunk)
+        self._unfinalized_bytes -= len(chunk)
@@ -1,12 +1,16 @@
 import logging
 import time
-from typing import Iterable, List
+from typing import Callable, Iterable, Iterator, List, Union
 
+import numpy as np
 from google.cloud import speech
 
-from voicebots.microphone import MicrophoneStream
-from voicebots import text_utils
+from voicebots import audio_codecs, google_clients, text_utils, tracing
+from voicebots.asr.audio_sources import SAMPLE_WIDTH, AudioSource, MicrophoneSource
+from voicebots.asr.resample import Resampler
 from voicebots.asr.transcriber import Transcriber, Transcript
+from voicebots.asr.vad import VoiceActivityDetector
+from voicebots.phrase_matcher import PhraseMatcher
 
 # How long to wait before turning of the microphone (seconds)
 SILENCE_TIMEOUT_SEC = 10
@@ -15,13 +19,30 @@ SILENCE_TIMEOUT_SEC = 10
 # This should be the same as recording device
 # audio_interface = pyaudio.PyAudio()
 # audio_interface.get_default_input_device_info()
-RATE = 44100  # Frames per second. Previously 16000
+RATE = 44100  # Capture frames per second. Previously 16000
+
+# Sample rate sent to Google. Speech recognition doesn't benefit from more
+# than 16kHz, so captured audio is downsampled before streaming.
+RECOGNITION_RATE = 16000
 
-CHUNK = int(
-    RATE / 10
-)  # Buffer length - Number of frames to accumulate before returning audio
 LANGUAGE_CODE = "en-US"
 
+# Synchronous recognition takes at most 1 minute of audio, so recordings are
+# recognized in segments of up to this long
+RECOGNIZE_SEGMENT_SEC = 55
+# Segments are split at the quietest point in their last few seconds, so
+# words aren't cut in half
+SEGMENT_SPLIT_WINDOW_SEC = 5
+# Length of the frames compared when looking for the quietest point
+SEGMENT_SPLIT_FRAME_MS = 50
+
+# Encodings of the audio streamed to Google, see `audio_codecs.ASR_CODECS`
+SPEECH_ENCODINGS = {
+    "linear16": speech.RecognitionConfig.AudioEncoding.LINEAR16,
+    "flac": speech.RecognitionConfig.AudioEncoding.FLAC,
+    "ogg_opus": speech.RecognitionConfig.AudioEncoding.OGG_OPUS,
+}
+
 logger = logging.getLogger(__name__)
 
 
@@ -45,14 +66,19 @@ def _get_speech_contexts(supported_phrases):
 class GoogleTranscriber(Transcriber):
     """Parse audio from microphone using Google Cloud Speech API.
 
-    This class transcribes microphone audio to text. In the future, we
-    should also support pre-recorded audio files for integration tests.
+    This class transcribes microphone audio to text, or audio from any other
+    AudioSource (WAV files, arrays), e.g. for batch jobs and integration tests.
     """
 
     def __init__(
         self,
-        supported_phrases: List[str] = None,
+        supported_phrases: Union[List[str], PhraseMatcher, None] = None,
         single_utterance: bool = True,
+        vad: Union[VoiceActivityDetector, None] = None,
+        capture_rate: int = RATE,
+        recognition_rate: int = RECOGNITION_RATE,
+        source: Union[AudioSource, None] = None,
+        encoding: str = "linear16",
     ):
         """Instantiate the Listener.
 
@@ -60,22 +86,48 @@ class GoogleTranscriber(Transcriber):
             supported_phrases: Optional; A hard-coded list of text commands. If we detect
                 one of these phrases during transcription, we can exit early and return the phrase,
                 instead of waiting for Google to detect that the user has stopped speaking. This noticeably
-                speeds up transcription times for known phrases (Brendan).
+                speeds up transcription times for known phrases (Brendan). Can be a compiled
+                PhraseMatcher, e.g. to share a large command grammar, or to tolerate typos.
             single_utterance: Optional; indicates whether this request should automatically end after speech
                 is no longer detected. If set, Speech-to-Text will detect pauses, silence, or non-speech audio
                 to determine when to end recognition.
+            vad: Optional; Local voice activity detector. If set, only the audio of the user's
+                utterance is sent to Google, and the utterance ends as soon as the VAD detects
+                the user stopped talking, instead of waiting for Google's endpointing. Its rate
+                must match `recognition_rate`.
+            capture_rate: Optional; Sample rate of the microphone.
+            recognition_rate: Optional; Sample rate sent to Google. If lower than the rate of the
+                audio source, audio is downsampled before streaming.
+            source: Optional; Where `listen()` reads audio from. Defaults to the microphone,
+                at `capture_rate`.
+            encoding: Optional; "linear16", or "flac" or "ogg_opus" to compress the audio
+                before streaming it (requires ffmpeg). Opus must be at 8, 12, 16, 24 or 48kHz.
         """
-        self.supported_phrases = supported_phrases or []
-        self._client = speech.SpeechClient()
+        if encoding not in SPEECH_ENCODINGS:
+            raise ValueError(
+                f"Unknown encoding {encoding}. Expected one of {list(SPEECH_ENCODINGS)}"
+            )
+        if encoding != "linear16":
+            audio_codecs.check_ffmpeg()
+        if not isinstance(supported_phrases, PhraseMatcher):
+            supported_phrases = PhraseMatcher(supported_phrases or [])
+        self.phrase_matcher = supported_phrases
+        self.supported_phrases = supported_phrases.phrases
+        self.vad = vad
+        self.capture_rate = capture_rate
+        self.recognition_rate = recognition_rate
+        self.source = source
+        self.encoding = encoding
+        self._client = google_clients.get_speech_client()
         self._config = speech.StreamingRecognitionConfig(
             config=speech.RecognitionConfig(
-                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                sample_rate_hertz=RATE,
+                encoding=SPEECH_ENCODINGS[encoding],
+                sample_rate_hertz=recognition_rate,
                 language_code=LANGUAGE_CODE,
                 # https://cloud.google.com/speech-to-text/docs/basics#select-model
                 # model="latest_long",  # Alternative: video
                 model="video",
-                speech_contexts=_get_speech_contexts(supported_phrases),
+                speech_contexts=_get_speech_contexts(self.supported_phrases),
             ),
             interim_results=True,
             single_utterance=single_utterance,
@@ -87,43 +139,224 @@ class GoogleTranscriber(Transcriber):
         Returns:
             Transcript with detected utterance and additional metadata.
         """
-        with MicrophoneStream(rate=RATE, chunk=CHUNK) as stream:
-            audio_generator = stream.generator()
-            requests = (
-                speech.StreamingRecognizeRequest(audio_content=content)
-                for content in audio_generator
+        source = self.source or MicrophoneSource(self.capture_rate)
+        # The "listen" span includes waiting for the user to start and finish
+        # talking. The "asr" span is recognition only, from the end of speech
+        # (the audio ended, or Google detected it) to the final result.
+        speech_end = _SpeechEnd()
+        with tracing.span("listen", source=source.name) as span, source:
+            requests = self._stream_requests(
+                source, vad=self.vad, span=span, on_audio_end=speech_end.mark
             )
             responses = self._client.streaming_recognize(self._config, requests)
             transcriptions = _handle_transcription_stream(
-                responses, self.supported_phrases
+                responses, self.phrase_matcher, on_speech_end=speech_end.mark
             )
-            is_final = False
-            while not is_final:
-                transcript = next(transcriptions)
-                is_final = transcript.is_final
+            transcript = None
+            for transcript in transcriptions:
+                if transcript.is_final:
+                    span.set(deadline_exceeded=transcript.deadline_exceeded)
+                    if not transcript.deadline_exceeded:
+                        speech_end.record(source=source.name)
                 yield transcript
+                if transcript.is_final:
+                    return
+
+            # The audio ended (e.g. the VAD ended the utterance, or heard no
+            # speech at all) before Google sent a final result. Only the VAD's
+            # silence timeout ends the call: speech without a transcript (a
+            # cough, noise) is an empty utterance.
+            deadline_exceeded = self.vad is not None and self.vad.deadline_exceeded
+            span.set(deadline_exceeded=deadline_exceeded)
+            if deadline_exceeded:
+                yield Transcript(None, True, deadline_exceeded=True)
+            else:
+                speech_end.record(source=source.name)
+                text = transcript.text if transcript is not None else None
+                yield Transcript(text or "", True)
+
+    def transcribe(self, source: AudioSource) -> Iterable[Transcript]:
+        """Transcribe all speech in the source, e.g. a recorded call.
+
+        Recordings (sources with a known duration) are recognized with
+        synchronous requests, one per segment of up to RECOGNIZE_SEGMENT_SEC,
+        so they aren't limited by streaming's real-time pace and ~5 minute
+        cap. Live sources (e.g. a network caller) are streamed.
+
+        Yields:
+            One final Transcript per utterance, as soon as Google finalizes it.
+        """
+        if source.duration_sec is None:
+            yield from self._transcribe_stream(source)
+            return
+        with tracing.span("asr", source=source.name) as span, source:
+            num_bytes = 0
+            for segment in _split_segments(
+                self._pcm_chunks(source), self.recognition_rate
+            ):
+                if self.encoding != "linear16":
+                    segment = b"".join(
+                        _encode_stream([segment], self.encoding, self.recognition_rate)
+                    )
+                num_bytes += len(segment)
+                span.set(bytes=num_bytes)
+                response = self._client.recognize(
+                    config=self._config.config,
+                    audio=speech.RecognitionAudio(content=segment),
+                )
+                for result in response.results:
+                    if result.alternatives:
+                        text = result.alternatives[0].transcript.strip()
+                        yield Transcript(text, True)
+
+    def _transcribe_stream(self, source: AudioSource) -> Iterable[Transcript]:
+        config = speech.StreamingRecognitionConfig(
+            config=self._config.config,
+            interim_results=False,
+            single_utterance=False,
+        )
+        speech_end = _SpeechEnd()
+        with tracing.span("listen", source=source.name) as span, source:
+            requests = self._stream_requests(
+                source, span=span, on_audio_end=speech_end.mark
+            )
+            responses = self._client.streaming_recognize(config, requests)
+            for response in responses:
+                for result in response.results:
+                    if result.is_final and result.alternatives:
+                        text = result.alternatives[0].transcript.strip()
+                        yield Transcript(text, True)
+            # The last result arrives after the end of the audio
+            speech_end.record(source=source.name)
+
+    def _pcm_chunks(
+        self, source: AudioSource, vad: Union[VoiceActivityDetector, None] = None
+    ) -> Iterator[bytes]:
+        """PCM of the source at the recognition rate, gated by the VAD if set."""
+        audio_generator = source.chunks()
+        if source.rate != self.recognition_rate:
+            resampler = Resampler(source.rate, self.recognition_rate)
+            audio_generator = resampler.resample_stream(audio_generator)
+        if vad is not None:
+            audio_generator = vad.gate(audio_generator)
+        return audio_generator
+
+    def _stream_requests(
+        self,
+        source: AudioSource,
+        vad: Union[VoiceActivityDetector, None] = None,
+        span: Union[tracing.Span, None] = None,
+        on_audio_end: Union[Callable[[], None], None] = None,
+    ) -> Iterator[speech.StreamingRecognizeRequest]:
+        audio_generator = self._pcm_chunks(source, vad=vad)
+        if self.encoding != "linear16":
+            audio_generator = _encode_stream(
+                audio_generator, self.encoding, self.recognition_rate
+            )
+        # Sources may reuse their buffer, so copy each chunk into the request
+        num_bytes = 0
+        for content in audio_generator:
+            content = bytes(content)
+            num_bytes += len(content)
+            if span is not None:
+                span.set(bytes=num_bytes)
+            yield speech.StreamingRecognizeRequest(audio_content=content)
+        # E.g. the VAD ended the utterance, or the caller's audio ended
+        if on_audio_end is not None:
+            on_audio_end()
+
+
+def _encode_stream(chunks: Iterable[bytes], codec: str, rate: int) -> Iterator[bytes]:
+    """Compress PCM chunks, skipping chunks the encoder hasn't output yet."""
+    encoder = audio_codecs.StreamEncoder(codec, rate)
+    try:
+        for chunk in chunks:
+            data = encoder.encode(chunk)
+            if data:
+                yield data
+    finally:
+        # Flush on the end of the audio, and stop ffmpeg if the stream is abandoned
+        data = encoder.close()
+    if data:
+        yield data
+    logger.debug(f"Compressed ASR audio {encoder.compression_ratio:.1f}x ({codec})")
+
+
+class _SpeechEnd:
+    """When the user stopped talking, for the "asr" span of an utterance."""
+
+    def __init__(self):
+        self.time: Union[float, None] = None
+
+    def mark(self):
+        """The audio ended, or Google detected the end of speech."""
+        if self.time is None:
+            self.time = time.time()
+
+    def record(self, **attributes):
+        """Record recognition from the end of speech until now.
+
+        Not recorded if the end of speech is unknown, e.g. a supported
+        command ended the utterance early.
+        """
+        if self.time is not None:
+            tracing.record_span("asr", self.time, time.time(), **attributes)
+
+
+def _split_segments(
+    chunks: Iterable[bytes],
+    rate: int,
+    max_sec: float = RECOGNIZE_SEGMENT_SEC,
+    window_sec: float = SEGMENT_SPLIT_WINDOW_SEC,
+) -> Iterator[bytes]:
+    """Join PCM chunks into segments of at most `max_sec`.
+
+    Each full segment is cut at the quietest frame of its last `window_sec`.
+    """
+    max_bytes = int(max_sec * rate) * SAMPLE_WIDTH
+    frame = int(rate * SEGMENT_SPLIT_FRAME_MS / 1000)
+    window_frames = max(int(window_sec * rate) // frame, 1)
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer += chunk
+        while len(buffer) >= max_bytes:
+            # Copied, since a bytearray can't shrink while numpy views it
+            samples = np.frombuffer(bytes(buffer[:max_bytes]), dtype=np.int16)
+            num_frames = len(samples) // frame
+            first = max(num_frames - window_frames, 1)
+            frames = samples[first * frame : num_frames * frame].reshape(-1, frame)
+            energy = np.square(frames.astype(np.float32)).mean(axis=1)
+            # Cut in the middle of the quietest frame
+            cut = (first + int(np.argmin(energy))) * frame + frame // 2
+            segment = bytes(buffer[: cut * SAMPLE_WIDTH])
+            del buffer[: cut * SAMPLE_WIDTH]
+            yield segment
+    if buffer:
+        yield bytes(buffer)
 
 
-def _is_supported_command(text: str, supported_phrases: List[str]) -> bool:
-    return text_utils.normalize_text(text) in supported_phrases
+def _is_supported_command(text: str, phrase_matcher: PhraseMatcher) -> bool:
+    return phrase_matcher.fullmatch(text) is not None
 
 
 def _handle_transcription_stream(
     responses: Iterable,
-    supported_phrases: List[str],
+    phrase_matcher: PhraseMatcher,
     deadline: int = SILENCE_TIMEOUT_SEC,
+    on_speech_end: Union[Callable[[], None], None] = None,
 ) -> Iterable[Transcript]:
     """Handle streaming transcriptions from Google Cloud Speech API.
 
     Args:
         responses: Iterable of Google API responses
-        supported_phrases: Optional; A hard-coded list of text commands. If we detect
-            one of these phrases during transcription, we can exit early and return the phrase,
-            instead of waiting for Google to detect that the user has stopped speaking.
+        phrase_matcher: Supported text commands. If we detect one of these phrases
+            during transcription, we can exit early and return the phrase, instead of
+            waiting for Google to detect that the user has stopped speaking.
         deadline: Optional; Maximum amount of seconds to wait for user to say something, otherwise
             exit early due to inactivity. NOTE: Google currently controls part of this equation,
             since they wait for silence on their end, too. So even with a deadline=0, we would still
             wait for N seconds for google to detect the silence and send an end of utterance event.
+        on_speech_end: Optional; Called when Google detects the end of the utterance.
 
     Returns:
         Iterable[Transcript]: Stream of transcribed audio and metadata
@@ -133,6 +366,9 @@ def _handle_transcription_stream(
     start_time = time.time()
     is_final = False
     for response in responses:
+        if response.speech_event_type.name == "END_OF_SINGLE_UTTERANCE":
+            if on_speech_end is not None:
+                on_speech_end()
         if not is_final:
             if not response.results:
                 if (
@@ -171,11 +407,16 @@ def _handle_transcription_stream(
                 num_chars_printed = len(transcript)
 
                 # Eagerly return command if matches result
-                if _is_supported_command(transcript, supported_phrases):
+                if _is_supported_command(transcript, phrase_matcher):
                     logger.info("Detected a supported command! Exiting early.")
                     is_final = True
 
-                yield Transcript(transcript, is_final, overwrite_chars=overwrite_chars)
+                yield Transcript(
+                    transcript,
+                    is_final,
+                    overwrite_chars=overwrite_chars,
+                    stability=result.stability,
+                )
 
             else:
                 logger.info(f"Current transcript: {transcript}")
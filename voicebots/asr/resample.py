@@ -0,0 +1,99 @@
+"""Streaming sample rate conversion for 16-bit mono PCM.
+
+Microphones typically capture at 44.1kHz or 48kHz, but speech recognition
+only needs 16kHz. Downsampling before streaming to the recognizer cuts the
+upstream bytes by ~2.75x.
+
+Uses a polyphase windowed-sinc FIR filter, vectorized with NumPy. The filter
+state is carried across chunks, so chunk boundaries don't cause clicks.
+
+Usage:
+    resampler = Resampler(in_rate=44100, out_rate=16000)
+    for chunk in resampler.resample_stream(microphone_stream.generator()):
+        send_to_recognizer(chunk)
+"""
+from math import gcd
+from typing import Iterable, Iterator
+
+import numpy as np
+
+# Filter taps per polyphase branch. More taps, sharper anti-aliasing filter.
+TAPS_PER_PHASE = 48
+
+# Filter cutoff, as a fraction of the output Nyquist frequency
+CUTOFF = 0.9
+
+
+def design_polyphase_filter(up: int, down: int, taps_per_phase: int) -> np.ndarray:
+    """Design a Kaiser-windowed sinc low-pass filter, split into polyphase branches.
+
+    Returns:
+        Array of shape (up, taps_per_phase). Row p holds taps h[p + k * up],
+        reversed, so it can be dotted directly with a window of input samples.
+    """
+    num_taps = up * taps_per_phase
+    cutoff = CUTOFF / max(up, down)  # Relative to the upsampled Nyquist
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = cutoff * np.sinc(cutoff * n) * np.kaiser(num_taps, 8.0)
+    taps *= up / taps.sum()  # Unity gain after zero-stuffing
+    return taps.reshape(taps_per_phase, up).T[:, ::-1].astype(np.float32)
+
+
+class Resampler:
+    """Resamples a stream of int16 PCM chunks from in_rate to out_rate."""
+
+    def __init__(
+        self, in_rate: int, out_rate: int, taps_per_phase: int = TAPS_PER_PHASE
+    ):
+        divisor = gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.taps_per_phase = taps_per_phase
+        self._filters = design_polyphase_filter(self.up, self.down, taps_per_phase)
+        self.reset()
+
+    def reset(self):
+        """Clear the filter state, e.g. before an unrelated stream."""
+        # Input history needed for the next output samples
+        self._history = np.zeros(self.taps_per_phase - 1, dtype=np.float32)
+        self._num_inputs = 0  # Input samples consumed, excluding history
+        self._num_outputs = 0  # Output samples produced
+
+    def resample(self, chunk) -> bytes:
+        """Resample one chunk of int16 PCM. Returns int16 PCM bytes."""
+        if self.up == self.down:
+            return bytes(chunk)
+        samples = np.frombuffer(chunk, dtype=np.int16).astype(np.float32)
+        window = np.concatenate([self._history, samples])
+        offset = self._num_inputs - len(self._history)  # Input index of window[0]
+        self._num_inputs += len(samples)
+
+        # Output sample m is centered on (upsampled) input position m * down / up.
+        # Produce every output whose newest input sample is already available.
+        last_output = (self._num_inputs * self.up - 1) // self.down
+        outputs = np.arange(self._num_outputs, last_output + 1)
+        self._num_outputs = last_output + 1
+
+        positions = outputs * self.down
+        newest = positions // self.up - offset  # Index into window
+        phases = positions % self.up
+        windows = np.lib.stride_tricks.sliding_window_view(
+            window, self.taps_per_phase
+        )
+        resampled = np.einsum(
+            "ij,ij->i",
+            windows[newest - (self.taps_per_phase - 1)],
+            self._filters[phases],
+        )
+
+        self._history = window[len(window) - (self.taps_per_phase - 1) :]
+        return np.clip(np.rint(resampled), -32768, 32767).astype(np.int16).tobytes()
+
+    def resample_stream(self, chunks: Iterable) -> Iterator[bytes]:
+        """Resample a stream of int16 PCM chunks."""
+        for chunk in chunks:
+            resampled = self.resample(chunk)
+            if resampled:
+                yield resampled
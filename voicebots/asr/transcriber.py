@@ -1,6 +1,26 @@
 import dataclasses
+import random
+import threading
+import time
 from dataclasses import dataclass
-from typing import Iterable
+from typing import Iterable, List, Union
+
+from voicebots.asr.audio_sources import AudioSource
+from voicebots.simulation import Latency, maybe_fail
+
+# Fake ASR timing
+FAKE_WORD_SEC = 0.3
+# Time from the end of speech until the final result
+FAKE_ENDPOINTING_LATENCY = Latency(median_sec=0.5, p95_sec=1.2)
+
+# Default user utterances of the FakeTranscriber
+FAKE_SCRIPT = [
+    "hi there how are you doing today",
+    "can you help me plan a trip to the mountains",
+    "what should I pack for a week of hiking",
+    "that sounds great thanks",
+    "goodbye",
+]
 
 
 @dataclass
@@ -13,12 +33,15 @@ class Transcript:
         deadline_exceeded (bool): Indicates whether the transcriber exited early due to user inactivity.
         overwrite_chars (str): Used for display purposes when logging interim results to the console. If the last
             `text` result was longer, overwrite_chars is used to clear the console of the longer result.
+        stability (float): For interim results, an estimate (0.0 - 1.0) of how likely the text is to stay
+            the same. 0.0 if unknown.
     """
 
     text: str
     is_final: bool
     deadline_exceeded: bool = False
     overwrite_chars: str = ""
+    stability: float = 0.0
 
     def dict(self):
         return dataclasses.asdict(self)
@@ -26,9 +49,103 @@ class Transcript:
 
 class Transcriber:
     """Base class for all speech-to-text listeners.
-    These classes transcribe microphone audio to text. In the future,
-    we should also support pre-recorded audio files for integration tests.
+    These classes transcribe microphone audio to text, or audio from any
+    other AudioSource (e.g. pre-recorded audio files for integration tests).
     """
 
     def listen(self) -> Iterable[Transcript]:
+        """Transcribe the next user utterance, yielding interim and final results."""
         raise NotImplementedError
+
+    def transcribe(self, source: AudioSource) -> Iterable[Transcript]:
+        """Transcribe all speech in the source, yielding one final Transcript per utterance."""
+        raise NotImplementedError
+
+    def close(self):
+        """Release the audio source, for transcribers that keep it open across turns."""
+        pass
+
+
+class ScriptedTranscriber(Transcriber):
+    """Replays a fixed script of utterances instead of listening to audio.
+
+    Used to drive the voice loop headlessly (demos, integration tests).
+    Each call to `listen()` consumes one utterance, yielding word-by-word
+    interim results followed by the final result. Once the script is
+    exhausted, `listen()` reports a deadline exceeded.
+    """
+
+    def __init__(self, utterances: List[str], pause_sec: float = 0, word_sec: float = 0):
+        """Instantiate the ScriptedTranscriber.
+
+        Args:
+            utterances: Text of each user utterance, in order.
+            pause_sec: Optional; Silence before each utterance starts.
+            word_sec: Optional; Time between interim results (one per word).
+        """
+        self.utterances = list(utterances)
+        self.pause_sec = pause_sec
+        self.word_sec = word_sec
+
+    def listen(self) -> Iterable[Transcript]:
+        time.sleep(self.pause_sec)
+        if not self.utterances:
+            yield Transcript(None, True, deadline_exceeded=True)
+            return
+        words = self.utterances.pop(0).split()
+        for i in range(1, len(words)):
+            yield Transcript(" ".join(words[:i]), False)
+            time.sleep(self.word_sec)
+        yield Transcript(" ".join(words), True)
+
+
+class FakeTranscriber(ScriptedTranscriber):
+    """Local stand-in for Google streaming ASR.
+
+    Like ScriptedTranscriber, but the final result arrives after a sampled
+    endpointing latency, and requests fail at a configurable rate.
+    """
+
+    def __init__(
+        self,
+        utterances: List[str] = FAKE_SCRIPT,
+        pause_sec: float = 0,
+        word_sec: float = FAKE_WORD_SEC,
+        endpointing_latency: Latency = FAKE_ENDPOINTING_LATENCY,
+        error_rate: float = 0.0,
+        seed: Union[int, None] = None,
+    ):
+        """Instantiate the FakeTranscriber.
+
+        Args:
+            utterances: Optional; Text of each user utterance, in order.
+            pause_sec: Optional; Silence before each utterance starts.
+            word_sec: Optional; Time between interim results (one per word).
+            endpointing_latency: Optional; Time from the last word to the final result.
+            error_rate: Optional; Fraction of requests that fail with a FakeServiceError.
+            seed: Optional; Seed for reproducible latencies and errors.
+        """
+        super().__init__(utterances, pause_sec=pause_sec, word_sec=word_sec)
+        self.endpointing_latency = endpointing_latency
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def listen(self) -> Iterable[Transcript]:
+        for transcript in super().listen():
+            if transcript.is_final and not transcript.deadline_exceeded:
+                time.sleep(self._sample_latency())
+            yield transcript
+
+    def transcribe(self, source: AudioSource) -> Iterable[Transcript]:
+        """Read the whole source, then return the next scripted utterance."""
+        for _ in source.chunks():
+            pass
+        time.sleep(self._sample_latency())
+        if self.utterances:
+            yield Transcript(self.utterances.pop(0), True)
+
+    def _sample_latency(self) -> float:
+        with self._lock:
+            maybe_fail(self._rng, self.error_rate, "transcription")
+            return self.endpointing_latency.sample(self._rng)
@@ -0,0 +1,205 @@
+"""Local voice activity detection (VAD) and endpointing.
+
+Google decides when the user has stopped talking, which takes a while (see
+`_handle_transcription_stream`), and we pay to stream every chunk of silence.
+The VoiceActivityDetector runs locally on the raw audio instead:
+
+- Audio is withheld from the recognizer until speech starts (plus a short
+  pre-roll, so the first syllable isn't clipped).
+- The utterance ends locally after `hangover_ms` of silence, which closes the
+  request stream so Google returns the final result right away.
+- A speech-start callback fires as soon as the user starts talking, e.g. to
+  interrupt the bot (barge-in).
+
+Speech is detected per frame from energy (relative to an adaptive noise floor)
+and zero-crossing rate, computed with NumPy.
+
+Usage:
+    vad = VoiceActivityDetector(rate=16000, on_speech_start=lambda: print("Speech!"))
+    for chunk in vad.gate(microphone_stream.generator()):
+        send_to_recognizer(chunk)
+"""
+import collections
+import logging
+from typing import Callable, Iterable, Iterator, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FRAME_MS = 30
+# Frames this much louder than the noise floor count as speech
+SPEECH_MARGIN_DB = 10.0
+# Frames quieter than this never count as speech
+MIN_SPEECH_DB = -55.0
+# Frames with more zero crossings than this are treated as noise (hiss, clicks)
+MAX_ZERO_CROSSING_RATE = 0.5
+# Consecutive speech needed to start an utterance
+MIN_SPEECH_MS = 90
+# Silence after speech that ends the utterance
+HANGOVER_MS = 600
+# Audio sent from before speech was detected
+PRE_ROLL_MS = 300
+# Give up if no speech starts within this time
+MAX_SILENCE_SEC = 10
+# How fast the noise floor tracks background level (per frame)
+NOISE_FLOOR_ADAPTATION = 0.05
+
+
+def frame_features(frames: np.ndarray):
+    """Compute energy (dBFS) and zero-crossing rate per frame.
+
+    Args:
+        frames: int16 array of shape (num_frames, frame_length).
+
+    Returns:
+        Tuple of (energy_db, zero_crossing_rate) arrays of shape (num_frames,).
+    """
+    samples = frames.astype(np.float32) / 32768.0
+    rms = np.sqrt(np.mean(samples**2, axis=1))
+    energy_db = 20 * np.log10(np.maximum(rms, 1e-10))
+    signs = np.signbit(samples)
+    zero_crossing_rate = np.mean(signs[:, 1:] != signs[:, :-1], axis=1)
+    return energy_db, zero_crossing_rate
+
+
+class VoiceActivityDetector:
+    """Energy and zero-crossing based VAD for 16-bit mono PCM."""
+
+    def __init__(
+        self,
+        rate: int,
+        frame_ms: int = FRAME_MS,
+        speech_margin_db: float = SPEECH_MARGIN_DB,
+        min_speech_db: float = MIN_SPEECH_DB,
+        max_zero_crossing_rate: float = MAX_ZERO_CROSSING_RATE,
+        min_speech_ms: int = MIN_SPEECH_MS,
+        hangover_ms: int = HANGOVER_MS,
+        pre_roll_ms: int = PRE_ROLL_MS,
+        max_silence_sec: float = MAX_SILENCE_SEC,
+        on_speech_start: Union[Callable[[], None], None] = None,
+        on_speech_end: Union[Callable[[], None], None] = None,
+    ):
+        """Instantiate the VoiceActivityDetector.
+
+        Args:
+            rate: Sample rate of the audio.
+            frame_ms: Analysis frame length.
+            speech_margin_db: How much louder than the noise floor speech must be.
+            min_speech_db: Absolute minimum energy of speech.
+            max_zero_crossing_rate: Frames above this rate are treated as noise.
+            min_speech_ms: Consecutive speech needed to start an utterance.
+            hangover_ms: Silence after speech that ends the utterance.
+            pre_roll_ms: Audio from before speech was detected to include.
+            max_silence_sec: Stop waiting if no speech starts within this time.
+            on_speech_start: Optional; Called when the user starts talking.
+            on_speech_end: Optional; Called when the utterance ends locally.
+        """
+        self.rate = rate
+        self.frame_length = int(rate * frame_ms / 1000)
+        self.speech_margin_db = speech_margin_db
+        self.min_speech_db = min_speech_db
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.pre_roll_frames = pre_roll_ms // frame_ms
+        self.max_silence_sec = max_silence_sec
+        self.on_speech_start = on_speech_start
+        self.on_speech_end = on_speech_end
+        self.noise_floor_db: Union[float, None] = None
+
+        # Per-utterance state
+        self.speech_detected = False
+        self.deadline_exceeded = False
+
+    def is_speech(self, frames: np.ndarray) -> np.ndarray:
+        """Classify frames as speech, updating the noise floor from non-speech frames.
+
+        Args:
+            frames: int16 array of shape (num_frames, frame_length).
+
+        Returns:
+            Boolean array of shape (num_frames,).
+        """
+        energy_db, zero_crossing_rate = frame_features(frames)
+        if self.noise_floor_db is None:
+            self.noise_floor_db = float(np.min(energy_db))
+        is_speech = np.zeros(len(frames), dtype=bool)
+        for i, energy in enumerate(energy_db):
+            is_speech[i] = (
+                energy > self.noise_floor_db + self.speech_margin_db
+                and energy > self.min_speech_db
+                and zero_crossing_rate[i] < self.max_zero_crossing_rate
+            )
+            if not is_speech[i]:
+                self.noise_floor_db += NOISE_FLOOR_ADAPTATION * (
+                    energy - self.noise_floor_db
+                )
+        return is_speech
+
+    def gate(self, chunks: Iterable) -> Iterator[bytes]:
+        """Pass through only the audio of one utterance.
+
+        Stops iterating (without reading further audio) once the utterance
+        ends, or if no speech starts within `max_silence_sec`, in which case
+        `deadline_exceeded` is set and nothing is yielded.
+
+        Args:
+            chunks: 16-bit mono PCM chunks of any size, e.g. from `MicrophoneStream.generator()`.
+
+        Yields:
+            bytes. PCM of the utterance, in frame multiples.
+        """
+        self.speech_detected = False
+        self.deadline_exceeded = False
+        # Always keep the frames that triggered speech detection
+        pre_roll = collections.deque(
+            maxlen=max(self.pre_roll_frames, self.min_speech_frames)
+        )
+        frame_bytes = self.frame_length * 2
+        remainder = b""
+        num_speech = 0  # Consecutive speech frames before the utterance started
+        num_silence = 0  # Consecutive silent frames since speech started
+        num_frames_seen = 0
+        max_silence_frames = self.max_silence_sec * self.rate / self.frame_length
+
+        for chunk in chunks:
+            data = remainder + bytes(chunk)
+            num_frames = len(data) // frame_bytes
+            remainder = data[num_frames * frame_bytes :]
+            if num_frames == 0:
+                continue
+            num_frames_seen += num_frames
+            frames = np.frombuffer(
+                data, dtype=np.int16, count=num_frames * self.frame_length
+            ).reshape(num_frames, self.frame_length)
+
+            output = []
+            for frame, is_speech in zip(frames, self.is_speech(frames)):
+                if not self.speech_detected:
+                    pre_roll.append(frame.tobytes())
+                    num_speech = num_speech + 1 if is_speech else 0
+                    if num_speech >= self.min_speech_frames:
+                        logger.debug("Speech started")
+                        self.speech_detected = True
+                        output.extend(pre_roll)
+                        if self.on_speech_start is not None:
+                            self.on_speech_start()
+                    continue
+
+                output.append(frame.tobytes())
+                num_silence = 0 if is_speech else num_silence + 1
+                if num_silence >= self.hangover_frames:
+                    logger.debug("Speech ended")
+                    yield b"".join(output)
+                    if self.on_speech_end is not None:
+                        self.on_speech_end()
+                    return
+
+            if output:
+                yield b"".join(output)
+
+            if not self.speech_detected and num_frames_seen > max_silence_frames:
+                logger.info("No speech detected for awhile..")
+                self.deadline_exceeded = True
+                return
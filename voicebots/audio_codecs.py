@@ -0,0 +1,174 @@
+"""Compressed audio for the wire and the disk, using ffmpeg.
+
+Raw LINEAR16 PCM is ~256kbps at 16kHz (384kbps at 24kHz). Opus speech is
+~10x smaller and FLAC ~2x smaller (lossless), which matters on bandwidth
+constrained hosts and for cache disks.
+
+- ASR: `StreamEncoder` compresses PCM chunks as they are captured, so they
+  can be streamed to Google as FLAC or OGG_OPUS.
+- TTS: Google returns OGG_OPUS or MP3, which is cached as is and decoded
+  once to WAV with `decode_to_wav` for playback.
+
+Requires the ffmpeg binary on the PATH.
+
+Usage:
+    encoder = StreamEncoder("ogg_opus", rate=16000)
+    for chunk in pcm_chunks:
+        send(encoder.encode(chunk))
+    send(encoder.close())
+"""
+import io
+import logging
+import queue
+import shutil
+import subprocess
+import threading
+import wave
+from typing import List
+
+logger = logging.getLogger(__name__)
+
+# Codecs Google Speech accepts in streaming requests
+ASR_CODECS = ["linear16", "flac", "ogg_opus"]
+
+# ffmpeg output args of each codec
+FFMPEG_CODEC_ARGS = {
+    "flac": ["-c:a", "flac", "-f", "flac"],
+    # Opus at 24kbps (VoIP mode) is transparent for speech recognition
+    "ogg_opus": [
+        "-c:a", "libopus", "-b:a", "24k", "-application", "voip", "-f", "ogg"
+    ],
+}
+
+# Sample rate of decoded TTS audio. Google voices are 24kHz.
+DECODE_RATE = 24000
+
+# Bytes read from ffmpeg at a time
+READ_SIZE = 4096
+
+FFMPEG = "ffmpeg"
+
+
+class CodecError(RuntimeError):
+    """ffmpeg is missing, or failed to encode or decode audio."""
+
+
+def check_ffmpeg():
+    if shutil.which(FFMPEG) is None:
+        raise CodecError(
+            f"{FFMPEG} is required for compressed audio. Install it, or use LINEAR16."
+        )
+
+
+def _pcm_input_args(rate: int) -> List[str]:
+    return ["-f", "s16le", "-ar", str(rate), "-ac", "1", "-i", "pipe:0"]
+
+
+def _ffmpeg_command(*args: str) -> List[str]:
+    return [FFMPEG, "-hide_banner", "-loglevel", "error", *args]
+
+
+class StreamEncoder:
+    """Compresses a stream of 16-bit mono PCM chunks with an ffmpeg process.
+
+    Encoding lags the input by a frame or so: `encode()` returns whatever
+    compressed audio is ready (possibly nothing), and `close()` returns the
+    rest.
+    """
+
+    def __init__(self, codec: str, rate: int):
+        """Instantiate the StreamEncoder.
+
+        Args:
+            codec: "flac" or "ogg_opus".
+            rate: Sample rate of the PCM audio.
+        """
+        if codec not in FFMPEG_CODEC_ARGS:
+            raise ValueError(
+                f"Unknown codec {codec}. Expected one of {list(FFMPEG_CODEC_ARGS)}"
+            )
+        check_ffmpeg()
+        self.codec = codec
+        self.rate = rate
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._output: "queue.Queue[bytes]" = queue.Queue()
+        self._process = subprocess.Popen(
+            _ffmpeg_command(
+                *_pcm_input_args(rate), *FFMPEG_CODEC_ARGS[codec], "pipe:1"
+            ),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # ffmpeg blocks once its stdout pipe is full, so drain it continuously
+        self._reader = threading.Thread(target=self._read_output, daemon=True)
+        self._reader.start()
+
+    @property
+    def compression_ratio(self) -> float:
+        return self.bytes_in / self.bytes_out if self.bytes_out else 0.0
+
+    def encode(self, pcm: bytes) -> bytes:
+        """Add PCM audio, and return the compressed audio ready so far."""
+        self.bytes_in += len(pcm)
+        try:
+            self._process.stdin.write(pcm)
+            self._process.stdin.flush()
+        except BrokenPipeError:
+            raise CodecError(self._error_message())
+        return self._take_output()
+
+    def close(self) -> bytes:
+        """End the stream, and return the rest of the compressed audio."""
+        if not self._process.stdin.closed:
+            self._process.stdin.close()
+        self._reader.join()
+        if self._process.wait() != 0:
+            raise CodecError(self._error_message())
+        return self._take_output()
+
+    def _read_output(self):
+        while True:
+            data = self._process.stdout.read1(READ_SIZE)
+            if not data:
+                return
+            self._output.put(data)
+
+    def _take_output(self) -> bytes:
+        chunks = []
+        while True:
+            try:
+                chunks.append(self._output.get_nowait())
+            except queue.Empty:
+                break
+        data = b"".join(chunks)
+        self.bytes_out += len(data)
+        return data
+
+    def _error_message(self) -> str:
+        self._process.kill()
+        stderr = self._process.stderr.read().decode(errors="replace").strip()
+        return f"Failed to encode {self.codec}: {stderr}"
+
+
+def decode_to_wav(audio_bytes: bytes, rate: int = DECODE_RATE) -> bytes:
+    """Decode compressed audio (e.g. OGG_OPUS, MP3) to 16-bit mono WAV bytes."""
+    check_ffmpeg()
+    result = subprocess.run(
+        _ffmpeg_command(
+            "-i", "pipe:0", "-f", "s16le", "-ar", str(rate), "-ac", "1", "pipe:1"
+        ),
+        input=audio_bytes,
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        stderr = result.stderr.decode(errors="replace").strip()
+        raise CodecError(f"Failed to decode audio: {stderr}")
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(result.stdout)
+    return buffer.getvalue()
@@ -10,12 +10,31 @@ Python libraries for playing audio:
 
 NOTE: Might need to `brew install ffmpeg`
 """
-
+import io
+import logging
+import threading
+import wave
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Iterable, Tuple, Union
 
 from pydub import AudioSegment
 from pydub.playback import play
 
+from voicebots.ring_buffer import RingBuffer
+
+logger = logging.getLogger(__name__)
+
+# Google TTS LINEAR16 default output format
+DEFAULT_SAMPLE_RATE = 24000
+DEFAULT_CHANNELS = 1
+DEFAULT_SAMPLE_WIDTH = 2  # 16 bit
+
+# Seconds of audio the sink buffers ahead of the speaker
+SINK_BUFFER_SEC = 10
+# Frames per output callback. Smaller means faster stop(), more callbacks.
+SINK_FRAMES_PER_BUFFER = 1024
+
 
 def play_audio_bytes(bytes):
     # LINEAR_16 / Wav encoding
@@ -41,3 +60,165 @@ def load_audio_from_file(fpath, format="wav"):
     with open(fpath, "rb") as f:
         audio_bytes = f.read()
     return audio_bytes
+
+
+@dataclass(frozen=True)
+class AudioFormat:
+    """Format of raw PCM audio."""
+
+    rate: int = DEFAULT_SAMPLE_RATE
+    channels: int = DEFAULT_CHANNELS
+    sample_width: int = DEFAULT_SAMPLE_WIDTH  # bytes
+
+    @property
+    def bytes_per_sec(self) -> int:
+        return self.rate * self.channels * self.sample_width
+
+
+def wav_to_pcm(wav_bytes: bytes) -> Tuple[bytes, AudioFormat]:
+    """Strip the header from WAV bytes (e.g. Google LINEAR16 output)."""
+    with wave.open(io.BytesIO(wav_bytes)) as wav:
+        audio_format = AudioFormat(
+            rate=wav.getframerate(),
+            channels=wav.getnchannels(),
+            sample_width=wav.getsampwidth(),
+        )
+        return wav.readframes(wav.getnframes()), audio_format
+
+
+class AudioSink:
+    """Streaming audio output.
+
+    Unlike `play_audio_bytes`, which blocks until the whole clip has played,
+    the sink starts playing as soon as the first chunk is written, accepts
+    more audio while playing, and can be interrupted.
+
+    Audio is written into a ring buffer, which the PyAudio output callback
+    drains in real time (playing silence when it runs dry).
+
+    Usage:
+        with AudioSink() as sink:
+            for sentence in sentences:
+                sink.write_wav(synthesize(sentence))  # Plays as soon as written
+            sink.flush()  # Wait until played
+
+        sink.stop()  # Barge-in: drop buffered audio immediately
+    """
+
+    def __init__(
+        self,
+        audio_format: AudioFormat = AudioFormat(),
+        buffer_sec: float = SINK_BUFFER_SEC,
+        frames_per_buffer: int = SINK_FRAMES_PER_BUFFER,
+    ):
+        self.audio_format = audio_format
+        self.buffer_sec = buffer_sec
+        self.frames_per_buffer = frames_per_buffer
+        self._buffer = RingBuffer(int(buffer_sec * audio_format.bytes_per_sec))
+        self._audio_interface = None
+        self._audio_stream = None
+        self._pa_continue = None
+        self._lock = threading.Lock()
+
+    def write(self, pcm: bytes, audio_format: Union[AudioFormat, None] = None):
+        """Queue raw PCM for playback. Blocks while the buffer is full.
+
+        If the format differs from the current one, the buffered audio is
+        played out first, then the output stream is reopened. A `stop()`
+        while blocked drops the rest of `pcm`.
+        """
+        with self._lock:
+            if audio_format is not None and audio_format != self.audio_format:
+                self._buffer.wait_empty()
+                self._close_stream()
+                self.audio_format = audio_format
+                self._buffer = RingBuffer(int(self.buffer_sec * audio_format.bytes_per_sec))
+            if self._audio_stream is None:
+                self._open_stream()
+            buffer = self._buffer
+        buffer.write(pcm, block=True)
+
+    def write_wav(self, wav_bytes: bytes):
+        """Queue WAV bytes (e.g. from LINEAR16 TTS) for playback."""
+        pcm, audio_format = wav_to_pcm(wav_bytes)
+        self.write(pcm, audio_format)
+
+    def write_chunks(self, chunks: Iterable[bytes], audio_format: AudioFormat):
+        """Queue PCM chunks as they arrive, e.g. from streaming TTS."""
+        for chunk in chunks:
+            self.write(chunk, audio_format)
+
+    def flush(self, timeout: Union[float, None] = None) -> bool:
+        """Block until all queued audio has been played. Returns False on timeout."""
+        return self._buffer.wait_empty(timeout)
+
+    def stop(self):
+        """Stop playback immediately, dropping any queued audio."""
+        self._buffer.clear()
+
+    @property
+    def is_playing(self) -> bool:
+        return len(self._buffer) > 0
+
+    def close(self):
+        with self._lock:
+            self._buffer.close()
+            self._close_stream()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _open_stream(self):
+        # Imported here so the rest of the module works without pyaudio,
+        # e.g. serving or the fake backend on a machine without audio devices.
+        import pyaudio
+
+        self._pa_continue = pyaudio.paContinue
+        self._audio_interface = pyaudio.PyAudio()
+        self._audio_stream = self._audio_interface.open(
+            format=self._audio_interface.get_format_from_width(
+                self.audio_format.sample_width
+            ),
+            channels=self.audio_format.channels,
+            rate=self.audio_format.rate,
+            output=True,
+            frames_per_buffer=self.frames_per_buffer,
+            stream_callback=self._drain_buffer,
+        )
+
+    def _close_stream(self):
+        if self._audio_stream is None:
+            return
+        self._audio_stream.stop_stream()
+        self._audio_stream.close()
+        self._audio_interface.terminate()
+        self._audio_stream = None
+        self._audio_interface = None
+
+    def _drain_buffer(self, in_data, frame_count, time_info, status_flags):
+        """Fill the output device buffer, padding with silence."""
+        out = bytearray(
+            frame_count * self.audio_format.channels * self.audio_format.sample_width
+        )
+        self._buffer.read_into(out)
+        return bytes(out), self._pa_continue
+
+
+class NullAudioSink(AudioSink):
+    """AudioSink that drops the audio, e.g. for the fake backend.
+
+    Opens no output device, so the voice loop runs headless (CI, load tests).
+    """
+
+    def write(self, pcm: bytes, audio_format: Union[AudioFormat, None] = None):
+        if audio_format is not None:
+            self.audio_format = audio_format
+
+    def flush(self, timeout: Union[float, None] = None) -> bool:
+        return True
+
+    def close(self):
+        pass
@@ -0,0 +1,119 @@
+"""Select the ASR, TTS and LLM backends of the voice loop.
+
+"live" uses Google Cloud Speech, Google Cloud TTS and OpenAI. "fake" uses
+in-process stand-ins with simulated latency and errors, so the voice loop
+can be load tested on a laptop or CI box without network access or spend.
+
+Usage:
+    ctx = Settings.from_env_file(backend="fake", fake_error_rate=0.05)
+    backends = get_backends(ctx, voice_name="en-GB-Neural2-D")
+    backends.completer.complete("Hello")
+"""
+from dataclasses import dataclass
+from typing import List, Union
+
+from voicebots.asr import google_transcriber
+from voicebots.asr.continuous_transcriber import ContinuousGoogleTranscriber
+from voicebots.asr.transcriber import FakeTranscriber, Transcriber
+from voicebots.asr.vad import VoiceActivityDetector
+from voicebots.completer import Completer, FakeCompleter
+from voicebots.oai_client import OAIClient
+from voicebots.settings import Settings
+from voicebots.speech import google_speech
+from voicebots.speech.synthesizer import (
+    FakeSynthesizer,
+    GoogleSynthesizer,
+    Synthesizer,
+)
+
+BACKENDS = ["live", "fake"]
+
+
+@dataclass
+class Backends:
+    transcriber: Transcriber
+    synthesizer: Synthesizer
+    completer: Completer
+
+
+def get_backends(
+    ctx: Settings,
+    voice_name: str,
+    tts_cache=None,
+    llm_cache=None,
+    supported_phrases: Union[List[str], None] = None,
+    vad: bool = False,
+) -> Backends:
+    """Build the backends selected by `ctx.backend`.
+
+    Args:
+        ctx: Settings. `backend` selects the backends, and `fake_error_rate`
+            and `fake_seed` configure the fakes.
+        voice_name: Voice of the synthesizer.
+        tts_cache: Optional; TTSCache for the live synthesizer.
+        llm_cache: Optional; CompletionCache for the live completer.
+        supported_phrases: Optional; Phrases the live transcriber listens for.
+        vad: Optional; Use local voice activity detection in the live transcriber.
+
+    Returns:
+        Backends.
+    """
+    transcriber = get_transcriber(ctx, supported_phrases=supported_phrases, vad=vad)
+    if ctx.backend == "fake":
+        return Backends(
+            transcriber=transcriber,
+            synthesizer=FakeSynthesizer(
+                error_rate=ctx.fake_error_rate, seed=ctx.fake_seed
+            ),
+            completer=FakeCompleter(
+                error_rate=ctx.fake_error_rate, seed=ctx.fake_seed
+            ),
+        )
+    return Backends(
+        transcriber=transcriber,
+        synthesizer=GoogleSynthesizer(
+            voice_name,
+            cache=tts_cache,
+            encoding=google_speech.AudioEncoding[ctx.tts_encoding],
+        ),
+        completer=OAIClient(
+            ctx.openai_api_key,
+            organization_id=ctx.openai_org_id,
+            cache=llm_cache,
+            cache_namespace=ctx.llm_cache_namespace,
+        ),
+    )
+
+
+def get_transcriber(
+    ctx: Settings,
+    supported_phrases: Union[List[str], None] = None,
+    vad: bool = False,
+) -> Transcriber:
+    """Build the transcriber selected by `ctx.backend`.
+
+    Transcribers keep per-call state (the VAD, the fake's script), so
+    servers build one per session. See `get_backends` for the args.
+    """
+    if ctx.backend == "fake":
+        return FakeTranscriber(error_rate=ctx.fake_error_rate, seed=ctx.fake_seed)
+    if ctx.backend != "live":
+        raise ValueError(
+            f"Unknown backend {ctx.backend}. Expected one of {BACKENDS}"
+        )
+    if ctx.asr_continuous:
+        # Google endpoints utterances in the continuous stream, so no VAD
+        return ContinuousGoogleTranscriber(
+            supported_phrases=supported_phrases or [],
+            encoding=ctx.asr_encoding,
+        )
+    return google_transcriber.GoogleTranscriber(
+        supported_phrases=supported_phrases or [],
+        single_utterance=False,
+        encoding=ctx.asr_encoding,
+        vad=(
+            VoiceActivityDetector(rate=google_transcriber.RECOGNITION_RATE)
+            if vad
+            else None
+        ),
+    )
@@ -4,7 +4,7 @@ import json
 import os
 import logging
 import uuid
-from typing import Callable, Dict, List, Tuple
+from typing import Callable, Dict, Iterator, List, Tuple, Union
 
 from prompt_toolkit import PromptSession
 from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
@@ -14,7 +14,11 @@ from prompt_toolkit.styles import Style
 from prompt_toolkit import HTML
 from prompt_toolkit import print_formatted_text as print
 
-from voicebots.oai_client import OAIClient
+from voicebots import response_cache as rc
+from voicebots import text_utils, tracing
+from voicebots.completer import Completer
+from voicebots.conversation import Conversation, render_turn
+from voicebots.intent_router import IntentRouter
 
 
 def get_default_style():
@@ -129,33 +133,154 @@ def handle_end_chat(turns_: List[Dict], user_name: str, write_text_fn: Callable)
 
 
 def build_transcript(turns: List[Dict]) -> str:
-    clean_lines = []
-    for turn in turns:
-        text = turn["text"].strip().replace("\n", " ")
-        clean_lines.append(f"{turn['speaker'].capitalize()}: {text}")
-    return "\n".join(clean_lines)
+    return "\n".join(render_turn(turn) for turn in turns)
 
 
-def chat_prompt(
+def build_chat_prompt(
     turns: List[Dict],
     user_name: str,
     agent_name: str,
     prompt_text: str,
-    prompt_config: dict,
-    oai_client: OAIClient
+    conversation: Union[Conversation, None] = None,
 ) -> str:
+    """Fill in the prompt template with the dialogue history.
+
+    With a Conversation, the transcript is built incrementally and trimmed
+    to its token budget.
+    """
+    if conversation is not None:
+        return conversation.build_prompt(turns)
     transcript = build_transcript(turns)
-    prompt_text = prompt_text.format(
+    return prompt_text.format(
         transcript=transcript, user_name=user_name, agent_name=agent_name
     )
-    logging.debug("Prompt:\n{prompt_text}")
+
+
+def chat_complete(
+    turns: List[Dict],
+    user_name: str,
+    agent_name: str,
+    prompt_text: str,
+    prompt_config: dict,
+    oai_client: Completer,
+    response_cache: Union[rc.ResponseCache, None] = None,
+    conversation: Union[Conversation, None] = None,
+    router: Union[IntentRouter, None] = None,
+) -> Dict:
+    """Like `chat_prompt`, but returns the full post-processed OAI result."""
+    agent_text = _get_routed_response(router, turns)
+    if agent_text is None:
+        agent_text = _get_cached_response(response_cache, prompt_text, turns)
+    if agent_text is not None:
+        return rc.cached_result(agent_text)
+
+    scope = rc.get_prompt_scope(prompt_text)
+    prompt_text = build_chat_prompt(
+        turns, user_name, agent_name, prompt_text, conversation=conversation
+    )
+    logging.debug(f"Prompt:\n{prompt_text}")
     result = oai_client.complete(
-        prompt_text, request_tag=f"chat_turn[len(turns)]", **prompt_config
+        prompt_text, request_tag=f"chat_turn[{len(turns)}]", **prompt_config
+    )
+    logging.debug(f"OAI Result:\n{result}")
+    if response_cache is not None:
+        response_cache.set(scope, turns, result["top_answer_text"].strip())
+    return result
+
+
+def chat_prompt(
+    turns: List[Dict],
+    user_name: str,
+    agent_name: str,
+    prompt_text: str,
+    prompt_config: dict,
+    oai_client: Completer,
+    response_cache: Union[rc.ResponseCache, None] = None,
+    conversation: Union[Conversation, None] = None,
+    router: Union[IntentRouter, None] = None,
+) -> str:
+    result = chat_complete(
+        turns=turns,
+        user_name=user_name,
+        agent_name=agent_name,
+        prompt_text=prompt_text,
+        prompt_config=prompt_config,
+        oai_client=oai_client,
+        response_cache=response_cache,
+        conversation=conversation,
+        router=router,
     )
-    logging.debug("OAI Result:\n{result}")
     return result["top_answer_text"].strip()
 
 
+def chat_prompt_stream(
+    turns: List[Dict],
+    user_name: str,
+    agent_name: str,
+    prompt_text: str,
+    prompt_config: dict,
+    oai_client: Completer,
+    response_cache: Union[rc.ResponseCache, None] = None,
+    conversation: Union[Conversation, None] = None,
+    router: Union[IntentRouter, None] = None,
+) -> Iterator[str]:
+    """Like `chat_prompt`, but yields the agent's reply one sentence at a time.
+
+    Sentences are yielded as soon as the LLM finishes generating them, so
+    the caller can synthesize and play the first sentence while the rest
+    of the reply is still streaming in.
+    """
+    agent_text = _get_routed_response(router, turns)
+    if agent_text is not None:
+        # In one piece, so it matches the audio prewarmed by the router
+        yield agent_text
+        return
+    agent_text = _get_cached_response(response_cache, prompt_text, turns)
+    if agent_text is not None:
+        yield from text_utils.iter_sentences([agent_text])
+        return
+
+    scope = rc.get_prompt_scope(prompt_text)
+    # The caller may append the reply to turns while we are still streaming
+    turns = list(turns)
+    prompt_text = build_chat_prompt(
+        turns, user_name, agent_name, prompt_text, conversation=conversation
+    )
+    logging.debug(f"Prompt:\n{prompt_text}")
+    deltas = oai_client.complete_stream(
+        prompt_text, request_tag=f"chat_turn[{len(turns)}]", **prompt_config
+    )
+    sentences = []
+    for sentence in text_utils.iter_sentences(deltas):
+        sentences.append(sentence)
+        yield sentence
+    # Only cache complete replies, not ones the user interrupted
+    if response_cache is not None:
+        response_cache.set(scope, turns, " ".join(sentences))
+
+
+def _get_routed_response(
+    router: Union[IntentRouter, None], turns: List[Dict]
+) -> Union[str, None]:
+    if router is None:
+        return None
+    with tracing.span("intent_router") as span:
+        route = router.route(turns)
+        span.set(intent=route.intent if route is not None else None)
+    return route.text if route is not None else None
+
+
+def _get_cached_response(
+    response_cache: Union[rc.ResponseCache, None], prompt_text: str, turns: List[Dict]
+) -> Union[str, None]:
+    if response_cache is None:
+        return None
+    with tracing.span("response_cache") as span:
+        agent_text = response_cache.get(rc.get_prompt_scope(prompt_text), turns)
+        span.set(cache_hit=agent_text is not None)
+    return agent_text
+
+
 def get_prompt_text(prompt_file: str, user_name: str, agent_name: str) -> Tuple[str, str]:
     """Get the prompt text from a file.
 
@@ -0,0 +1,133 @@
+"""LLM completion backends.
+
+`Completer` is the interface the voice loop uses to call the LLM. OAIClient
+implements it against the OpenAI API. FakeCompleter is a local stand-in with
+configurable latency, streaming speed and error rate, for load testing
+without network access or API spend.
+"""
+import random
+import threading
+import time
+from typing import Dict, Iterator, List, Union
+
+from voicebots.simulation import Latency, maybe_fail
+
+# Fake LLM timing
+FAKE_FIRST_TOKEN_LATENCY = Latency(median_sec=0.4, p95_sec=1.2)
+FAKE_TOKEN_SEC = 0.02  # ~50 tokens/sec
+
+# Replies of the FakeCompleter are made from these sentences
+FAKE_REPLY_SENTENCES = [
+    "That's a great question.",
+    "Let me think about that for a second.",
+    "I would start by looking at the simplest option first.",
+    "Most people find that the second approach works better in practice.",
+    "Could you tell me a bit more about what you have in mind?",
+    "Sure, I can help with that.",
+]
+FAKE_SENTENCES_PER_REPLY = 3
+
+
+class Completer:
+    """Base class for all LLM completion backends."""
+
+    def complete(
+        self, prompt: str, request_tag: Union[str, None] = None, **params
+    ) -> Dict:
+        """Complete the prompt.
+
+        Args:
+            prompt: Prompt to complete.
+            request_tag: Optional; Tag for logging and debugging.
+            params: Completion params, e.g. max_tokens, stop. See `OAIClient.complete`.
+
+        Returns:
+            Dict. Post-processed result, see `oai_client.postprocess_completion_response`.
+        """
+        raise NotImplementedError
+
+    def complete_stream(
+        self, prompt: str, request_tag: Union[str, None] = None, **params
+    ) -> Iterator[str]:
+        """Like `complete`, but yields text deltas as they are generated."""
+        raise NotImplementedError
+
+
+class FakeCompleter(Completer):
+    """Local stand-in for the OpenAI Completion API.
+
+    Replies are a few canned sentences, one token per word. Waits for the
+    sampled first token latency, then generates `1 / token_sec` tokens/sec.
+    """
+
+    def __init__(
+        self,
+        first_token_latency: Latency = FAKE_FIRST_TOKEN_LATENCY,
+        token_sec: float = FAKE_TOKEN_SEC,
+        error_rate: float = 0.0,
+        sentences_per_reply: int = FAKE_SENTENCES_PER_REPLY,
+        seed: Union[int, None] = None,
+    ):
+        """Instantiate the FakeCompleter.
+
+        Args:
+            first_token_latency: Optional; Time until the first token.
+            token_sec: Optional; Time to generate each following token.
+            error_rate: Optional; Fraction of requests that fail with a FakeServiceError.
+            sentences_per_reply: Optional; Length of each reply.
+            seed: Optional; Seed for reproducible latencies, errors and replies.
+        """
+        self.first_token_latency = first_token_latency
+        self.token_sec = token_sec
+        self.error_rate = error_rate
+        self.sentences_per_reply = sentences_per_reply
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def complete(
+        self,
+        prompt: str,
+        request_tag: Union[str, None] = None,
+        max_tokens: int = 256,
+        **params,
+    ) -> Dict:
+        start = time.time()
+        tokens = list(self.complete_stream(prompt, request_tag, max_tokens, **params))
+        text = "".join(tokens)
+        num_prompt_tokens = len(prompt.split())
+        usage = {
+            "prompt_tokens": num_prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": num_prompt_tokens + len(tokens),
+        }
+        return {
+            "response": {"choices": [{"text": text}], "usage": usage},
+            "num_tokens": usage["total_tokens"],
+            "all_answers_text": [text],
+            "top_answer_text": text,
+            "latency": round(time.time() - start, 3),
+            "usage": usage,
+            "request_params": dict(prompt=prompt, max_tokens=max_tokens, **params),
+            "request_tag": request_tag,
+        }
+
+    def complete_stream(
+        self,
+        prompt: str,
+        request_tag: Union[str, None] = None,
+        max_tokens: int = 256,
+        **params,
+    ) -> Iterator[str]:
+        with self._lock:
+            maybe_fail(self._rng, self.error_rate, "completion")
+            latency = self.first_token_latency.sample(self._rng)
+            sentences = self._rng.sample(
+                FAKE_REPLY_SENTENCES,
+                min(self.sentences_per_reply, len(FAKE_REPLY_SENTENCES)),
+            )
+        time.sleep(latency)
+        words: List[str] = " ".join(sentences).split()[:max_tokens]
+        for i, word in enumerate(words):
+            if i > 0:
+                time.sleep(self.token_sec)
+            yield word if i == 0 else " " + word
@@ -0,0 +1,195 @@
+"""Policy-controlled cache of LLM completions.
+
+Wraps a diskcache store with a CachePolicy, which decides what is read from
+and written to the cache, and for how long:
+
+- TTL, and a size limit with an eviction policy, so the cache doesn't grow
+  without bound on long-running hosts.
+- Include/exclude by model and request tag, and a max temperature, since
+  reusing sampled completions (e.g. temperature=0.7 chat turns) defeats
+  sampling.
+- Read-only and write-only modes.
+
+Usage:
+    cache = CompletionCache.open("/tmp/disk_cache", CachePolicy(ttl_sec=86400))
+    oai_client = OAIClient(api_key, cache=cache)
+    print(cache.stats)
+"""
+import fnmatch
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Union
+
+import diskcache
+
+CACHE_MODES = ["read_write", "read_only", "write_only", "off"]
+
+DEFAULT_SIZE_LIMIT = 2**30  # 1GB
+DEFAULT_EVICTION_POLICY = "least-recently-used"
+
+
+@dataclass
+class CachePolicy:
+    """Decides which completions are read from and written to the cache.
+
+    Attributes:
+        mode (str): "read_write", "read_only", "write_only" or "off".
+        ttl_sec (float): Entries expire after this long. None keeps them until evicted.
+        size_limit (int): Max size of the cache in bytes, see `CompletionCache.open`.
+        eviction_policy (str): diskcache eviction policy, e.g. "least-recently-used".
+        max_temperature (float): Requests sampled above this temperature bypass the
+            cache. None caches every temperature.
+        include_models (List[str]): If set, only these models are cached.
+        exclude_models (List[str]): Models that are never cached.
+        include_tags (List[str]): If set, only request tags matching one of these
+            glob patterns (e.g. "chat_turn*") are cached.
+        exclude_tags (List[str]): Request tag glob patterns that are never cached.
+    """
+
+    mode: str = "read_write"
+    ttl_sec: Union[float, None] = None
+    size_limit: int = DEFAULT_SIZE_LIMIT
+    eviction_policy: str = DEFAULT_EVICTION_POLICY
+    max_temperature: Union[float, None] = None
+    include_models: Union[List[str], None] = None
+    exclude_models: Union[List[str], None] = None
+    include_tags: Union[List[str], None] = None
+    exclude_tags: Union[List[str], None] = None
+
+    def __post_init__(self):
+        if self.mode not in CACHE_MODES:
+            raise ValueError(
+                f"Unknown cache mode {self.mode}. Expected one of {CACHE_MODES}"
+            )
+
+    def applies_to(self, params: Dict, request_tag: Union[str, None] = None) -> bool:
+        """Whether a request with these params may use the cache at all."""
+        if self.mode == "off":
+            return False
+        temperature = params.get("temperature") or 0
+        if self.max_temperature is not None and temperature > self.max_temperature:
+            return False
+        model = params.get("model")
+        if self.include_models is not None and model not in self.include_models:
+            return False
+        if self.exclude_models is not None and model in self.exclude_models:
+            return False
+        tag = request_tag or ""
+        if self.include_tags is not None and not _matches_any(tag, self.include_tags):
+            return False
+        if self.exclude_tags is not None and _matches_any(tag, self.exclude_tags):
+            return False
+        return True
+
+    def can_read(self, params: Dict, request_tag: Union[str, None] = None) -> bool:
+        return self.mode != "write_only" and self.applies_to(params, request_tag)
+
+    def can_write(self, params: Dict, request_tag: Union[str, None] = None) -> bool:
+        return self.mode != "read_only" and self.applies_to(params, request_tag)
+
+
+@dataclass
+class CompletionCacheStats:
+    """Counters for the completion cache.
+
+    Attributes:
+        hits (int): Lookups served from the cache.
+        misses (int): Lookups not found in the cache.
+        bypassed (int): Requests the policy kept from reading the cache.
+        writes (int): Responses added to the cache.
+        evictions (int): Entries removed because they expired or the cache was full.
+    """
+
+    hits: int = 0
+    misses: int = 0
+    bypassed: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class CompletionCache:
+    """A diskcache store of completion responses, governed by a CachePolicy."""
+
+    def __init__(
+        self, cache: diskcache.Cache, policy: Union[CachePolicy, None] = None
+    ):
+        """Instantiate the CompletionCache.
+
+        Args:
+            cache: Underlying store. To count evictions accurately, open it with
+                `cull_limit=0` (see `CompletionCache.open`), so entries are only
+                removed by `cull()`.
+            policy: Optional; Defaults to caching everything, without expiry.
+        """
+        self.cache = cache
+        self.policy = policy or CachePolicy()
+        self.stats = CompletionCacheStats()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(
+        cls, directory: str, policy: Union[CachePolicy, None] = None
+    ) -> "CompletionCache":
+        """Open a cache in `directory`, with the policy's size limit and eviction policy."""
+        policy = policy or CachePolicy()
+        cache = diskcache.Cache(
+            directory=directory,
+            size_limit=policy.size_limit,
+            eviction_policy=policy.eviction_policy,
+            # Evict in `set()` instead, where evictions are counted
+            cull_limit=0,
+        )
+        return cls(cache, policy)
+
+    def __len__(self) -> int:
+        return len(self.cache)
+
+    def get(
+        self, cache_key: str, params: Dict, request_tag: Union[str, None] = None
+    ) -> Union[Dict, None]:
+        """Get a cached completion response, or None."""
+        if not self.policy.can_read(params, request_tag):
+            with self._lock:
+                self.stats.bypassed += 1
+            return None
+        entry = self.cache.get(cache_key)
+        with self._lock:
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+        return entry["response"]
+
+    def set(
+        self,
+        cache_key: str,
+        params: Dict,
+        response: Dict,
+        request_tag: Union[str, None] = None,
+    ):
+        """Cache a completion response, if the policy allows it.
+
+        The params are stored alongside the response, for debugging.
+        """
+        if not self.policy.can_write(params, request_tag):
+            return
+        self.cache.set(
+            cache_key,
+            {"params": params, "response": response},
+            expire=self.policy.ttl_sec,
+            tag=request_tag,
+        )
+        # Remove expired entries, and the least recently used ones if over the size limit
+        num_evicted = self.cache.cull()
+        with self._lock:
+            self.stats.writes += 1
+            self.stats.evictions += num_evicted
+
+
+def _matches_any(text: str, patterns: List[str]) -> bool:
+    return any(fnmatch.fnmatchcase(text, pattern) for pattern in patterns)
@@ -0,0 +1,297 @@
+"""Incrementally built, token-budgeted prompt for a chat.
+
+`chat_utils.build_chat_prompt` renders the whole dialogue every turn, so
+prompt construction is O(history), and long calls eventually overflow the
+model context. A Conversation renders each turn once, counts its tokens,
+and keeps a window of recent turns within a token budget. When the window
+overflows, the oldest turns are dropped (optionally folded into a running
+summary) until it is back under `TRIM_TARGET` of the budget, so the window
+start only moves every few turns.
+
+Summaries are written by the LLM on a background thread, so the turn that
+overflows the window doesn't wait for them. Until a summary is ready, the
+prompt has the previous summary, without the turns just dropped.
+
+Token counts use tiktoken if it is installed, otherwise an estimate from
+the number of characters.
+
+Usage:
+    conversation = Conversation(prompt_text, "User", "Assistant", 3000)
+    prompt = conversation.build_prompt(turns)
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Union
+
+from voicebots.completer import Completer
+
+logger = logging.getLogger(__name__)
+
+# Tokens left for the prompt: text-davinci-003 context, minus the reply
+DEFAULT_MAX_PROMPT_TOKENS = 4097 - 256
+# When over budget, trim the window to this fraction of the budget
+TRIM_TARGET = 0.75
+# Tokenizer of the text-davinci models
+DEFAULT_ENCODING = "p50k_base"
+# Estimate used without tiktoken
+CHARS_PER_TOKEN = 4
+
+SUMMARY_PROMPT = """Summarize the conversation below in a few sentences. Keep names, facts and anything the user asked for.
+
+{summary}
+{transcript}
+
+Summary:"""
+SUMMARY_CONFIG = {"temperature": 0.0, "max_tokens": 128}
+
+
+def get_token_counter(encoding_name: str = DEFAULT_ENCODING) -> Callable[[str], int]:
+    """Get a function that counts the tokens of a text.
+
+    Uses tiktoken if it is installed, otherwise estimates from the length.
+    """
+    try:
+        import tiktoken
+    except ImportError:
+        logger.info("tiktoken is not installed, estimating token counts")
+        return lambda text: -(-len(text) // CHARS_PER_TOKEN)
+    encoding = tiktoken.get_encoding(encoding_name)
+    return lambda text: len(encoding.encode(text))
+
+
+def get_summarizer(
+    completer: Completer, **params
+) -> Callable[[str, List[Dict]], str]:
+    """Get a `summarize` function for a Conversation, which calls the LLM.
+
+    Args:
+        completer: LLM backend, e.g. OAIClient.
+        params: Optional; Completion params. Defaults to SUMMARY_CONFIG.
+    """
+    params = {**SUMMARY_CONFIG, **params}
+
+    def summarize(summary: str, turns: List[Dict]) -> str:
+        prompt = SUMMARY_PROMPT.format(
+            summary=f"Earlier: {summary}" if summary else "",
+            transcript="\n".join(render_turn(turn) for turn in turns),
+        )
+        result = completer.complete(prompt, request_tag="summary", **params)
+        return result["top_answer_text"]
+
+    return summarize
+
+
+def render_turn(turn: Dict) -> str:
+    """Render a turn as a line of the transcript, e.g. "User: Hi there"."""
+    text = turn["text"].strip().replace("\n", " ")
+    return f"{turn['speaker'].capitalize()}: {text}"
+
+
+class Conversation:
+    """Rendered transcript of a chat, within a token budget.
+
+    The dialogue turns stay a plain list of dicts owned by the caller (the
+    CLI, TurnEngine, etc). `build_prompt(turns)` picks up turns appended
+    since the last call, and re-renders the turns from the first one that
+    changed, e.g. the last turn after a speculative prompt for an interim
+    transcript.
+    """
+
+    def __init__(
+        self,
+        prompt_text: str,
+        user_name: str,
+        agent_name: str,
+        max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+        count_tokens: Union[Callable[[str], int], None] = None,
+        summarize: Union[Callable[[str, List[Dict]], str], None] = None,
+    ):
+        """Instantiate the Conversation.
+
+        Args:
+            prompt_text: Prompt template, with a {transcript} variable.
+            user_name: Name of the user in the prompt.
+            agent_name: Name of the agent in the prompt.
+            max_prompt_tokens: Optional; Token budget of the whole prompt.
+            count_tokens: Optional; Counts the tokens of a text. Defaults to
+                `get_token_counter()`.
+            summarize: Optional; Given the current summary and the turns
+                being dropped from the window, returns a new summary, which
+                is kept at the top of the transcript. Called on a background
+                thread. Turns are simply dropped if None.
+        """
+        self.prompt_text = prompt_text
+        self.user_name = user_name
+        self.agent_name = agent_name
+        self.max_prompt_tokens = max_prompt_tokens
+        self.count_tokens = count_tokens or get_token_counter()
+        self.summarize = summarize
+        self.summary = ""
+
+        # Rendered lines and their token counts, one per turn
+        self._turns: List[Dict] = []
+        self._lines: List[str] = []
+        self._line_tokens: List[int] = []
+        # Index of the first turn in the window
+        self._start = 0
+        self._transcript = ""
+        self._window_tokens = 0
+        self._summary_tokens = 0
+        self._template_tokens = self.count_tokens(self._format(""))
+        # Turns dropped from the window, but not yet summarized
+        self._unsummarized: List[Dict] = []
+        self._summary_future: Union[Future, None] = None
+        self._executor = None
+        if summarize is not None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="summarize"
+            )
+        # Speculative prompts are built in a background thread
+        self._lock = threading.Lock()
+
+    @property
+    def transcript(self) -> str:
+        """Transcript of the turns in the window, after the summary if any."""
+        if self.summary:
+            return f"{self._summary_line()}\n{self._transcript}"
+        return self._transcript
+
+    @property
+    def num_tokens(self) -> int:
+        """Tokens of the prompt, as of the last `build_prompt`."""
+        return self._template_tokens + self._summary_tokens + self._window_tokens
+
+    @property
+    def num_dropped_turns(self) -> int:
+        """Turns trimmed from the start of the window."""
+        return self._start
+
+    def build_prompt(self, turns: List[Dict]) -> str:
+        """Fill in the prompt template with the dialogue history in the window.
+
+        Same format as `chat_utils.build_chat_prompt`.
+        """
+        with self._lock:
+            self._sync(turns)
+            self._apply_summary()
+            if self.num_tokens > self.max_prompt_tokens:
+                self._trim()
+            return self._format(self.transcript)
+
+    def wait_for_summary(self, timeout: Union[float, None] = None):
+        """Block until the turns dropped so far are in the summary.
+
+        E.g. before saving the summary. The next `build_prompt` uses it.
+
+        Raises:
+            concurrent.futures.TimeoutError: A summary took over `timeout`.
+        """
+        while True:
+            with self._lock:
+                future = self._summary_future
+                if future is None:
+                    return
+                if future.done():
+                    self._apply_summary()
+                    continue
+            future.exception(timeout)
+
+    def _format(self, transcript: str) -> str:
+        return self.prompt_text.format(
+            transcript=transcript, user_name=self.user_name, agent_name=self.agent_name
+        )
+
+    def _summary_line(self) -> str:
+        return f"(Summary of the conversation so far: {self.summary})"
+
+    def _sync(self, turns: List[Dict]):
+        # Keep the rendered turns up to the first one that changed. Turns
+        # dropped from the window are assumed unchanged, so this compares at
+        # most the window, not the whole history. With fewer turns than were
+        # dropped, the history was rewritten (e.g. a new chat), so compare all.
+        limit = min(len(self._turns), len(turns))
+        num_kept = self._start if len(turns) > self._start else 0
+        while num_kept < limit and self._turns[num_kept] == turns[num_kept]:
+            num_kept += 1
+        if num_kept < len(self._turns):
+            self._truncate(num_kept)
+        for turn in turns[num_kept:]:
+            self._append(turn)
+
+    def _append(self, turn: Dict):
+        line = render_turn(turn)
+        # Count the newline that joins it to the previous line
+        num_tokens = self.count_tokens(line) + 1
+        self._turns.append(dict(turn))
+        self._lines.append(line)
+        self._line_tokens.append(num_tokens)
+        self._transcript = f"{self._transcript}\n{line}" if self._transcript else line
+        self._window_tokens += num_tokens
+
+    def _truncate(self, num_turns: int):
+        del self._turns[num_turns:]
+        del self._lines[num_turns:]
+        del self._line_tokens[num_turns:]
+        if num_turns < self._start:
+            # Turns already dropped from the window changed, start over
+            logger.info("Dialogue history was rewritten, resetting the window")
+            self._start = 0
+            self._set_summary("")
+            # Ignore the summary in progress, if any
+            self._unsummarized = []
+            self._summary_future = None
+        self._render_window()
+
+    def _render_window(self):
+        self._transcript = "\n".join(self._lines[self._start :])
+        self._window_tokens = sum(self._line_tokens[self._start :])
+
+    def _trim(self):
+        target = self.max_prompt_tokens * TRIM_TARGET
+        start = self._start
+        window_tokens = self._window_tokens
+        # Always keep the last turn, even if it alone is over budget
+        while (
+            start < len(self._lines) - 1
+            and self._template_tokens + self._summary_tokens + window_tokens > target
+        ):
+            window_tokens -= self._line_tokens[start]
+            start += 1
+        dropped = self._turns[self._start : start]
+        logger.info(
+            f"Prompt over budget ({self.num_tokens} > {self.max_prompt_tokens} "
+            f"tokens), dropping {len(dropped)} turns"
+        )
+        self._start = start
+        self._render_window()
+        if self.summarize is not None and dropped:
+            self._unsummarized.extend(dropped)
+            self._start_summary()
+
+    def _start_summary(self):
+        # One summary at a time, each building on the previous one
+        if self._summary_future is not None or not self._unsummarized:
+            return
+        dropped, self._unsummarized = self._unsummarized, []
+        self._summary_future = self._executor.submit(
+            self.summarize, self.summary, dropped
+        )
+
+    def _apply_summary(self):
+        future = self._summary_future
+        if future is None or not future.done():
+            return
+        self._summary_future = None
+        try:
+            self._set_summary(future.result())
+        except Exception:
+            # The dropped turns are lost, as without a summarizer
+            logger.exception("Failed to summarize the dropped turns")
+        self._start_summary()
+
+    def _set_summary(self, summary: str):
+        self.summary = summary.strip()
+        self._summary_tokens = (
+            self.count_tokens(self._summary_line()) + 1 if self.summary else 0
+        )
@@ -0,0 +1,116 @@
+"""Shared, long-lived Google Cloud clients.
+
+Constructing a `TextToSpeechClient` or `SpeechClient` sets up a new gRPC
+channel and auth, which we don't want to pay for on every utterance. This
+module keeps one client per API for the whole process, created lazily and
+shared across threads (gRPC channels are thread-safe). Channels are created
+with keepalive pings, so idle connections between turns aren't dropped.
+
+Usage:
+    from voicebots import google_clients
+    client = google_clients.get_tts_client()
+
+    # Point at a local stand-in, e.g. for benchmarks
+    google_clients.set_default_registry(
+        google_clients.GoogleClientRegistry(tts_endpoint="localhost:50051", insecure=True)
+    )
+"""
+import logging
+import threading
+from typing import Dict, List, Tuple, Union
+
+import grpc
+from google.cloud import speech, texttospeech
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHANNEL_OPTIONS = [
+    # Send keepalive pings so idle channels stay open between turns
+    ("grpc.keepalive_time_ms", 30000),
+    ("grpc.keepalive_timeout_ms", 10000),
+    ("grpc.keepalive_permit_without_calls", 1),
+    ("grpc.http2.max_pings_without_data", 0),
+    # Same as the generated transports
+    ("grpc.max_send_message_length", -1),
+    ("grpc.max_receive_message_length", -1),
+]
+
+
+class GoogleClientRegistry:
+    """Lazily creates and caches one client per Google API. Thread-safe."""
+
+    def __init__(
+        self,
+        tts_endpoint: Union[str, None] = None,
+        speech_endpoint: Union[str, None] = None,
+        insecure: bool = False,
+        channel_options: List[Tuple[str, int]] = DEFAULT_CHANNEL_OPTIONS,
+    ):
+        """Instantiate the GoogleClientRegistry.
+
+        Args:
+            tts_endpoint: Optional; "host:port" of the Text-to-Speech API.
+            speech_endpoint: Optional; "host:port" of the Speech-to-Text API.
+            insecure: Optional; Use plaintext channels without credentials,
+                e.g. for a local stand-in server.
+            channel_options: gRPC channel arguments.
+        """
+        self.tts_endpoint = tts_endpoint
+        self.speech_endpoint = speech_endpoint
+        self.insecure = insecure
+        self.channel_options = channel_options
+        self._clients: Dict[type, object] = {}
+        self._lock = threading.Lock()
+
+    def get_tts_client(self) -> texttospeech.TextToSpeechClient:
+        return self._get_client(texttospeech.TextToSpeechClient, self.tts_endpoint)
+
+    def get_speech_client(self) -> speech.SpeechClient:
+        return self._get_client(speech.SpeechClient, self.speech_endpoint)
+
+    def close(self):
+        """Close all channels. Clients are recreated on next use."""
+        with self._lock:
+            clients, self._clients = self._clients, {}
+        for client in clients.values():
+            client.transport.close()
+
+    def _get_client(self, client_cls, endpoint: Union[str, None]):
+        client = self._clients.get(client_cls)
+        if client is not None:
+            return client
+        with self._lock:
+            if client_cls not in self._clients:
+                self._clients[client_cls] = self._create_client(client_cls, endpoint)
+            return self._clients[client_cls]
+
+    def _create_client(self, client_cls, endpoint: Union[str, None]):
+        endpoint = endpoint or f"{client_cls.DEFAULT_ENDPOINT}:443"
+        logger.debug(f"Creating {client_cls.__name__} for {endpoint}")
+        transport_cls = client_cls.get_transport_class("grpc")
+        if self.insecure:
+            channel = grpc.insecure_channel(endpoint, options=self.channel_options)
+        else:
+            channel = transport_cls.create_channel(
+                endpoint, options=self.channel_options
+            )
+        return client_cls(transport=transport_cls(host=endpoint, channel=channel))
+
+
+_default_registry = GoogleClientRegistry()
+
+
+def set_default_registry(registry: GoogleClientRegistry):
+    """Replace the process-wide registry, e.g. to change endpoints."""
+    global _default_registry
+    _default_registry = registry
+
+
+def get_tts_client() -> texttospeech.TextToSpeechClient:
+    """Get the process-wide Text-to-Speech client."""
+    return _default_registry.get_tts_client()
+
+
+def get_speech_client() -> speech.SpeechClient:
+    """Get the process-wide Speech-to-Text client."""
+    return _default_registry.get_speech_client()
@@ -0,0 +1,364 @@
+"""Answer common turns locally, without calling the LLM.
+
+Greetings, thanks, "say that again", "goodbye" and the like don't need the
+LLM. The IntentRouter matches the user's last utterance against a set of
+intents, and returns a templated reply, so the turn skips the LLM round
+trip. Replies that don't depend on the dialogue are synthesized ahead of
+time (see `prewarm`), so they also skip TTS. Anything else falls through
+to the LLM.
+
+An utterance is routed to an intent if:
+- It is one of the intent's phrases (ignoring case and punctuation), or
+- It is short, and its character trigrams are similar enough to one of
+  the intent's examples (nearest neighbour). Intents whose reply repeats
+  the agent's last line are only matched by phrase.
+
+Intents can require the agent's previous line to contain one of their
+`after` phrases, e.g. "no" only ends the call after "anything else?".
+
+Usage:
+    router = IntentRouter(DEFAULT_INTENTS, user_name="Brendan")
+    router.prewarm(synthesize)
+    route = router.route(turns)
+    if route is not None:
+        speak(route.text)
+"""
+import json
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, FrozenSet, List, Tuple, Union
+
+from voicebots.phrase_matcher import PhraseMatcher, tokenize
+from voicebots.response_cache import normalize_utterance, trigram_similarity, trigrams
+
+logger = logging.getLogger(__name__)
+
+# Min trigram similarity to an example for the classifier to route
+DEFAULT_SIMILARITY_THRESHOLD = 0.8
+# Longer utterances always go to the LLM
+DEFAULT_MAX_UTTERANCE_WORDS = 6
+# Concurrent synthesis requests when prewarming replies
+PREWARM_WORKERS = 4
+# Template variable of the agent's previous line, e.g. for "repeat that"
+LAST_AGENT_TEXT = "{last_agent_text}"
+
+
+@dataclass
+class Intent:
+    """Something the user says that has a canned reply.
+
+    Attributes:
+        name (str): E.g. "greeting".
+        responses (List[str]): Reply templates, one is picked at random. Can
+            use {user_name}, {agent_name} and {last_agent_text}.
+        phrases (List[str]): Utterances that route to this intent.
+        examples (List[str]): Utterances for the similarity classifier, which
+            aren't matched as phrases. Not used if a reply has
+            {last_agent_text}.
+        after (List[str]): If set, only route when the agent's previous line
+            contains one of these phrases.
+        end_call (bool): The reply ends the call.
+    """
+
+    name: str
+    responses: List[str]
+    phrases: List[str] = field(default_factory=list)
+    examples: List[str] = field(default_factory=list)
+    after: List[str] = field(default_factory=list)
+    end_call: bool = False
+
+
+DEFAULT_INTENTS = [
+    Intent(
+        "greeting",
+        responses=["Hi {user_name}! What can I do for you?"],
+        phrases=["hi", "hello", "hey", "hi there", "hello there", "hey there"],
+        examples=["good morning", "good afternoon", "good evening", "hiya"],
+    ),
+    Intent(
+        "thanks",
+        responses=["You're welcome!", "No problem!"],
+        phrases=["thanks", "thank you", "thanks a lot", "thank you so much"],
+        examples=["thanks so much", "thank you very much", "cheers"],
+    ),
+    Intent(
+        "repeat",
+        responses=[LAST_AGENT_TEXT],
+        phrases=[
+            "what",
+            "pardon",
+            "come again",
+            "say that again",
+            "repeat that",
+            "can you repeat that",
+            "could you repeat that",
+            "what did you say",
+            "sorry what was that",
+            "can you say that again",
+        ],
+    ),
+    Intent(
+        "hold",
+        responses=["Sure, take your time."],
+        phrases=["hold on", "one moment", "one second", "just a second"],
+        examples=["hang on", "give me a second", "wait a minute"],
+    ),
+    Intent(
+        "nothing_else",
+        responses=["Alright. Thanks for calling, goodbye!"],
+        phrases=["no", "nope", "no thanks", "no thank you", "thats all", "thats it"],
+        after=["anything else"],
+        end_call=True,
+    ),
+    Intent(
+        "goodbye",
+        responses=["Goodbye {user_name}, talk to you soon!"],
+        phrases=["bye", "bye bye", "goodbye", "good bye", "bye now"],
+        examples=["see you later", "talk to you later", "see ya"],
+        end_call=True,
+    ),
+]
+
+
+@dataclass
+class Route:
+    """A routed turn.
+
+    Attributes:
+        intent (str): Name of the intent.
+        text (str): The agent's reply.
+        end_call (bool): The reply ends the call.
+    """
+
+    intent: str
+    text: str
+    end_call: bool = False
+
+
+@dataclass
+class IntentRouterStats:
+    """Counters for the intent router.
+
+    Attributes:
+        rule_hits (int): Turns routed by a phrase.
+        classifier_hits (int): Turns routed by similarity to an example.
+        misses (int): Turns passed to the LLM.
+        intents (Dict[str, int]): Turns routed to each intent.
+    """
+
+    rule_hits: int = 0
+    classifier_hits: int = 0
+    misses: int = 0
+    intents: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.rule_hits + self.classifier_hits
+        lookups = hits + self.misses
+        return hits / lookups if lookups else 0.0
+
+
+def load_intents(path: str) -> List[Intent]:
+    """Load intents from a JSON file with a list of `Intent` fields."""
+    with open(path) as f:
+        return [Intent(**intent) for intent in json.load(f)]
+
+
+class IntentRouter:
+    """Routes the user's last utterance to an intent's reply. Thread-safe."""
+
+    def __init__(
+        self,
+        intents: List[Intent],
+        user_name: str = "User",
+        agent_name: str = "Assistant",
+        similarity_threshold: Union[float, None] = DEFAULT_SIMILARITY_THRESHOLD,
+        max_utterance_words: int = DEFAULT_MAX_UTTERANCE_WORDS,
+        seed: Union[int, None] = None,
+    ):
+        """Instantiate the IntentRouter.
+
+        Args:
+            intents: E.g. DEFAULT_INTENTS, or `load_intents(path)`.
+            user_name: Optional; Filled into the reply templates.
+            agent_name: Optional; Filled into the reply templates.
+            similarity_threshold: Optional; Min trigram similarity (0-1) to an
+                intent's examples. Only exact phrases if None.
+            max_utterance_words: Optional; Don't route longer utterances.
+            seed: Optional; Seed of the reply picked for each turn.
+        """
+        self.intents = {intent.name: intent for intent in intents}
+        self.user_name = user_name
+        self.agent_name = agent_name
+        self.similarity_threshold = similarity_threshold
+        self.max_utterance_words = max_utterance_words
+        self.stats = IntentRouterStats()
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+        # Phrase -> intents, since the same phrase can follow different lines
+        self._phrase_intents: Dict[str, List[Intent]] = {}
+        self._examples: List[Tuple[FrozenSet[str], Intent]] = []
+        self._after: Dict[str, PhraseMatcher] = {}
+        for intent in intents:
+            for phrase in intent.phrases:
+                key = " ".join(tokenize(phrase))
+                self._phrase_intents.setdefault(key, []).append(intent)
+            # A near miss of a reply that echoes the agent (e.g. "what did you
+            # see" for "what did you say") would skip a real question
+            if not any(LAST_AGENT_TEXT in template for template in intent.responses):
+                for example in intent.examples:
+                    example_trigrams = trigrams(normalize_utterance(example))
+                    self._examples.append((example_trigrams, intent))
+            if intent.after:
+                self._after[intent.name] = PhraseMatcher(intent.after)
+        self._phrases = PhraseMatcher(self._phrase_intents)
+
+    def route(self, turns: List[Dict]) -> Union[Route, None]:
+        """Get the reply to the user's last utterance, or None for the LLM.
+
+        Args:
+            turns: Dialogue turns, ending with the user's utterance.
+        """
+        if not turns or turns[-1]["speaker"] != "user":
+            return None
+        match = self._find(turns)
+        text = ""
+        if match is not None:
+            intent, by_rule, last_agent_text = match
+            with self._lock:
+                template = self._random.choice(intent.responses)
+            # E.g. "repeat that" before the agent said anything
+            text = self._format(template, last_agent_text)
+        with self._lock:
+            if not text:
+                self.stats.misses += 1
+                return None
+            if by_rule:
+                self.stats.rule_hits += 1
+            else:
+                self.stats.classifier_hits += 1
+            self.stats.intents[intent.name] = self.stats.intents.get(intent.name, 0) + 1
+        logger.info(f"Routed '{turns[-1]['text']}' to intent {intent.name}")
+        return Route(intent.name, text, end_call=intent.end_call)
+
+    def ends_call(self, turns: List[Dict]) -> bool:
+        """True if the user's last utterance is an intent that ends the call.
+
+        Doesn't count towards the stats.
+        """
+        if not turns or turns[-1]["speaker"] != "user":
+            return False
+        match = self._find(turns)
+        return match is not None and match[0].end_call
+
+    def static_responses(self) -> List[str]:
+        """Replies that don't depend on the dialogue, e.g. to pre-synthesize."""
+        texts = [
+            self._format(template, "")
+            for intent in self.intents.values()
+            for template in intent.responses
+            if LAST_AGENT_TEXT not in template
+        ]
+        return list(dict.fromkeys(texts))
+
+    def prewarm(
+        self, synthesize: Callable[[str], bytes], max_workers: int = PREWARM_WORKERS
+    ) -> int:
+        """Synthesize the static replies, so the synthesizer's cache has them.
+
+        Returns:
+            Number of replies synthesized. Failures are logged and skipped.
+        """
+
+        def _synthesize(text: str) -> bool:
+            try:
+                synthesize(text)
+                return True
+            except Exception:
+                logger.exception(f"Failed to prewarm reply '{text}'")
+                return False
+
+        texts = self.static_responses()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            num_synthesized = sum(executor.map(_synthesize, texts))
+        logger.info(f"Prewarmed {num_synthesized}/{len(texts)} intent replies")
+        return num_synthesized
+
+    def _find(self, turns: List[Dict]) -> Union[Tuple[Intent, bool, str], None]:
+        """Find the intent of the user's last utterance.
+
+        Returns:
+            The intent, True if it matched a phrase rather than by similarity,
+            and the agent's previous line. None if no intent matched.
+        """
+        utterance = normalize_utterance(turns[-1]["text"])
+        if not utterance or len(utterance.split()) > self.max_utterance_words:
+            return None
+        last_agent_text = next(
+            (t["text"] for t in reversed(turns[:-1]) if t["speaker"] == "agent"), ""
+        )
+        phrase = self._phrases.fullmatch(utterance)
+        if phrase is not None:
+            for intent in self._phrase_intents[phrase]:
+                if self._follows(intent, last_agent_text):
+                    return intent, True, last_agent_text
+        if self.similarity_threshold is None:
+            return None
+        query = trigrams(utterance)
+        best, best_similarity = None, self.similarity_threshold
+        for example_trigrams, intent in self._examples:
+            similarity = trigram_similarity(query, example_trigrams)
+            if similarity >= best_similarity and self._follows(intent, last_agent_text):
+                best, best_similarity = intent, similarity
+        return (best, False, last_agent_text) if best is not None else None
+
+    def _follows(self, intent: Intent, last_agent_text: str) -> bool:
+        after = self._after.get(intent.name)
+        return after is None or after.search(last_agent_text) is not None
+
+    def _format(self, template: str, last_agent_text: str) -> str:
+        return template.format(
+            user_name=self.user_name,
+            agent_name=self.agent_name,
+            last_agent_text=last_agent_text,
+        ).strip()
+
+
+if __name__ == "__main__":
+    """Check that common turns are routed, and common questions go to the LLM.
+
+    Usage:
+        python -m voicebots.intent_router
+    """
+    router = IntentRouter(DEFAULT_INTENTS, seed=0)
+    last_line = {"speaker": "agent", "text": "It costs ten dollars."}
+    routed = {
+        "Hi there!": "greeting",
+        "Thank you very much.": "thanks",
+        "What did you say?": "repeat",
+        "Hang on.": "hold",
+        "See you later!": "goodbye",
+    }
+    questions = [
+        "What did you see?",
+        "What did you pay?",
+        "What time is it?",
+        "What can you do?",
+        "How are you?",
+        "Who are you?",
+        "What do you mean?",
+        "Can you help me?",
+        "See you at nine?",
+        "Tell me more.",
+    ]
+    for text, intent in routed.items():
+        route = router.route([last_line, {"speaker": "user", "text": text}])
+        assert route is not None and route.intent == intent, (text, route)
+    for text in questions:
+        route = router.route([last_line, {"speaker": "user", "text": text}])
+        assert route is None, (text, route)
+    print(f"OK: {router.stats}")
@@ -11,32 +11,65 @@ This has an example of "activity detection" which would handle silence and chain
 https://github.com/daanzu/dragonfly/blob/kaldi/dragonfly/engines/backend_kaldi/audio.py (example with Kaldi)
 """
 import logging
-import queue
+from dataclasses import dataclass
 
 import pyaudio
 
+from voicebots.ring_buffer import RingBuffer
+
 logger = logging.getLogger(__name__)
 
+SAMPLE_WIDTH = 2  # paInt16
+
+# Seconds of audio buffered before the oldest audio is overwritten
+BUFFER_SEC = 5
+
+
+@dataclass
+class MicrophoneStats:
+    """Back-pressure stats of a MicrophoneStream.
+
+    Attributes:
+        overruns (int): Times the consumer fell behind and unread audio was overwritten.
+        overrun_bytes (int): Bytes of audio lost to overruns.
+        depth_bytes (int): Bytes currently buffered.
+        max_depth_bytes (int): Most bytes ever buffered.
+    """
+
+    overruns: int
+    overrun_bytes: int
+    depth_bytes: int
+    max_depth_bytes: int
+
 
 class MicrophoneStream:
-    """Opens a recording stream as a generator yielding the audio chunks."""
+    """Opens a recording stream as a generator yielding the audio chunks.
 
-    def __init__(self, rate, chunk):
+    Audio is captured into a preallocated ring buffer, and the generator yields
+    fixed-size frames as memoryviews over a reused buffer, so steady-state
+    capture doesn't allocate per chunk.
+    """
+
+    def __init__(self, rate, chunk, frame_size=None, buffer_sec=BUFFER_SEC):
         """Initialize the MicrophoneStream
 
         Args:
             rate (int): Sampling rate. Number of frames per second.
             chunk (int): Buffer length. Number of frames to accumulate before returning audio to caller.
+            frame_size (int): Optional; Number of frames per yielded chunk. Defaults to `chunk`.
+            buffer_sec (float): Optional; Seconds of audio to buffer if the consumer falls behind.
         """
         self._rate = rate
         self._chunk = chunk
+        self._frame_size = frame_size or chunk
 
         # Create a thread-safe buffer of audio data
-        self._buff = queue.Queue()
+        self._buff = RingBuffer(int(rate * buffer_sec) * SAMPLE_WIDTH)
         self.closed = True
 
     def open_stream(self):
         logger.debug("Turning ON the microphone!")
+        self._buff = RingBuffer(self._buff.capacity)
         self._audio_interface = pyaudio.PyAudio()
         self._audio_stream = self._audio_interface.open(
             format=pyaudio.paInt16,
@@ -61,35 +94,43 @@ class MicrophoneStream:
         self.closed = True
         # Signal the generator to terminate so that the client's
         # streaming_recognize method will not block the process termination.
-        self._buff.put(None)
+        self._buff.close()
         self._audio_interface.terminate()
+        if self._buff.overruns:
+            logger.warning(f"Microphone buffer overruns: {self.stats}")
+
+    @property
+    def stats(self) -> MicrophoneStats:
+        return MicrophoneStats(
+            overruns=self._buff.overruns,
+            overrun_bytes=self._buff.overrun_bytes,
+            depth_bytes=len(self._buff),
+            max_depth_bytes=self._buff.max_depth,
+        )
 
     def _fill_buffer(self, in_data, frame_count, time_info, status_flags):
-        """Continuously collect data from the audio stream, into the buffer."""
-        self._buff.put(in_data)
+        """Continuously collect data from the audio stream, into the buffer.
+
+        Never blocks the audio thread: if the consumer falls behind, the
+        oldest audio is overwritten (and counted in `stats`).
+        """
+        self._buff.write(in_data, block=False)
         return None, pyaudio.paContinue
 
     def generator(self):
-        while not self.closed:
-            # Use a blocking get() to ensure there's at least one chunk of
-            # data, and stop iteration if the chunk is None, indicating the
-            # end of the audio stream.
-            chunk = self._buff.get()
-            if chunk is None:
+        """Yield audio in frames of `frame_size`.
+
+        Each chunk is a memoryview over a reused buffer, only valid until the
+        next chunk is requested. Copy it (e.g. `bytes(chunk)`) to keep it.
+        The last chunk may be shorter, once the stream is closed.
+        """
+        frame = memoryview(bytearray(self._frame_size * SAMPLE_WIDTH))
+        while True:
+            # Block until a full frame is available, or the stream is closed.
+            num_bytes = self._buff.read_into(frame, block=True)
+            if num_bytes == 0:
                 return
-            data = [chunk]
-
-            # Now consume whatever other data's still buffered.
-            while True:
-                try:
-                    chunk = self._buff.get(block=False)
-                    if chunk is None:
-                        return
-                    data.append(chunk)
-                except queue.Empty:
-                    break
-
-            yield b"".join(data)
+            yield frame[:num_bytes]
 
     def __enter__(self):
         return self.open_stream()
@@ -9,14 +9,18 @@ Caching is useful for speeding up development and saving money :)
 - Retries and backoff
 - Rate limiting
 - Response postprocessing
+- Async client with pooled connections (AsyncOAIClient)
 """
 import argparse
+import asyncio
+import json
 import logging
 import pprint
 import re
 import time
-from typing import Dict, List, Union
+from typing import Dict, Iterator, List, Union
 
+import aiohttp
 import diskcache
 import openai
 from tenacity import (
@@ -27,11 +31,44 @@ from tenacity import (
     wait_random_exponential,
 )
 
+from voicebots import text_utils, tracing
+from voicebots.completer import Completer
+from voicebots.single_flight import AsyncSingleFlight, SingleFlight, SingleFlightStats
+from voicebots.completion_cache import (
+    CachePolicy,
+    CompletionCache,
+    CompletionCacheStats,
+)
+
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
 INSERT_API_TOKEN = "[insert]"
 
+# Max concurrent requests (and pooled HTTP connections) per AsyncOAIClient
+DEFAULT_MAX_CONCURRENCY = 64
+
+# Bump when the cached entry format or response postprocessing changes, so
+# stale entries are never served.
+CACHE_VERSION = 2
+DEFAULT_CACHE_NAMESPACE = "default"
+
+RETRYABLE_ERRORS = (
+    openai.error.APIConnectionError,
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+# Retry transient API errors with exponential backoff
+retry_api_errors = retry(
+    stop=stop_after_attempt(2),
+    wait=wait_random_exponential(multiplier=1, max=10),
+    retry=retry_if_exception_type(RETRYABLE_ERRORS),
+    before_sleep=before_sleep_log(logger, log_level=logging.INFO),
+)
+
 
 def postprocess_completion_response(response: Dict) -> Dict:
     """Postprocess OAI completion API response.
@@ -49,30 +86,120 @@ def postprocess_completion_response(response: Dict) -> Dict:
     }
 
 
-class OAIClient:
+def get_cache_key(params: dict, namespace: str = DEFAULT_CACHE_NAMESPACE) -> str:
+    """Get cache key for given completion parameters.
+
+    The params are serialized to canonical JSON and hashed, so the key has a
+    fixed size however long the prompt (transcript) grows.
+
+    Args:
+        params (dict): Keyword arguments to pass to `openai.Completion.create()`.
+        namespace (str): Separates caches that must not share entries, e.g. per
+            deployment, or after changing how prompts are built.
+
+    Returns:
+        str. Cache key.
+    """
+    canonical = json.dumps(
+        params, sort_keys=True, separators=(",", ":"), default=str
+    )
+    digest = text_utils.hash_normalized_text(canonical, normalize=False)
+    return f"completion:v{CACHE_VERSION}:{namespace}:{digest}"
+
+
+def get_completion_cache(
+    cache: Union[diskcache.Cache, CompletionCache, None],
+    policy: Union[CachePolicy, None] = None,
+) -> Union[CompletionCache, None]:
+    """Wrap a plain diskcache store in a CompletionCache with the given policy.
+
+    A CompletionCache is used as is, unless a policy is given. Then its store
+    is wrapped in a new CompletionCache (with its own stats), since the cache
+    may be shared with clients that use its policy.
+    """
+    if cache is None:
+        return None
+    if isinstance(cache, CompletionCache):
+        if policy is None:
+            return cache
+        cache = cache.cache
+    return CompletionCache(cache, policy)
+
+
+def build_completion_params(
+    prompt: str,
+    stop: Union[List[str], None] = None,
+    n: int = 1,
+    best_of: int = 1,
+    top_p: int = 1,
+    temperature: float = 0,
+    logprobs: int | None = None,
+    max_tokens: int = 256,
+    frequency_penalty: int = 0,
+    presence_penalty: int = 0,
+    model: str = "text-davinci-002",
+    logit_bias: Union[Dict[str, float], None] = None,
+    mode: str = "complete",  # or insert
+) -> Dict:
+    """Build the keyword arguments for `openai.Completion.create()`.
+
+    For INSERT requests, the prompt is split on the `[insert]` token into
+    a prompt and suffix.
+    """
+    suffix = None
+    if mode == "insert":
+        if prompt.lower().count(INSERT_API_TOKEN) != 1:
+            raise ValueError(
+                f"Prompt must contain exactly 1 instance of '{INSERT_API_TOKEN}' token."
+            )
+        prompt, suffix = re.split(r"\[insert\]", prompt, flags=re.IGNORECASE)
+
+    return dict(
+        prompt=prompt,
+        model=model,
+        n=n,
+        top_p=top_p,
+        best_of=best_of,  # we always return all answers so best_of = n
+        temperature=temperature,
+        logprobs=logprobs,
+        max_tokens=max_tokens,
+        frequency_penalty=frequency_penalty,
+        presence_penalty=presence_penalty,
+        stop=stop,
+        logit_bias=logit_bias or {},
+        suffix=suffix,
+    )
+
+
+class OAIClient(Completer):
     def __init__(
         self,
         api_key: str,
         organization_id: str = None,
-        cache: Union[diskcache.Cache, None] = None,
+        cache: Union[diskcache.Cache, CompletionCache, None] = None,
+        cache_namespace: str = DEFAULT_CACHE_NAMESPACE,
+        cache_policy: Union[CachePolicy, None] = None,
     ):
-        self._disk_cache = cache
+        self._disk_cache = get_completion_cache(cache, cache_policy)
+        self._cache_namespace = cache_namespace
+        # Identical concurrent requests share one API call
+        self._flights = SingleFlight(name="OAI")
         openai.organization = organization_id
         openai.api_key = api_key
 
-    def _get_cache_key(self, params: dict) -> str:
-        """Get cache key for given parameters.
+    @property
+    def cache_stats(self) -> Union[CompletionCacheStats, None]:
+        """Hit, miss and eviction counters of the cache, if any."""
+        return self._disk_cache.stats if self._disk_cache is not None else None
 
-        Args:
-            params (dict): Keyword arguments to pass to `openai.Completion.create()`.
-            request_key (str): Key to use for cache lookup and logging.
+    @property
+    def coalesce_stats(self) -> SingleFlightStats:
+        """Counters of requests that shared an identical request in flight."""
+        return self._flights.stats
 
-        Returns:
-            str. Cache key.
-        """
-        return f"completion:" + ":".join(
-            [f"{k}={v}" for k, v in sorted(params.items())]
-        )
+    def _get_cache_key(self, params: dict) -> str:
+        """Get cache key for given parameters. See `get_cache_key`."""
+        return get_cache_key(params, namespace=self._cache_namespace)
 
     def _completion_api_call(self, params: dict) -> Dict:
         """Wrapper so we can time the API call w/o cache."""
@@ -82,11 +209,24 @@ class OAIClient:
         response["latency"] = round(time.time() - start, 3)
         return response
 
+    @retry_api_errors
+    def _completion_api_stream_call(self, params: dict) -> Iterator[Dict]:
+        """Open a streaming completion request.
+
+        Only opening the stream is retried. Errors raised mid-stream are
+        passed on to the caller, since tokens may already have been consumed.
+        """
+        logging.debug(f"Calling streaming API with params: {params}")
+        return openai.Completion.create(stream=True, **params)  # type:ignore
+
     def _complete_with_cache(
         self, params: dict, request_tag: Union[str, None] = None
     ) -> Dict:
         """Call Completion API with caching.
 
+        Identical requests made while one is in flight wait for it, and share
+        its response, even when sampling (temperature > 0).
+
         Args:
             params (dict): See `openai.Completion` documentation.
             request_tag (Union[str, None], optional): Tag for easier request debugging/logging.
@@ -95,40 +235,36 @@ class OAIClient:
             Dict: OAI Completion API response.
         """
         cache_key = self._get_cache_key(params)
+        return self._flights.do(
+            cache_key, self._complete_uncoalesced, cache_key, params, request_tag
+        )
 
+    def _complete_uncoalesced(
+        self, cache_key: str, params: dict, request_tag: Union[str, None]
+    ) -> Dict:
         logging.debug(f"[OAI:{request_tag}] Prompt:\n{params['prompt']}")
 
-        if self._disk_cache is not None:
-            cached_response: Dict = self._disk_cache.get(cache_key)  # type: ignore
-            if cached_response is not None:
-                logging.info(
-                    f"[OAI:{request_tag}] Cache hit!. Entries {len(self._disk_cache)}"
-                )
-                return cached_response
+        with tracing.span(
+            "llm", request_tag=request_tag, model=params["model"]
+        ) as span:
+            if self._disk_cache is not None:
+                cached_response = self._disk_cache.get(cache_key, params, request_tag)
+                if cached_response is not None:
+                    logging.info(f"[OAI:{request_tag}] Cache hit!")
+                    span.set(cache_hit=True)
+                    return cached_response
 
-        response = self._completion_api_call(params)
+            response = self._completion_api_call(params)
+            span.set(cache_hit=False, tokens=response["usage"]["total_tokens"])
 
         logging.debug(f"[OAI:{request_tag}] Latency: {response['latency']}.")
 
         if self._disk_cache is not None:
-            self._disk_cache.set(cache_key, response, tag=request_tag)
+            self._disk_cache.set(cache_key, params, response, request_tag)
 
         return response
 
-    @retry(
-        stop=stop_after_attempt(2),
-        wait=wait_random_exponential(multiplier=1, max=10),
-        retry=retry_if_exception_type(
-            (
-                openai.error.APIConnectionError,
-                openai.error.RateLimitError,
-                openai.error.ServiceUnavailableError,
-                openai.error.Timeout,
-                openai.error.TryAgain,
-            )
-        ),
-        before_sleep=before_sleep_log(logger, log_level=logging.INFO),
-    )
+    @retry_api_errors
     def complete(
         self,
         prompt: str,
@@ -164,28 +300,20 @@ class OAIClient:
         """
         logging.debug(f"[OAI] Prompt:\n{prompt}")
 
-        suffix = None
-        if mode == "insert":
-            if prompt.lower().count(INSERT_API_TOKEN) != 1:
-                raise ValueError(
-                    f"Prompt must contain exactly 1 instance of '{INSERT_API_TOKEN}' token."
-                )
-            prompt, suffix = re.split(r"\[insert\]", prompt, flags=re.IGNORECASE)
-
-        params = dict(
+        params = build_completion_params(
             prompt=prompt,
-            model=model,
+            stop=stop,
             n=n,
+            best_of=best_of,
             top_p=top_p,
-            best_of=best_of,  # we always return all answers so best_of = n
             temperature=temperature,
             logprobs=logprobs,
             max_tokens=max_tokens,
             frequency_penalty=frequency_penalty,
             presence_penalty=presence_penalty,
-            stop=stop,
-            logit_bias=logit_bias or {},
-            suffix=suffix,
+            model=model,
+            logit_bias=logit_bias,
+            mode=mode,
         )
 
         logging.debug(f"[OAI:{request_tag}] Params: {params}")
@@ -202,6 +330,270 @@ class OAIClient:
 
         return result
 
+    def complete_stream(
+        self,
+        prompt: str,
+        stop: Union[List[str], None] = None,
+        top_p: int = 1,
+        temperature: float = 0,
+        max_tokens: int = 256,
+        frequency_penalty: int = 0,
+        presence_penalty: int = 0,
+        model: str = "text-davinci-002",
+        logit_bias: Union[Dict[str, float], None] = None,
+        request_tag: Union[str, None] = None,
+    ) -> Iterator[str]:
+        """Stream a completion from the OpenAI Completion API.
+
+        Takes the same params as `complete()`, but yields text deltas as soon
+        as the API returns them, so callers can start acting on the beginning
+        of a completion while the rest is still being generated.
+
+        A cached response (written by `complete()`) is yielded as a single
+        delta. Streamed completions are not written to the cache, since the
+        streaming API does not report token usage.
+
+        Identical requests made while one is streaming share its stream: they
+        get the deltas generated so far at once, then the rest as they arrive.
+
+        Args:
+            prompt (str): Prompt to complete.
+            request_tag (str): Request Tag to use for cache lookup and logging.
+
+        Yields:
+            str. Text deltas of the top (and only) completion.
+        """
+        params = build_completion_params(
+            prompt=prompt,
+            stop=stop,
+            top_p=top_p,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+            model=model,
+            logit_bias=logit_bias,
+        )
+
+        logging.debug(f"[OAI:{request_tag}] Streaming params: {params}")
+
+        cache_key = self._get_cache_key(params)
+        yield from self._flights.do_stream(
+            cache_key, self._complete_stream_uncoalesced, cache_key, params, request_tag
+        )
+
+    def _complete_stream_uncoalesced(
+        self, cache_key: str, params: dict, request_tag: Union[str, None]
+    ) -> Iterator[str]:
+        with tracing.span(
+            "llm", request_tag=request_tag, model=params["model"], stream=True
+        ) as span:
+            cached_response = None
+            if self._disk_cache is not None:
+                cached_response = self._disk_cache.get(cache_key, params, request_tag)
+            if cached_response is not None:
+                logging.info(f"[OAI:{request_tag}] Cache hit!")
+                span.set(cache_hit=True)
+                yield postprocess_completion_response(cached_response)[
+                    "top_answer_text"
+                ]
+                return
+
+            start = time.time()
+            first_token_latency = None
+            num_chunks = 0
+            for chunk in self._completion_api_stream_call(params):
+                num_chunks += 1
+                delta = chunk["choices"][0]["text"]
+                if not delta:
+                    continue
+                if first_token_latency is None:
+                    first_token_latency = round(time.time() - start, 3)
+                    span.set(first_token_sec=first_token_latency)
+                yield delta
+            # The streaming API doesn't report usage. Each chunk is ~1 token.
+            span.set(cache_hit=False, tokens=num_chunks)
+
+        logging.debug(
+            f"[OAI:{request_tag}] First token latency: {first_token_latency}. "
+            f"Total latency: {round(time.time() - start, 3)}."
+        )
+
+
+class AsyncOAIClient:
+    """Asyncio variant of `OAIClient`.
+
+    Unlike `OAIClient`, credentials are stored per instance (not on the global
+    `openai` module), so clients for different keys/orgs can coexist in one
+    process. All requests share a pooled `aiohttp` session, and a semaphore
+    bounds the number of requests in flight.
+
+    Usage:
+        async with AsyncOAIClient(api_key, cache=cache) as client:
+            result = await client.complete("Hello, how are you?")
+            results = await client.complete_many(
+                [dict(prompt="Hi"), dict(prompt="Bye", max_tokens=10)]
+            )
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        organization_id: str = None,
+        cache: Union[diskcache.Cache, CompletionCache, None] = None,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        cache_namespace: str = DEFAULT_CACHE_NAMESPACE,
+        cache_policy: Union[CachePolicy, None] = None,
+    ):
+        self._api_key = api_key
+        self._organization_id = organization_id
+        self._disk_cache = get_completion_cache(cache, cache_policy)
+        self._cache_namespace = cache_namespace
+        self._max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._session: Union[aiohttp.ClientSession, None] = None
+        self._flights = AsyncSingleFlight(name="AsyncOAI")
+
+    @property
+    def coalesce_stats(self) -> SingleFlightStats:
+        """Counters of requests that shared an identical request in flight."""
+        return self._flights.stats
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Lazily create the pooled HTTP session (requires a running loop)."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._max_concurrency)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def close(self):
+        """Close the pooled HTTP session."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        await self.close()
+
+    @retry_api_errors
+    async def _completion_api_call(self, params: dict) -> Dict:
+        """Wrapper so we can time the API call w/o cache."""
+        logging.debug(f"Calling API with params: {params}")
+        async with self._semaphore:
+            # openai reads the session from a context variable, which is
+            # local to the current task.
+            openai.aiosession.set(self._get_session())
+            start = time.time()
+            response: Dict = await openai.Completion.acreate(  # type:ignore
+                api_key=self._api_key,
+                organization=self._organization_id,
+                **params,
+            )
+        response["latency"] = round(time.time() - start, 3)
+        return response
+
+    async def _complete_with_cache(
+        self, params: dict, request_tag: Union[str, None] = None
+    ) -> Dict:
+        """Call Completion API with caching. See `OAIClient._complete_with_cache`."""
+        cache_key = get_cache_key(params, namespace=self._cache_namespace)
+        return await self._flights.do(
+            cache_key, self._complete_uncoalesced, cache_key, params, request_tag
+        )
+
+    async def _complete_uncoalesced(
+        self, cache_key: str, params: dict, request_tag: Union[str, None]
+    ) -> Dict:
+        logging.debug(f"[OAI:{request_tag}] Prompt:\n{params['prompt']}")
+
+        # diskcache is SQLite, so keep its reads and writes off the event loop
+        if self._disk_cache is not None:
+            cached_response = await asyncio.to_thread(
+                self._disk_cache.get, cache_key, params, request_tag
+            )
+            if cached_response is not None:
+                logging.info(f"[OAI:{request_tag}] Cache hit!")
+                return cached_response
+
+        response = await self._completion_api_call(params)
+
+        logging.debug(f"[OAI:{request_tag}] Latency: {response['latency']}.")
+
+        if self._disk_cache is not None:
+            await asyncio.to_thread(
+                self._disk_cache.set, cache_key, params, response, request_tag
+            )
+
+        return response
+
+    async def complete(
+        self,
+        prompt: str,
+        stop: Union[List[str], None] = None,
+        n: int = 1,
+        best_of: int = 1,
+        top_p: int = 1,
+        temperature: float = 0,
+        logprobs: int | None = None,
+        max_tokens: int = 256,
+        frequency_penalty: int = 0,
+        presence_penalty: int = 0,
+        model: str = "text-davinci-002",
+        logit_bias: Union[Dict[str, float], None] = None,
+        request_tag: Union[str, None] = None,
+        mode: str = "complete",  # or insert
+    ) -> Dict:
+        """Call OpenAI Completion API. See `OAIClient.complete`.
+
+        Returns:
+            Dict. Post-processed response, same shape as `OAIClient.complete`.
+        """
+        params = build_completion_params(
+            prompt=prompt,
+            stop=stop,
+            n=n,
+            best_of=best_of,
+            top_p=top_p,
+            temperature=temperature,
+            logprobs=logprobs,
+            max_tokens=max_tokens,
+            frequency_penalty=frequency_penalty,
+            presence_penalty=presence_penalty,
+            model=model,
+            logit_bias=logit_bias,
+            mode=mode,
+        )
+
+        logging.debug(f"[OAI:{request_tag}] Params: {params}")
+
+        response = await self._complete_with_cache(params, request_tag)
+
+        result = postprocess_completion_response(response)
+        result["request_params"] = params
+        result["request_tag"] = request_tag
+        return result
+
+    async def complete_many(
+        self, requests: List[Dict], return_exceptions: bool = False
+    ) -> List[Dict]:
+        """Fan out many completion requests concurrently.
+
+        Args:
+            requests: List of keyword arguments for `complete()`.
+            return_exceptions: If True, failed requests return their exception
+                instead of cancelling the whole batch.
+
+        Returns:
+            List of results, in the same order as `requests`.
+        """
+        return await asyncio.gather(
+            *[self.complete(**kwargs) for kwargs in requests],
+            return_exceptions=return_exceptions,
+        )
+
 
 if __name__ == "__main__":
     """Example Usage of OAIClient.
@@ -0,0 +1,189 @@
+"""Compiled matcher for command phrases in transcripts.
+
+Phrases are normalized and split into tokens, and compiled into an
+Aho-Corasick automaton over the tokens, so a transcript is matched against
+any number of phrases in one pass over its tokens. This is cheap enough to
+run on every interim result.
+
+With `max_edits=1`, transcript tokens that aren't in the phrases (e.g.
+"goodby", "exitt") are mapped to a phrase token within one edit, using an
+index of the tokens with one character deleted. Only tokens of at least
+`MIN_FUZZY_TOKEN_CHARS` are matched approximately, since short words are
+too often one edit away from each other.
+
+Usage:
+    matcher = PhraseMatcher(["end call", "goodbye"], max_edits=1)
+    matcher.fullmatch("End call.")  # "end call"
+    matcher.search("ok goodbye then")  # "goodbye"
+"""
+import logging
+import re
+from collections import deque
+from typing import Dict, Iterable, List, Set, Union
+
+from voicebots import text_utils
+
+logger = logging.getLogger(__name__)
+
+# Words of a normalized text. Apostrophes are dropped, e.g. "don't" -> "dont"
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Shorter tokens are only matched exactly
+MIN_FUZZY_TOKEN_CHARS = 4
+
+# Approximate token lookups remembered, per matcher
+FUZZY_CACHE_SIZE = 10000
+
+# Id of transcript tokens that aren't in any phrase
+_UNKNOWN = -1
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase words of text, without punctuation."""
+    return TOKEN_RE.findall(text_utils.normalize_text(text).replace("'", ""))
+
+
+def _deletes(token: str) -> Set[str]:
+    """Variants of token with one character deleted."""
+    return {token[:i] + token[i + 1 :] for i in range(len(token))}
+
+
+class PhraseMatcher:
+    """Finds command phrases in text, in time linear in the text's length.
+
+    Attributes:
+        phrases: The phrases, as given.
+        max_edits: Character edits allowed per token, 0 or 1.
+    """
+
+    def __init__(self, phrases: Iterable[str], max_edits: int = 0):
+        """Compile the phrases.
+
+        Args:
+            phrases: Command phrases, e.g. ["end call", "repeat that"].
+            max_edits: Optional; 1 to also match tokens one character
+                insertion, deletion or substitution away from a phrase token.
+        """
+        if max_edits not in (0, 1):
+            raise ValueError(f"max_edits must be 0 or 1, got {max_edits}")
+        self.phrases = list(phrases)
+        self.max_edits = max_edits
+        self._vocab: Dict[str, int] = {}
+        # Trie of token ids. Node 0 is the root.
+        self._goto: List[Dict[int, int]] = [{}]
+        self._fail: List[int] = [0]
+        # Phrase ending at each node, and the longest one ending at its suffixes
+        self._phrase: List[Union[int, None]] = [None]
+        self._output: List[Union[int, None]] = [None]
+        self._phrase_nodes: Dict[int, int] = {}
+        for index, phrase in enumerate(self.phrases):
+            self._add(phrase, index)
+        self._build_failure_links()
+        # Deleted variant -> phrase tokens, to look up tokens within one edit
+        self._deletes: Dict[str, List[str]] = {}
+        self._fuzzy_cache: Dict[str, int] = {}
+        if max_edits:
+            for token in self._vocab:
+                if len(token) >= MIN_FUZZY_TOKEN_CHARS:
+                    for variant in _deletes(token) | {token}:
+                        self._deletes.setdefault(variant, []).append(token)
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def fullmatch(self, text: str) -> Union[str, None]:
+        """The phrase that the whole text is, if any."""
+        node = 0
+        for token_id in self._token_ids(text):
+            node = self._goto[node].get(token_id)
+            if node is None:
+                return None
+        index = self._phrase[node]
+        return None if index is None else self.phrases[index]
+
+    def search(self, text: str) -> Union[str, None]:
+        """The first phrase that occurs in the text, if any.
+
+        If several phrases end at the same token, the longest is returned.
+        """
+        for index in self._find(text):
+            return self.phrases[index]
+        return None
+
+    def findall(self, text: str) -> List[str]:
+        """Phrases that occur in the text, in the order they end."""
+        return [self.phrases[index] for index in self._find(text)]
+
+    def _find(self, text: str) -> Iterable[int]:
+        node = 0
+        for token_id in self._token_ids(text):
+            while node and token_id not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(token_id, 0)
+            match = self._output[node]
+            while match is not None:
+                yield match
+                match = self._next_output(match)
+
+    def _next_output(self, index: int) -> Union[int, None]:
+        # Shorter phrases that end at the same token
+        node = self._fail[self._phrase_nodes[index]]
+        return self._output[node]
+
+    def _add(self, phrase: str, index: int):
+        tokens = tokenize(phrase)
+        if not tokens:
+            logger.warning(f"Ignoring phrase without words: {phrase!r}")
+            return
+        node = 0
+        for token in tokens:
+            token_id = self._vocab.setdefault(token, len(self._vocab))
+            if token_id not in self._goto[node]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._phrase.append(None)
+                self._output.append(None)
+                self._goto[node][token_id] = len(self._goto) - 1
+            node = self._goto[node][token_id]
+        # Keep the first of duplicate phrases (after normalization)
+        if self._phrase[node] is None:
+            self._phrase[node] = index
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for token_id, child in self._goto[node].items():
+                fail = self._fail[node]
+                while fail and token_id not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(token_id, 0)
+                queue.append(child)
+            if self._phrase[node] is not None:
+                self._phrase_nodes[self._phrase[node]] = node
+                self._output[node] = self._phrase[node]
+            else:
+                self._output[node] = self._output[self._fail[node]]
+
+    def _token_ids(self, text: str) -> Iterable[int]:
+        for token in tokenize(text):
+            token_id = self._vocab.get(token)
+            if token_id is None:
+                token_id = self._fuzzy_id(token) if self.max_edits else _UNKNOWN
+            yield token_id
+
+    def _fuzzy_id(self, token: str) -> int:
+        if token in self._fuzzy_cache:
+            return self._fuzzy_cache[token]
+        token_id = _UNKNOWN
+        if len(token) >= MIN_FUZZY_TOKEN_CHARS:
+            candidates = set(self._deletes.get(token, []))
+            for variant in _deletes(token):
+                candidates.update(self._deletes.get(variant, []))
+            if candidates:
+                # Deterministic pick if the token is close to several
+                token_id = self._vocab[min(candidates)]
+        if len(self._fuzzy_cache) >= FUZZY_CACHE_SIZE:
+            self._fuzzy_cache.clear()
+        self._fuzzy_cache[token] = token_id
+        return token_id
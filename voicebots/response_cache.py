@@ -0,0 +1,299 @@
+"""Cache of agent replies, keyed on the normalized end of the dialogue.
+
+Exact completion caching (see `voicebots.completion_cache`) rarely hits in
+live chat, since the prompt includes the whole transcript. This cache is
+keyed on the prompt template and the last few turns instead, so common
+openers ("hi", "what can you do?") are answered locally, without calling
+the LLM.
+
+Turns are normalized (lowercase, no punctuation, single spaces). The
+context (the turns before the user's last utterance) must match exactly.
+The user's utterance can also match approximately: with a
+`similarity_threshold`, the most similar cached utterance in the same
+context is used, by character trigram similarity.
+
+Entries are scoped per prompt, e.g. the prompt file, so bots with different
+prompts never share replies.
+
+Usage:
+    cache = ResponseCache(num_turns=2, similarity_threshold=0.8)
+    scope = get_prompt_scope(prompt_text)
+    agent_text = cache.get(scope, turns)
+    if agent_text is None:
+        agent_text = complete(turns)
+        cache.set(scope, turns, agent_text)
+    print(cache.stats)
+"""
+import logging
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Tuple, Union
+
+import diskcache
+
+from voicebots import text_utils
+
+logger = logging.getLogger(__name__)
+
+# Turns in the key: the user's utterance and the agent line before it
+DEFAULT_NUM_TURNS = 2
+# Max cached replies, across all scopes
+DEFAULT_MAX_ENTRIES = 10000
+# Replies are only reused for short utterances, like openers
+DEFAULT_MAX_UTTERANCE_WORDS = 12
+
+# Bump to invalidate persisted entries after changing the key format
+CACHE_VERSION = 1
+
+PUNCTUATION_RE = re.compile(r"[^\w\s']+")
+WHITESPACE_RE = re.compile(r"\s+")
+
+
+@dataclass
+class ResponseCacheStats:
+    """Counters for the response cache.
+
+    Attributes:
+        hits (int): Lookups served by an exact match.
+        similar_hits (int): Lookups served by a similar utterance.
+        misses (int): Lookups not found in the cache.
+        skipped (int): Lookups of utterances too long to cache.
+        writes (int): Replies added to the cache.
+    """
+
+    hits: int = 0
+    similar_hits: int = 0
+    misses: int = 0
+    skipped: int = 0
+    writes: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.hits + self.similar_hits
+        lookups = hits + self.misses
+        return hits / lookups if lookups else 0.0
+
+
+def normalize_utterance(text: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    text = PUNCTUATION_RE.sub(" ", text_utils.normalize_text(text))
+    return WHITESPACE_RE.sub(" ", text).strip()
+
+
+def trigrams(text: str) -> FrozenSet[str]:
+    """Character trigrams of text, padded so short words still have some."""
+    padded = f"  {text} "
+    return frozenset(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def trigram_similarity(a: FrozenSet[str], b: FrozenSet[str]) -> float:
+    """Dice coefficient of two trigram sets, between 0 and 1."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def get_prompt_scope(prompt_text: str) -> str:
+    """Scope of a prompt template. Changes whenever the prompt is edited."""
+    return text_utils.hash_normalized_text(prompt_text, normalize=False)[:16]
+
+
+def cached_result(agent_text: str) -> Dict:
+    """A post-processed completion result for a cached reply.
+
+    Same format as `oai_client.postprocess_completion_response`.
+    """
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+    return {
+        "response": None,
+        "num_tokens": 0,
+        "all_answers_text": [agent_text],
+        "top_answer_text": agent_text,
+        "latency": 0.0,
+        "usage": usage,
+    }
+
+
+@dataclass
+class _Entry:
+    agent_text: str
+    trigrams: FrozenSet[str]
+
+
+class ResponseCache:
+    """In-memory LRU of agent replies, optionally persisted to disk. Thread-safe."""
+
+    def __init__(
+        self,
+        num_turns: int = DEFAULT_NUM_TURNS,
+        similarity_threshold: Union[float, None] = None,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_utterance_words: int = DEFAULT_MAX_UTTERANCE_WORDS,
+        directory: Union[str, None] = None,
+    ):
+        """Instantiate the ResponseCache.
+
+        Args:
+            num_turns: Number of turns at the end of the dialogue in the key,
+                including the user's last utterance.
+            similarity_threshold: Optional; Also serve replies cached for a
+                different utterance in the same context, if their trigram
+                similarity is at least this (0-1). Exact matches only if None.
+            max_entries: Optional; Least recently used replies are dropped
+                beyond this.
+            max_utterance_words: Optional; Don't cache replies to longer
+                utterances, which rarely repeat.
+            directory: Optional; Persist replies in this diskcache directory,
+                so they are reused across sessions. Also holds at most
+                `max_entries` replies.
+        """
+        self.num_turns = num_turns
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.max_utterance_words = max_utterance_words
+        self.stats = ResponseCacheStats()
+        self._lock = threading.Lock()
+        # (scope, context, utterance) -> _Entry, least recently used first
+        self._entries: "OrderedDict[Tuple[str, str, str], _Entry]" = OrderedDict()
+        # (scope, context) -> utterances, for similarity search
+        self._utterances: Dict[Tuple[str, str], Dict[str, FrozenSet[str]]] = {}
+        self._disk = diskcache.Cache(directory) if directory is not None else None
+        if self._disk is not None:
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, scope: str, turns: List[Dict]) -> Union[str, None]:
+        """Get the cached reply to the dialogue so far, or None.
+
+        Args:
+            scope: E.g. `get_prompt_scope(prompt_text)`.
+            turns: Dialogue turns, ending with the user's utterance.
+        """
+        key = self._get_key(scope, turns)
+        if key is None:
+            with self._lock:
+                self.stats.skipped += 1
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                logger.info(f"Response cache hit: '{key[2]}'")
+                return entry.agent_text
+            if self.similarity_threshold is not None:
+                similar_key = self._find_similar(key)
+                if similar_key is not None:
+                    self._entries.move_to_end(similar_key)
+                    self.stats.similar_hits += 1
+                    logger.info(
+                        f"Response cache hit: '{key[2]}' ~ '{similar_key[2]}'"
+                    )
+                    return self._entries[similar_key].agent_text
+            self.stats.misses += 1
+        return None
+
+    def set(self, scope: str, turns: List[Dict], agent_text: str):
+        """Cache the agent's reply to the dialogue so far.
+
+        Args:
+            scope: E.g. `get_prompt_scope(prompt_text)`.
+            turns: Dialogue turns, ending with the user's utterance.
+            agent_text: The agent's reply.
+        """
+        key = self._get_key(scope, turns)
+        if key is None or not agent_text:
+            return
+        with self._lock:
+            evicted = self._add(key, agent_text)
+            self.stats.writes += 1
+        if self._disk is not None:
+            self._disk.set(self._get_disk_key(key), agent_text)
+            self._delete_from_disk(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._utterances.clear()
+        if self._disk is not None:
+            self._disk.clear()
+
+    def _get_key(
+        self, scope: str, turns: List[Dict]
+    ) -> Union[Tuple[str, str, str], None]:
+        if not turns or turns[-1]["speaker"] != "user":
+            return None
+        utterance = normalize_utterance(turns[-1]["text"])
+        if not utterance or len(utterance.split()) > self.max_utterance_words:
+            return None
+        context = "\n".join(
+            f"{turn['speaker']}: {normalize_utterance(turn['text'])}"
+            for turn in turns[-self.num_turns : -1]
+        )
+        return scope, context, utterance
+
+    def _find_similar(
+        self, key: Tuple[str, str, str]
+    ) -> Union[Tuple[str, str, str], None]:
+        scope, context, utterance = key
+        candidates = self._utterances.get((scope, context))
+        if not candidates:
+            return None
+        query = trigrams(utterance)
+        best, best_similarity = None, self.similarity_threshold
+        for candidate, candidate_trigrams in candidates.items():
+            similarity = trigram_similarity(query, candidate_trigrams)
+            if similarity >= best_similarity:
+                best, best_similarity = candidate, similarity
+        return (scope, context, best) if best is not None else None
+
+    def _add(
+        self, key: Tuple[str, str, str], agent_text: str
+    ) -> List[Tuple[str, str, str]]:
+        """Add an entry, and drop the least recently used beyond max_entries.
+
+        Returns:
+            Keys of the dropped entries.
+        """
+        scope, context, utterance = key
+        entry = _Entry(agent_text, trigrams(utterance))
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        self._utterances.setdefault((scope, context), {})[utterance] = entry.trigrams
+        evicted = []
+        while len(self._entries) > self.max_entries:
+            (scope, context, utterance), _ = self._entries.popitem(last=False)
+            evicted.append((scope, context, utterance))
+            utterances = self._utterances[(scope, context)]
+            del utterances[utterance]
+            if not utterances:
+                del self._utterances[(scope, context)]
+        return evicted
+
+    def _delete_from_disk(self, keys: List[Tuple[str, str, str]]):
+        # Keep the disk tier within max_entries too
+        for key in keys:
+            self._disk.delete(self._get_disk_key(key))
+
+    def _get_disk_key(self, key: Tuple[str, str, str]) -> Tuple:
+        return ("response", CACHE_VERSION) + key
+
+    def _load(self):
+        num_loaded = 0
+        evicted = []
+        with self._lock:
+            # In insertion order (unlike iterkeys), so the newest are kept
+            for disk_key in list(self._disk):
+                if disk_key[:2] != ("response", CACHE_VERSION):
+                    continue
+                agent_text = self._disk.get(disk_key)
+                if agent_text is not None:
+                    evicted.extend(self._add(tuple(disk_key[2:]), agent_text))
+                    num_loaded += 1
+        # E.g. a cache written with a larger max_entries
+        self._delete_from_disk(evicted)
+        logger.info(f"Loaded {num_loaded} cached responses")
@@ -0,0 +1,148 @@
+"""Preallocated, thread-safe byte ring buffer for streaming audio.
+
+Used between a producer and a real-time consumer, e.g. TTS -> speaker, or
+microphone -> ASR. Data is copied into a fixed bytearray, so steady-state
+streaming doesn't allocate.
+"""
+import threading
+from typing import Union
+
+
+class RingBuffer:
+    """Fixed-capacity FIFO of bytes.
+
+    Writers either block until there is space (back-pressure, e.g. TTS audio
+    which must not be dropped), or overwrite the oldest data (e.g. microphone
+    audio, where the real-time producer must never wait). Overwritten bytes
+    are counted as overruns.
+    """
+
+    def __init__(self, capacity: int):
+        """Instantiate the RingBuffer.
+
+        Args:
+            capacity: Size of the buffer in bytes.
+        """
+        self.capacity = capacity
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # Read position
+        self._size = 0  # Bytes available to read
+        self._cond = threading.Condition()
+        self._num_clears = 0
+        self.closed = False
+
+        # Stats
+        self.overruns = 0  # Writes that overwrote unread data
+        self.overrun_bytes = 0
+        self.max_depth = 0  # High water mark, in bytes
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(
+        self, data, block: bool = True, timeout: Union[float, None] = None
+    ) -> int:
+        """Append bytes to the buffer.
+
+        Args:
+            data: Bytes-like object.
+            block: If True, wait for space when the buffer is full. If False,
+                overwrite the oldest unread data instead.
+            timeout: Max seconds to wait for space when blocking.
+
+        Returns:
+            Number of bytes written. Less than len(data) only if a blocking
+            write timed out, or the buffer was cleared or closed meanwhile.
+        """
+        data = memoryview(data).cast("B")
+        written = 0
+        with self._cond:
+            num_clears = self._num_clears
+            while written < len(data) and not self.closed:
+                free = self.capacity - self._size
+                if free == 0:
+                    if block:
+                        woke = self._cond.wait(timeout)
+                        if not woke or num_clears != self._num_clears:
+                            break
+                        continue
+                    # Drop the oldest data to make room
+                    overwrite = min(len(data) - written, self.capacity)
+                    self._start = (self._start + overwrite) % self.capacity
+                    self._size -= overwrite
+                    self.overruns += 1
+                    self.overrun_bytes += overwrite
+                    free = overwrite
+                n = min(free, len(data) - written)
+                self._copy_in(data[written : written + n])
+                written += n
+                self._size += n
+                self.max_depth = max(self.max_depth, self._size)
+                self._cond.notify_all()
+        return written
+
+    def read_into(
+        self, out, block: bool = False, timeout: Union[float, None] = None
+    ) -> int:
+        """Read up to len(out) bytes into a writable buffer.
+
+        Args:
+            out: Writable bytes-like object, e.g. a bytearray or memoryview.
+            block: If True, wait until len(out) bytes are available (or the
+                buffer is closed). If False, read whatever is available.
+            timeout: Max seconds to wait when blocking.
+
+        Returns:
+            Number of bytes read. 0 means no data, or closed and drained.
+        """
+        out = memoryview(out).cast("B")
+        with self._cond:
+            if block:
+                self._cond.wait_for(
+                    lambda: self._size >= len(out) or self.closed, timeout
+                )
+            n = min(len(out), self._size)
+            end = self._start + n
+            if end <= self.capacity:
+                out[:n] = self._view[self._start : end]
+            else:
+                first = self.capacity - self._start
+                out[:first] = self._view[self._start :]
+                out[first:n] = self._view[: n - first]
+            self._start = end % self.capacity
+            self._size -= n
+            self._cond.notify_all()
+        return n
+
+    def wait_empty(self, timeout: Union[float, None] = None) -> bool:
+        """Block until all data has been read. Returns False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self._size == 0 or self.closed, timeout
+            )
+
+    def clear(self):
+        """Drop all unread data, and cancel writes blocked waiting for space."""
+        with self._cond:
+            self._num_clears += 1
+            self._start = 0
+            self._size = 0
+            self._cond.notify_all()
+
+    def close(self):
+        """Wake up waiting readers and writers. Unread data can still be read."""
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def _copy_in(self, data: memoryview):
+        """Copy data after the unread bytes. Caller holds the lock and checked space."""
+        write_pos = (self._start + self._size) % self.capacity
+        end = write_pos + len(data)
+        if end <= self.capacity:
+            self._view[write_pos:end] = data
+        else:
+            first = self.capacity - write_pos
+            self._view[write_pos:] = data[:first]
+            self._view[: len(data) - first] = data[first:]
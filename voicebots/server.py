@@ -0,0 +1,425 @@
+"""WebSocket server for the voice loop, one session per caller.
+
+Each connection runs the same pipeline as `cli chat --stream`: the caller's
+audio is transcribed, the reply is generated with `chat_prompt_stream`, and
+each sentence is synthesized and sent back as soon as it is generated. The
+completer, synthesizer (and its TTS cache), response cache and Google
+clients are shared by all sessions. Each session has its own transcriber,
+dialogue turns and prompt window.
+
+Protocol, at ws://host:port/ws?rate=16000:
+    Caller -> server:
+        Binary frames: 16-bit mono PCM audio at `rate`.
+        {"type": "end_of_utterance"}: The caller stopped talking (e.g. push
+            to talk, or client side VAD). The utterance is transcribed and
+            answered. Audio sent after it starts the next utterance.
+        {"type": "hangup"}: End the session.
+    Server -> caller:
+        {"type": "transcript", "text": ...}: Final transcript of an utterance.
+        {"type": "agent_text", "text": ...}: A sentence of the reply, followed
+            by a binary frame with its audio (LINEAR16 WAV).
+        {"type": "agent_done", "text": ...}: The whole reply has been sent.
+        {"type": "end_call"}: The caller asked to end the call.
+        {"type": "error", "message": ...}: The turn failed, or a text frame
+            wasn't a JSON object. The session continues.
+    An invalid `rate` closes the connection with code 1008.
+
+GET /health returns the server stats as JSON.
+
+Usage:
+    python -m cli serve --backend fake --port 8765
+    python -m examples.ws_client --wav-file hello.wav
+"""
+import asyncio
+import itertools
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, List, Union
+
+from aiohttp import WSMsgType, web
+
+from voicebots import chat_utils
+from voicebots.asr.audio_sources import QueueSource
+from voicebots.asr.transcriber import Transcriber
+from voicebots.completer import Completer
+from voicebots.conversation import DEFAULT_MAX_PROMPT_TOKENS, Conversation
+from voicebots.intent_router import IntentRouter
+from voicebots.response_cache import ResponseCache
+from voicebots.speech.synthesizer import Synthesizer
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_SESSIONS = 32
+# Sample rate of the caller's audio, unless given in the URL
+DEFAULT_RATE = 16000
+# Threads per session: transcription, generation, and synthesis of sentences
+THREADS_PER_SESSION = 4
+
+
+@dataclass
+class ServerStats:
+    """Counters for the voice server.
+
+    Attributes:
+        active_sessions (int): Sessions currently connected.
+        sessions (int): Sessions accepted since the server started.
+        rejected_sessions (int): Sessions refused because the server was full.
+        turns (int): Replies sent.
+        errors (int): Turns that failed.
+    """
+
+    active_sessions: int = 0
+    sessions: int = 0
+    rejected_sessions: int = 0
+    turns: int = 0
+    errors: int = 0
+
+
+class VoiceServer:
+    """Serves the voice loop to many callers over WebSocket."""
+
+    def __init__(
+        self,
+        make_transcriber: Callable[[], Transcriber],
+        synthesizer: Synthesizer,
+        completer: Completer,
+        prompt_text: str,
+        opening_line: str,
+        prompt_config: Dict,
+        user_name: str = "User",
+        agent_name: str = "Assistant",
+        should_end_call: Union[Callable[[str], bool], None] = None,
+        response_cache: Union[ResponseCache, None] = None,
+        router: Union[IntentRouter, None] = None,
+        max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+        max_sessions: int = DEFAULT_MAX_SESSIONS,
+    ):
+        """Instantiate the VoiceServer.
+
+        Args:
+            make_transcriber: Returns a new transcriber for each session.
+            synthesizer: TTS backend, shared by all sessions.
+            completer: LLM backend, shared by all sessions.
+            prompt_text: Prompt template, see `chat_utils.get_prompt_text`.
+            opening_line: Spoken by the agent when a caller connects.
+            prompt_config: Completion params, e.g. temperature, stop.
+            user_name: Optional; Name of the caller in the prompt.
+            agent_name: Optional; Name of the agent in the prompt.
+            should_end_call: Optional; Returns True if the caller's utterance
+                ends the call.
+            response_cache: Optional; Cache of replies to common utterances.
+            router: Optional; Answers common turns with canned replies. Its
+                replies are prewarmed when the server starts.
+            max_prompt_tokens: Optional; Token budget of each session's prompt.
+            max_sessions: Optional; Callers beyond this are turned away.
+        """
+        self.make_transcriber = make_transcriber
+        self.synthesizer = synthesizer
+        self.completer = completer
+        self.prompt_text = prompt_text
+        self.opening_line = opening_line
+        self.prompt_config = prompt_config
+        self.user_name = user_name
+        self.agent_name = agent_name
+        self.should_end_call = should_end_call or (lambda text: False)
+        self.response_cache = response_cache
+        self.router = router
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_sessions = max_sessions
+        self.stats = ServerStats()
+        self._session_ids = itertools.count()
+        # Blocking ASR, LLM and TTS calls run here, off the event loop
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_sessions * THREADS_PER_SESSION,
+            thread_name_prefix="voice-session",
+        )
+        self._lock = threading.Lock()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/ws", self.handle_session)
+        app.router.add_get("/health", self.handle_health)
+        app.on_startup.append(lambda app: self._startup())
+        app.on_shutdown.append(lambda app: self._shutdown())
+        return app
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response(asdict(self.stats))
+
+    async def handle_session(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        rate = _parse_rate(request.query.get("rate"))
+        if rate is None:
+            logger.warning(f"Invalid rate {request.query.get('rate')!r}, rejecting")
+            await ws.close(code=1008, message=b"rate must be a positive integer")
+            return ws
+        with self._lock:
+            if self.stats.active_sessions >= self.max_sessions:
+                self.stats.rejected_sessions += 1
+                full = True
+            else:
+                self.stats.active_sessions += 1
+                self.stats.sessions += 1
+                full = False
+        if full:
+            logger.warning("Server is full, rejecting session")
+            await ws.close(code=1013, message=b"Server is full")
+            return ws
+
+        try:
+            session = _Session(
+                self,
+                ws,
+                session_id=f"session_{next(self._session_ids)}",
+                rate=rate,
+            )
+            await session.run()
+        except Exception:
+            # E.g. the transcriber failed to start
+            logger.exception("Session failed")
+            await ws.close(code=1011, message=b"Internal error")
+        finally:
+            with self._lock:
+                self.stats.active_sessions -= 1
+        return ws
+
+    def run_in_thread(self, fn, *args) -> asyncio.Future:
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def submit(self, fn, *args):
+        return self._executor.submit(fn, *args)
+
+    def record(self, turns: int = 0, errors: int = 0):
+        with self._lock:
+            self.stats.turns += turns
+            self.stats.errors += errors
+
+    async def _startup(self):
+        if self.router is not None:
+            # Synthesize the canned replies in the background
+            self.submit(self.router.prewarm, self.synthesizer)
+
+    async def _shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _Session:
+    """One caller: reads their audio, and answers each utterance in order."""
+
+    def __init__(
+        self,
+        server: VoiceServer,
+        ws: web.WebSocketResponse,
+        session_id: str,
+        rate: int,
+    ):
+        self.server = server
+        self.ws = ws
+        self.session_id = session_id
+        self.rate = rate
+        self.transcriber = server.make_transcriber()
+        self.turns: List[Dict] = []
+        self.conversation = Conversation(
+            server.prompt_text,
+            user_name=server.user_name,
+            agent_name=server.agent_name,
+            max_prompt_tokens=server.max_prompt_tokens,
+        )
+        self._source: Union[QueueSource, None] = None
+        # Pending transcriptions, in the order the caller spoke
+        self._utterances: "asyncio.Queue[Union[asyncio.Future, None]]" = (
+            asyncio.Queue()
+        )
+        self._closed = False
+
+    async def run(self):
+        logger.info(f"[{self.session_id}] Connected, {self.rate}Hz audio")
+        self.turns.append({"speaker": "agent", "text": self.server.opening_line})
+        try:
+            await self._speak([self.server.opening_line])
+        except Exception as e:
+            logger.exception(f"[{self.session_id}] Failed to speak the opening line")
+            await self.ws.send_json({"type": "error", "message": str(e)})
+        responder = asyncio.create_task(self._respond_loop())
+        try:
+            async for message in self.ws:
+                if message.type == WSMsgType.BINARY:
+                    self._write_audio(message.data)
+                elif message.type == WSMsgType.TEXT:
+                    event = _parse_event(message.data)
+                    if event is None:
+                        await self.ws.send_json(
+                            {"type": "error", "message": "Expected a JSON object"}
+                        )
+                    elif event.get("type") == "end_of_utterance":
+                        self._end_utterance()
+                    elif event.get("type") == "hangup":
+                        break
+                elif message.type == WSMsgType.ERROR:
+                    logger.warning(
+                        f"[{self.session_id}] Connection error: {self.ws.exception()}"
+                    )
+                    break
+        finally:
+            self._closed = True
+            if self._source is not None:
+                self._source.close()
+            self._utterances.put_nowait(None)
+            responder.cancel()
+            await asyncio.gather(responder, return_exceptions=True)
+            await self.ws.close()
+            logger.info(
+                f"[{self.session_id}] Disconnected after {len(self.turns)} turns"
+            )
+
+    def _write_audio(self, data: bytes):
+        if self._source is None:
+            # Transcribe while the caller is still talking
+            self._source = QueueSource(self.rate, name=self.session_id)
+            self._utterances.put_nowait(
+                self.server.run_in_thread(self._transcribe, self._source)
+            )
+        self._source.write(data)
+
+    def _end_utterance(self):
+        if self._source is not None:
+            self._source.close()
+            self._source = None
+
+    def _transcribe(self, source: QueueSource) -> str:
+        transcripts = self.transcriber.transcribe(source)
+        text = " ".join(t.text for t in transcripts if t.is_final and t.text)
+        # Drain the rest of the audio, e.g. if the transcriber failed to start
+        source.close()
+        return text.strip()
+
+    async def _respond_loop(self):
+        while True:
+            transcription = await self._utterances.get()
+            if transcription is None:
+                return
+            try:
+                user_text = await transcription
+                await self.ws.send_json({"type": "transcript", "text": user_text})
+                if not user_text:
+                    continue
+                self.turns.append({"speaker": "user", "text": user_text})
+                if self._should_end_call(user_text):
+                    farewell = None
+                    if self.server.router is not None:
+                        farewell = self.server.router.route(self.turns)
+                    if farewell is not None:
+                        await self._speak([farewell.text])
+                        self.turns.append({"speaker": "agent", "text": farewell.text})
+                    await self.ws.send_json({"type": "end_call"})
+                    await self.ws.close()
+                    return
+                agent_text = await self._speak(self._generate_reply())
+                self.turns.append({"speaker": "agent", "text": agent_text})
+                self.server.record(turns=1)
+            except ConnectionResetError:
+                # The caller hung up
+                return
+            except Exception as e:
+                logger.exception(f"[{self.session_id}] Turn failed")
+                self.server.record(errors=1)
+                if not self.ws.closed:
+                    await self.ws.send_json({"type": "error", "message": str(e)})
+
+    def _should_end_call(self, user_text: str) -> bool:
+        router = self.server.router
+        return self.server.should_end_call(user_text) or (
+            router is not None and router.ends_call(self.turns)
+        )
+
+    def _generate_reply(self):
+        return chat_utils.chat_prompt_stream(
+            turns=self.turns,
+            user_name=self.server.user_name,
+            agent_name=self.server.agent_name,
+            prompt_text=self.server.prompt_text,
+            prompt_config=self.server.prompt_config,
+            oai_client=self.server.completer,
+            response_cache=self.server.response_cache,
+            conversation=self.conversation,
+            router=self.server.router,
+        )
+
+    async def _speak(self, sentences) -> str:
+        """Synthesize sentences as they are generated, and send them in order.
+
+        Returns:
+            The full text that was sent.
+        """
+        loop = asyncio.get_running_loop()
+        synthesized: "asyncio.Queue[Union[tuple, None]]" = asyncio.Queue()
+        cancelled = threading.Event()
+
+        def _generate():
+            # Each sentence goes to TTS as soon as it is generated
+            try:
+                for sentence in sentences:
+                    if cancelled.is_set() or self._closed:
+                        break
+                    future = self.server.submit(self.server.synthesizer, sentence)
+                    loop.call_soon_threadsafe(
+                        synthesized.put_nowait, (sentence, future)
+                    )
+            finally:
+                if hasattr(sentences, "close"):
+                    sentences.close()
+                loop.call_soon_threadsafe(synthesized.put_nowait, None)
+
+        generation = self.server.run_in_thread(_generate)
+        spoken = []
+        try:
+            while True:
+                item = await synthesized.get()
+                if item is None:
+                    break
+                sentence, future = item
+                audio_bytes = await asyncio.wrap_future(future)
+                await self.ws.send_json({"type": "agent_text", "text": sentence})
+                await self.ws.send_bytes(audio_bytes)
+                spoken.append(sentence)
+        except BaseException:
+            # Stop generating, e.g. TTS failed or the caller hung up
+            cancelled.set()
+            raise
+        await generation
+        agent_text = " ".join(spoken)
+        await self.ws.send_json({"type": "agent_done", "text": agent_text})
+        return agent_text
+
+
+def run_server(
+    server: VoiceServer, host: str = "localhost", port: int = DEFAULT_PORT
+):
+    """Serve `server` at ws://host:port/ws until interrupted."""
+    logger.info(f"Serving the voice loop at ws://{host}:{port}/ws")
+    web.run_app(server.create_app(), host=host, port=port)
+
+
+def _parse_rate(rate: Union[str, None]) -> Union[int, None]:
+    """Sample rate from the URL, or None if it isn't a positive integer."""
+    if rate is None:
+        return DEFAULT_RATE
+    try:
+        rate = int(rate)
+    except ValueError:
+        return None
+    return rate if rate > 0 else None
+
+
+def _parse_event(data: str) -> Union[Dict, None]:
+    """Event from a text frame, or None if it isn't a JSON object."""
+    try:
+        event = json.loads(data)
+    except ValueError:
+        return None
+    return event if isinstance(event, dict) else None
@@ -27,14 +27,54 @@ class Settings:
         openai_api_key: str,
         openai_org_id: str = None, 
         disk_cache_dir: str = "/tmp/disk_cache",
+        llm_cache_namespace: str = "default",  # Change to stop sharing cached completions
+        llm_cache_mode: str = "read_write",  # See voicebots.completion_cache
+        llm_cache_ttl_sec: float = 7 * 24 * 3600,  # 1 week
+        llm_cache_size_limit: int = 2**30,  # 1GB
+        llm_cache_max_temperature: float = 0.0,  # Don't reuse sampled completions
         prompt_history_path = "./.prompt_history",
+        max_prompt_tokens: int = 4097 - 256,  # Older turns are trimmed beyond this
         chat_turns_dir = "./.chat_turns",
+        response_cache_dir: str = "/tmp/response_cache",  # See voicebots.response_cache
+        response_cache_turns: int = 2,
+        response_cache_threshold: float = None,  # Exact matches only
+        tts_cache_dir: str = "/tmp/tts_cache",
+        tts_cache_size_limit: int = 2**30,  # 1GB
+        tts_memory_cache_size_limit: int = 64 * 2**20,  # 64MB
+        tts_encoding: str = "LINEAR16",  # or OGG_OPUS/MP3, cached compressed (ffmpeg)
+        asr_encoding: str = "linear16",  # or flac/ogg_opus, compressed uploads (ffmpeg)
+        asr_continuous: bool = False,  # Keep the mic and recognition stream open
+        backend: str = "live",  # or "fake", see voicebots.backends
+        fake_error_rate: float = 0.0,
+        fake_seed: int = None,
+        trace_file: str = None,  # JSONL file of latency spans, see voicebots.tracing
+        metrics_port: int = None,  # Serve Prometheus metrics on this port
     ):
         self.openai_api_key = openai_api_key
         self.openai_org_id = openai_org_id
         self.disk_cache_dir = disk_cache_dir
+        self.llm_cache_namespace = llm_cache_namespace
+        self.llm_cache_mode = llm_cache_mode
+        self.llm_cache_ttl_sec = llm_cache_ttl_sec
+        self.llm_cache_size_limit = llm_cache_size_limit
+        self.llm_cache_max_temperature = llm_cache_max_temperature
+        self.response_cache_dir = response_cache_dir
+        self.response_cache_turns = response_cache_turns
+        self.response_cache_threshold = response_cache_threshold
+        self.tts_cache_dir = tts_cache_dir
+        self.tts_cache_size_limit = tts_cache_size_limit
+        self.tts_memory_cache_size_limit = tts_memory_cache_size_limit
+        self.tts_encoding = tts_encoding
+        self.asr_encoding = asr_encoding
+        self.asr_continuous = asr_continuous
         self.prompt_history_path = prompt_history_path
+        self.max_prompt_tokens = max_prompt_tokens
         self.chat_turns_dir = chat_turns_dir
+        self.backend = backend
+        self.fake_error_rate = fake_error_rate
+        self.fake_seed = fake_seed
+        self.trace_file = trace_file
+        self.metrics_port = metrics_port
         os.makedirs(chat_turns_dir, exist_ok=True)
 
 
@@ -43,11 +83,13 @@ class Settings:
         """Load secrets from a .env file.
         
         Other kwargs are passed to the Settings constructor.
+        Secrets aren't required for the fake backend.
         """
         secrets = {}
         cfg = dotenv.dotenv_values(env_file)
+        check_required = kwargs.get("backend", "live") != "fake"
         for key, is_required in cls.SECRET_VARIABLES:
-            if is_required and not cfg.get(key):
+            if check_required and is_required and not cfg.get(key):
                 raise ValueError(f"Missing required secret variable {key}") 
             secrets[key.lower()] = cfg.get(key)
         return cls(**secrets, **kwargs)
@@ -0,0 +1,46 @@
+"""Latency and failure simulation for the local stand-in (fake) backends.
+
+Used by FakeTranscriber, FakeSynthesizer and FakeCompleter to capacity-test
+the voice loop without network access or API spend.
+"""
+import math
+import random
+from dataclasses import dataclass
+from typing import Union
+
+# z-score of the 95th percentile of a standard normal distribution
+P95_Z = 1.645
+
+
+class FakeServiceError(Exception):
+    """Simulated (transient) backend failure."""
+
+
+@dataclass(frozen=True)
+class Latency:
+    """Log-normal latency distribution, given by its median and p95.
+
+    Service latencies are right-skewed with a long tail, which a log-normal
+    distribution captures better than a normal one.
+
+    Attributes:
+        median_sec (float): Median latency.
+        p95_sec (float): 95th percentile latency. If not set, latency is fixed at the median.
+    """
+
+    median_sec: float
+    p95_sec: Union[float, None] = None
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median_sec <= 0:
+            return 0.0
+        if self.p95_sec is None or self.p95_sec <= self.median_sec:
+            return self.median_sec
+        sigma = math.log(self.p95_sec / self.median_sec) / P95_Z
+        return rng.lognormvariate(math.log(self.median_sec), sigma)
+
+
+def maybe_fail(rng: random.Random, error_rate: float, name: str):
+    """Raise a FakeServiceError with probability `error_rate`."""
+    if error_rate > 0 and rng.random() < error_rate:
+        raise FakeServiceError(f"Simulated {name} failure")
@@ -0,0 +1,230 @@
+"""Coalesce identical concurrent requests into one call.
+
+At the start of a burst of calls, every session asks for the same things
+at once (e.g. the opening line's audio, the first completion), and each
+misses the cache, since none of the calls has finished yet. With a
+SingleFlight, the first request for a key makes the call, and requests for
+the same key that arrive while it is in flight wait for it and share its
+result (or exception). Once the call finishes the key is forgotten, so
+later requests go through the cache as usual.
+
+Results are shared between the callers, so they must not be mutated.
+
+Streamed results (e.g. completion deltas) are shared with `do_stream`: the
+call runs on a background thread, and each caller iterates all of its items
+from the start, as they arrive.
+
+Usage:
+    flights = SingleFlight()
+    audio_bytes = flights.do(cache_key, synthesize, text)
+    for delta in flights.do_stream(cache_key, complete_stream, prompt):
+        ...
+    print(flights.stats)
+"""
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterator, List, Union
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SingleFlightStats:
+    """Counters for a SingleFlight.
+
+    Attributes:
+        calls (int): Requests made.
+        coalesced (int): Requests that joined a call already in flight,
+            instead of making their own.
+    """
+
+    calls: int = 0
+    coalesced: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        return self.coalesced / self.calls if self.calls else 0.0
+
+
+@dataclass
+class _Broadcast:
+    """Items of a streamed call, replayed to each of its callers.
+
+    Attributes:
+        items (List): Items the call has yielded so far.
+        done (bool): The call has ended.
+        error (BaseException): Raised by the call, if it failed.
+        readers (int): Callers still iterating. Guarded by the flight's lock.
+    """
+
+    items: List = field(default_factory=list)
+    done: bool = False
+    error: Union[BaseException, None] = None
+    readers: int = 0
+    changed: threading.Condition = field(default_factory=threading.Condition)
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time, across threads."""
+
+    def __init__(self, name: str = "single_flight"):
+        """Instantiate the SingleFlight.
+
+        Args:
+            name: Optional; Used in log messages.
+        """
+        self.name = name
+        self.stats = SingleFlightStats()
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, Future] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+
+    def do(self, key: Hashable, fn: Callable, *args, **kwargs) -> Any:
+        """Call `fn(*args, **kwargs)`, unless a call for `key` is in flight.
+
+        Returns:
+            The result of the call, shared with the other callers of the key.
+        """
+        with self._lock:
+            self.stats.calls += 1
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._flights[key] = future
+            else:
+                self.stats.coalesced += 1
+        if not leader:
+            logger.debug(f"[{self.name}] Joined the call in flight for {key}")
+            return future.result()
+
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+    def do_stream(self, key: Hashable, fn: Callable, *args, **kwargs) -> Iterator:
+        """Iterate `fn(*args, **kwargs)`, unless a call for `key` is in flight.
+
+        The call runs on a background thread. Each caller gets all of its
+        items, from the start, as they arrive. It stops early once none of
+        its callers is iterating any more, e.g. they were all interrupted.
+
+        Returns:
+            Iterator over the items of the call, shared with the other
+            callers of the key. Raises the call's exception, if any.
+        """
+        with self._lock:
+            self.stats.calls += 1
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+            else:
+                self.stats.coalesced += 1
+            broadcast.readers += 1
+        if leader:
+            threading.Thread(
+                target=self._produce,
+                args=(key, broadcast, fn, args, kwargs),
+                name=f"{self.name}-stream",
+                daemon=True,
+            ).start()
+        else:
+            logger.debug(f"[{self.name}] Joined the stream in flight for {key}")
+        return self._read(broadcast)
+
+    def _produce(
+        self, key: Hashable, broadcast: _Broadcast, fn: Callable, args, kwargs
+    ):
+        error = None
+        try:
+            items = fn(*args, **kwargs)
+            try:
+                for item in items:
+                    with broadcast.changed:
+                        broadcast.items.append(item)
+                        broadcast.changed.notify_all()
+                    with self._lock:
+                        # Nobody joins an abandoned stream, since it ends early
+                        if broadcast.readers == 0:
+                            del self._streams[key]
+                            logger.debug(f"[{self.name}] Stopped the stream for {key}")
+                            break
+            finally:
+                if hasattr(items, "close"):
+                    items.close()
+        except BaseException as e:
+            error = e
+        finally:
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            with broadcast.changed:
+                broadcast.done = True
+                broadcast.error = error
+                broadcast.changed.notify_all()
+
+    def _read(self, broadcast: _Broadcast) -> Iterator:
+        index = 0
+        try:
+            while True:
+                with broadcast.changed:
+                    while index == len(broadcast.items) and not broadcast.done:
+                        broadcast.changed.wait()
+                    items = broadcast.items[index:]
+                    error = broadcast.error
+                if not items:
+                    if error is not None:
+                        raise error
+                    return
+                index += len(items)
+                yield from items
+        finally:
+            with self._lock:
+                broadcast.readers -= 1
+
+
+class AsyncSingleFlight:
+    """Runs at most one call per key at a time, within an event loop."""
+
+    def __init__(self, name: str = "single_flight"):
+        """Instantiate the AsyncSingleFlight.
+
+        Args:
+            name: Optional; Used in log messages.
+        """
+        self.name = name
+        self.stats = SingleFlightStats()
+        self._flights: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(
+        self, key: Hashable, fn: Callable[..., Awaitable], *args, **kwargs
+    ) -> Any:
+        """Await `fn(*args, **kwargs)`, unless a call for `key` is in flight.
+
+        Returns:
+            The result of the call, shared with the other callers of the key.
+        """
+        self.stats.calls += 1
+        task = self._flights.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args, **kwargs))
+            self._flights[key] = task
+            task.add_done_callback(lambda _: self._flights.pop(key, None))
+        else:
+            self.stats.coalesced += 1
+            logger.debug(f"[{self.name}] Joined the call in flight for {key}")
+        # Cancelling one caller doesn't cancel the call the others wait for
+        return await asyncio.shield(task)
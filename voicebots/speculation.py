@@ -0,0 +1,177 @@
+"""Speculative LLM prefetch on interim ASR transcripts.
+
+Google streams interim transcripts while the user is still talking. Once an
+interim transcript looks stable, we can start the completion (and optionally
+TTS) for it in the background. If the final transcript matches, the reply is
+already on its way. If not, the speculative work is discarded and we call the
+LLM as usual.
+
+Usage:
+    speculator = SpeculativeResponder(complete=lambda turns: chat_complete(turns, ...))
+    for transcript in listener.listen():
+        if not transcript.is_final:
+            speculator.on_interim(turns, transcript)
+    turns.append({"speaker": "user", "text": transcript.text})
+    result, audio_bytes = speculator.resolve(turns)
+    print(speculator.stats)
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple, Union
+
+from voicebots import text_utils
+from voicebots.asr.transcriber import Transcript
+
+logger = logging.getLogger(__name__)
+
+# Minimum Google interim `stability` before we speculate on a transcript
+MIN_STABILITY = 0.8
+
+# Don't speculate on very short prefixes like "what"
+MIN_WORDS = 2
+
+
+@dataclass
+class SpeculationStats:
+    """Counters for speculative completions.
+
+    Attributes:
+        started (int): Speculative completions started.
+        hits (int): Final transcripts served by a speculative completion.
+        misses (int): Final transcripts not served by a speculative completion.
+        wasted_tokens (int): Tokens spent on discarded speculative completions.
+    """
+
+    started: int = 0
+    hits: int = 0
+    misses: int = 0
+    wasted_tokens: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        resolved = self.hits + self.misses
+        return self.hits / resolved if resolved else 0.0
+
+
+@dataclass
+class _Speculation:
+    text: str
+    future: Future
+
+
+class SpeculativeResponder:
+    """Start completions on stable interim transcripts, commit or discard on final."""
+
+    def __init__(
+        self,
+        complete: Callable[[List[Dict]], Dict],
+        synthesize: Union[Callable[[str], bytes], None] = None,
+        min_stability: float = MIN_STABILITY,
+        min_words: int = MIN_WORDS,
+    ):
+        """Instantiate the SpeculativeResponder.
+
+        Args:
+            complete: Given the dialogue turns, returns a post-processed OAI
+                result (see `chat_utils.chat_complete`).
+            synthesize: Optional; If set, also synthesize the speculative reply.
+            min_stability: Interim results at or above this `stability` are
+                speculated on. Transcribers that don't report stability can
+                still trigger speculation by repeating the same interim text.
+            min_words: Minimum number of words in an interim transcript.
+        """
+        self.complete = complete
+        self.synthesize = synthesize
+        self.min_stability = min_stability
+        self.min_words = min_words
+        self.stats = SpeculationStats()
+        self._speculation: Union[_Speculation, None] = None
+        self._last_interim: Union[str, None] = None
+        self._lock = threading.Lock()
+        # One worker per speculation, plus one for a discarded one still running
+        self._executor = ThreadPoolExecutor(max_workers=2)
+
+    def on_interim(self, turns: List[Dict], transcript: Transcript):
+        """Maybe start a speculative completion for an interim transcript.
+
+        Args:
+            turns: Dialogue turns so far, NOT including the user's utterance.
+            transcript: Interim transcript of the user's utterance.
+        """
+        if transcript.is_final or not transcript.text:
+            return
+        text = text_utils.normalize_text(transcript.text)
+        is_repeat, self._last_interim = text == self._last_interim, text
+        if len(text.split()) < self.min_words:
+            return
+        if transcript.stability < self.min_stability and not is_repeat:
+            return
+        if self._speculation is not None and self._speculation.text == text:
+            return
+
+        self._discard()
+        logger.info(f"Speculating on interim transcript: '{text}'")
+        speculative_turns = turns + [{"speaker": "user", "text": transcript.text}]
+        future = self._executor.submit(self._complete_and_synthesize, speculative_turns)
+        self._speculation = _Speculation(text, future)
+        with self._lock:
+            self.stats.started += 1
+
+    def resolve(self, turns: List[Dict]) -> Tuple[Dict, Union[bytes, None]]:
+        """Get the reply for the user's final utterance.
+
+        Args:
+            turns: Dialogue turns, ending with the user's final utterance.
+
+        Returns:
+            The post-processed OAI result and, if the speculative reply was
+            synthesized, its audio bytes.
+        """
+        final_text = text_utils.normalize_text(turns[-1]["text"])
+        speculation, self._speculation = self._speculation, None
+        self._last_interim = None
+
+        if speculation is not None and speculation.text == final_text:
+            try:
+                result, audio_bytes = speculation.future.result()
+                with self._lock:
+                    self.stats.hits += 1
+                logger.info("Speculative completion hit!")
+                return result, audio_bytes
+            except Exception:
+                logger.exception("Speculative completion failed")
+
+        with self._lock:
+            self.stats.misses += 1
+        if speculation is not None and speculation.text != final_text:
+            self._discard(speculation)
+        return self.complete(turns), None
+
+    def close(self):
+        """Discard any pending speculation and shut down the worker pool."""
+        self._discard()
+        self._executor.shutdown(wait=False)
+
+    def _complete_and_synthesize(self, turns: List[Dict]) -> Tuple[Dict, Union[bytes, None]]:
+        result = self.complete(turns)
+        audio_bytes = None
+        if self.synthesize is not None:
+            audio_bytes = self.synthesize(result["top_answer_text"].strip())
+        return result, audio_bytes
+
+    def _discard(self, speculation: Union[_Speculation, None] = None):
+        """Cancel a speculation, or count its tokens as wasted once it finishes."""
+        if speculation is None:
+            speculation, self._speculation = self._speculation, None
+        if speculation is None or speculation.future.cancel():
+            return
+        speculation.future.add_done_callback(self._count_wasted_tokens)
+
+    def _count_wasted_tokens(self, future: Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        result, _ = future.result()
+        with self._lock:
+            self.stats.wasted_tokens += result["num_tokens"]
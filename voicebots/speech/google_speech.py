@@ -1,15 +1,34 @@
 """Convert text to speech using Google Cloud APIs."""
 
-import os
-from typing import Union
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, Tuple, Union
 
 from google.cloud import texttospeech
 
-from voicebots import audio_utils, text_utils
+from voicebots import audio_codecs, google_clients, tracing
+from voicebots.single_flight import SingleFlight, SingleFlightStats
+from voicebots.speech.tts_cache import TTSCache, get_synthesis_key, get_tts_cache
 
 AudioEncoding = texttospeech.AudioEncoding
 SsmlVoiceGender = texttospeech.SsmlVoiceGender
 
+DEFAULT_SPEAKING_RATE = 1.05
+DEFAULT_PITCH = 0  # -20,20
+DEFAULT_PREWARM_WORKERS = 8
+# Output sample rate of `stream_text_to_speech`
+STREAMING_SAMPLE_RATE = 24000
+# Compressed encodings, which are decoded to WAV for playback
+COMPRESSED_ENCODINGS = [AudioEncoding.OGG_OPUS, AudioEncoding.MP3]
+
+logger = logging.getLogger(__name__)
+
+# Identical syntheses requested concurrently (e.g. the opening line at the
+# start of many calls) share one request
+_synthesis_flights = SingleFlight(name="TTS")
+
 
 def convert_text_to_speech(
     text=None,
@@ -18,6 +37,8 @@ def convert_text_to_speech(
     voice_gender=None, # SsmlVoiceGender.FEMALE,
     language_code="en-GB",
     encoding=AudioEncoding.LINEAR16,
+    speaking_rate=DEFAULT_SPEAKING_RATE,
+    pitch=DEFAULT_PITCH,
 ):
     """Synthesizes speech from the input string of text or ssml.
 
@@ -29,8 +50,8 @@ def convert_text_to_speech(
     """
     assert text is not None or ssml is not None, "must provide text or ssml"
 
-    # Instantiates a client
-    client = texttospeech.TextToSpeechClient()
+    # Reuse the process-wide client (and its gRPC channel)
+    client = google_clients.get_tts_client()
 
     # Set the text input to be synthesized
     synthesis_input = texttospeech.SynthesisInput(text=text, ssml=ssml)
@@ -44,8 +65,8 @@ def convert_text_to_speech(
     # Select the type of audio file you want returned
     audio_config = texttospeech.AudioConfig(
         audio_encoding=encoding,
-        speaking_rate=1.05,
-        pitch=0,  # -20,20
+        speaking_rate=speaking_rate,
+        pitch=pitch,
     )
 
     # Perform the text-to-speech request on the text input with the selected
@@ -58,6 +79,83 @@ def convert_text_to_speech(
     return response.audio_content
 
 
+def stream_text_to_speech(
+    texts: Iterable[str],
+    voice_name: str,
+    language_code: str = "en-US",
+    speaking_rate: float = DEFAULT_SPEAKING_RATE,
+    sample_rate_hertz: int = STREAMING_SAMPLE_RATE,
+) -> Iterator[bytes]:
+    """Synthesize speech with the bidirectional streaming API.
+
+    Text can be sent while earlier audio is already coming back, so playback
+    can start after the first chunk. Only some voices support streaming (e.g.
+    "en-US-Chirp3-HD-Charon"); for others, synthesize sentence by sentence
+    with `load_or_convert_text_to_speech`.
+
+    Args:
+        texts: Text to synthesize, e.g. sentences as they are generated.
+        voice_name: Name of a voice that supports streaming.
+        language_code: Language of the voice.
+        speaking_rate: 1.0 is normal speed.
+        sample_rate_hertz: Sample rate of the returned audio.
+
+    Yields:
+        bytes. Raw LINEAR16 PCM chunks (no WAV header).
+    """
+    streaming_config = texttospeech.StreamingSynthesizeConfig(
+        voice=texttospeech.VoiceSelectionParams(
+            name=voice_name, language_code=language_code
+        ),
+        streaming_audio_config=texttospeech.StreamingAudioConfig(
+            audio_encoding=AudioEncoding.PCM,
+            sample_rate_hertz=sample_rate_hertz,
+            speaking_rate=speaking_rate,
+        ),
+    )
+
+    def _requests():
+        yield texttospeech.StreamingSynthesizeRequest(streaming_config=streaming_config)
+        for text in texts:
+            yield texttospeech.StreamingSynthesizeRequest(
+                input=texttospeech.StreamingSynthesisInput(text=text)
+            )
+
+    client = google_clients.get_tts_client()
+    for response in client.streaming_synthesize(_requests()):
+        yield response.audio_content
+
+
+def get_synthesis_config(
+    text=None,
+    ssml=None,
+    voice_name=None,
+    voice_gender=None,
+    language_code=None,
+    encoding=AudioEncoding.LINEAR16,
+    speaking_rate=DEFAULT_SPEAKING_RATE,
+    pitch=DEFAULT_PITCH,
+) -> Dict:
+    """Get the `convert_text_to_speech` kwargs that determine the synthesized audio.
+
+    If voice_name is set, voice_gender and language_code are dropped, since
+    the voice overrides them.
+    """
+    synthesis_config = dict(
+        text=text,
+        ssml=ssml,
+        encoding=encoding,
+        speaking_rate=speaking_rate,
+        pitch=pitch,
+    )
+    if voice_name is not None:
+        synthesis_config["voice_name"] = voice_name
+    else:
+        synthesis_config["voice_gender"] = voice_gender
+        synthesis_config["language_code"] = language_code
+    return synthesis_config
+
+
 def load_or_convert_text_to_speech(
     text=None,
     ssml=None,
@@ -65,52 +163,172 @@ def load_or_convert_text_to_speech(
     voice_gender=None,  # SsmlVoiceGender.FEMALE,
     language_code=None,  # "en-US",
     encoding=AudioEncoding.LINEAR16,  # wav
+    speaking_rate=DEFAULT_SPEAKING_RATE,
+    pitch=DEFAULT_PITCH,
+    cache: Union[TTSCache, None] = None,
     cache_dir: Union[str, None] = None,
 ):
+    """Synthesize speech, reading from and writing to the TTS cache.
+
+    Args:
+        text (str, optional): Text to synthesize.
+        ssml (str, optional): SSML to synthesize, if text is not provided.
+        voice_name (str, optional): Name of the voice, e.g. "en-GB-Neural2-D". If set,
+            voice_gender and language_code are ignored.
+        voice_gender (SsmlVoiceGender, optional): Voice gender, if no voice_name.
+        language_code (str, optional): Language code, e.g. "en-US", if no voice_name.
+        encoding (AudioEncoding, optional): Defaults to AudioEncoding.LINEAR16 (wav).
+            With OGG_OPUS or MP3, the compressed audio is downloaded and cached,
+            and decoded to WAV (requires ffmpeg).
+        speaking_rate (float, optional): 1.0 is normal speed.
+        pitch (float, optional): Semitones, -20 to 20.
+        cache (TTSCache, optional): Cache for synthesized audio.
+        cache_dir (str, optional): If no cache is given, use the process-wide
+            cache stored in this directory.
+
+    Returns:
+        bytes: Synthesized audio. WAV, unless the encoding is neither
+            compressed nor LINEAR16.
     """
+    assert text is not None or ssml is not None, "must provide text or ssml"
+    if cache is None and cache_dir is not None:
+        cache = get_tts_cache(cache_dir)
+    decode = audio_codecs.decode_to_wav if encoding in COMPRESSED_ENCODINGS else None
+
+    synthesis_config = get_synthesis_config(
+        text=text,
+        ssml=ssml,
+        voice_name=voice_name,
+        voice_gender=voice_gender,
+        language_code=language_code,
+        encoding=encoding,
+        speaking_rate=speaking_rate,
+        pitch=pitch,
+    )
+    cache_key = get_synthesis_key(synthesis_config)
+    with tracing.span("tts", voice=voice_name, chars=len(text or ssml)) as span:
+        if cache is not None:
+            audio_bytes = cache.get(cache_key, decode=decode)
+            if audio_bytes is not None:
+                span.set(cache_hit=True, bytes=len(audio_bytes))
+                return audio_bytes
+
+        audio_bytes, playable_bytes = _synthesis_flights.do(
+            (cache_key, id(cache)),
+            _synthesize_and_cache,
+            synthesis_config,
+            decode,
+            cache,
+            cache_key,
+        )
+        span.set(cache_hit=False, bytes=len(audio_bytes))
+    return playable_bytes
+
+
+def _synthesize_and_cache(
+    synthesis_config: Dict,
+    decode: Union[Callable[[bytes], bytes], None],
+    cache: Union[TTSCache, None],
+    cache_key: str,
+) -> Tuple[bytes, bytes]:
+    """Synthesize speech, and add it to the cache.
+
+    Returns:
+        The audio as synthesized, and as played (e.g. decoded to WAV).
+    """
+    audio_bytes = convert_text_to_speech(**synthesis_config)
+    playable_bytes = decode(audio_bytes) if decode is not None else audio_bytes
+    if cache is not None:
+        cache.set(
+            cache_key,
+            audio_bytes,
+            tag=synthesis_config["text"] or synthesis_config["ssml"],
+            playable_bytes=playable_bytes,
+        )
+    return audio_bytes, playable_bytes
+
+
+def get_synthesis_coalesce_stats() -> SingleFlightStats:
+    """Counters of syntheses that shared an identical request in flight."""
+    return _synthesis_flights.stats
+
+
+@dataclass
+class PrewarmReport:
+    """Summary of a `prewarm_text_to_speech` run.
+
+    Attributes:
+        num_requests (int): Number of (phrase, voice) pairs.
+        num_cached (int): Pairs that were already cached.
+        num_synthesized (int): Pairs synthesized and added to the cache.
+        num_failed (int): Pairs that failed to synthesize.
+        elapsed_sec (float): Wall clock time of the run.
+        cache_bytes (int): Size of the cache after the run.
+    """
+
+    num_requests: int = 0
+    num_cached: int = 0
+    num_synthesized: int = 0
+    num_failed: int = 0
+    elapsed_sec: float = 0.0
+    cache_bytes: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Synthesized phrases per second."""
+        return self.num_synthesized / self.elapsed_sec if self.elapsed_sec else 0.0
 
-    TODO: Update to use diskcache
+
+def prewarm_text_to_speech(
+    texts: Iterable[str],
+    voice_names: Iterable[str],
+    cache: TTSCache,
+    max_workers: int = DEFAULT_PREWARM_WORKERS,
+    **synthesis_kwargs,
+) -> PrewarmReport:
+    """Synthesize phrases for each voice concurrently, and store them in the cache.
+
+    Removes cold-start synthesis latency for phrases we know we'll need, like
+    opening lines and canned responses.
 
     Args:
-        text (_type_, optional): _description_. Defaults to None.
-        ssml (_type_, optional): _description_. Defaults to None.
-        voice_name (_type_, optional): _description_. Defaults to None.
-        willoverridethefollowing2paramsvoice_gender (_type_, optional): _description_. Defaults to SsmlVoiceGender.FEMALE.
-        language_code (str, optional): _description_. Defaults to "en-US".
-        encoding (_type_, optional): _description_. Defaults to AudioEncoding.LINEAR16.
+        texts: Phrases to synthesize.
+        voice_names: Voices to synthesize each phrase with.
+        cache: Cache to fill.
+        max_workers: Number of concurrent synthesis requests.
+        synthesis_kwargs: Other params of `get_synthesis_config`, e.g. speaking_rate.
 
     Returns:
-        _type_: _description_
+        PrewarmReport.
     """
-    assert text is not None or ssml is not None, "must provide text or ssml"
-    text_hash = text_utils.hash_normalized_text(f"{text or ssml}__{voice_name}")
-    audio_bytes = None
-    if cache_dir is not None:
-        fpath = os.path.join(cache_dir, f"{text_hash}.wav")
-        if os.path.exists(fpath):
-            # print(f"Found existing audio file for '{text or ssml}'")
-            audio_bytes = audio_utils.load_audio_from_file(fpath)
-    if audio_bytes is None:
-        # print("Converting text to speech")
-        if voice_name is not None:
-            audio_bytes = convert_text_to_speech(
-                text=text,
-                ssml=ssml,
-                voice_name=voice_name,
-                encoding=encoding,
-            )
-        else:
-            audio_bytes = convert_text_to_speech(
-                text=text,
-                ssml=ssml,
-                voice_gender=voice_gender,
-                language_code=language_code,
-                encoding=encoding,
-            )
-        if cache_dir is not None:
-            fpath = os.path.join(cache_dir, f"{text_hash}.wav")
-            # print(f"No existing audio file found. Saving audio file {fpath}")
-            audio_utils.save_audio_to_file(
-                fpath, audio_bytes, tags={"text": text or ssml, "hash": text_hash}
-            )
-    return audio_bytes
+    report = PrewarmReport()
+    start = time.time()
+
+    def _prewarm(text, voice_name) -> bool:
+        synthesis_config = get_synthesis_config(
+            text=text, voice_name=voice_name, **synthesis_kwargs
+        )
+        if get_synthesis_key(synthesis_config) in cache:
+            return True
+        load_or_convert_text_to_speech(cache=cache, **synthesis_config)
+        return False
+
+    requests = [(text, voice) for text in texts for voice in voice_names]
+    report.num_requests = len(requests)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(_prewarm, *request): request for request in requests}
+        for future in as_completed(futures):
+            try:
+                was_cached = future.result()
+            except Exception:
+                logger.exception(f"Failed to synthesize {futures[future]}")
+                report.num_failed += 1
+                continue
+            if was_cached:
+                report.num_cached += 1
+            else:
+                report.num_synthesized += 1
+
+    report.elapsed_sec = round(time.time() - start, 3)
+    report.cache_bytes = cache.volume()
+    return report
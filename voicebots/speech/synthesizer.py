@@ -0,0 +1,112 @@
+"""Text-to-speech backends.
+
+`Synthesizer` is the interface the voice loop uses to turn a sentence into
+audio. GoogleSynthesizer uses Google Cloud TTS (with the TTS cache).
+FakeSynthesizer is a local stand-in with configurable latency and error
+rate, for load testing without network access or API spend.
+"""
+import io
+import random
+import threading
+import time
+import wave
+from typing import Union
+
+from voicebots.simulation import Latency, maybe_fail
+from voicebots.speech import google_speech
+from voicebots.speech.tts_cache import TTSCache
+
+# Fake TTS timing
+FAKE_SYNTHESIS_LATENCY = Latency(median_sec=0.25, p95_sec=0.6)
+# Length of the fake audio
+FAKE_WORDS_PER_SEC = 2.5
+FAKE_SAMPLE_RATE = 24000
+
+
+class Synthesizer:
+    """Base class for all text-to-speech backends."""
+
+    def synthesize(self, text: str) -> bytes:
+        """Synthesize text. Returns LINEAR16 WAV bytes."""
+        raise NotImplementedError
+
+    def __call__(self, text: str) -> bytes:
+        return self.synthesize(text)
+
+
+class GoogleSynthesizer(Synthesizer):
+    """Synthesize speech with Google Cloud TTS, through the TTS cache."""
+
+    def __init__(
+        self,
+        voice_name: str,
+        cache: Union[TTSCache, None] = None,
+        **synthesis_kwargs,
+    ):
+        """Instantiate the GoogleSynthesizer.
+
+        Args:
+            voice_name: Name of the voice, e.g. "en-GB-Neural2-D".
+            cache: Optional; Cache for synthesized audio.
+            synthesis_kwargs: Other params of `load_or_convert_text_to_speech`, e.g. speaking_rate.
+        """
+        self.voice_name = voice_name
+        self.cache = cache
+        self.synthesis_kwargs = synthesis_kwargs
+
+    def synthesize(self, text: str) -> bytes:
+        return google_speech.load_or_convert_text_to_speech(
+            text=text,
+            voice_name=self.voice_name,
+            cache=self.cache,
+            **self.synthesis_kwargs,
+        )
+
+
+class FakeSynthesizer(Synthesizer):
+    """Local stand-in for Google TTS.
+
+    Returns silent WAV audio, as long as it would take to say the text.
+    """
+
+    def __init__(
+        self,
+        latency: Latency = FAKE_SYNTHESIS_LATENCY,
+        error_rate: float = 0.0,
+        words_per_sec: float = FAKE_WORDS_PER_SEC,
+        sample_rate: int = FAKE_SAMPLE_RATE,
+        seed: Union[int, None] = None,
+    ):
+        """Instantiate the FakeSynthesizer.
+
+        Args:
+            latency: Optional; Time to synthesize each text.
+            error_rate: Optional; Fraction of requests that fail with a FakeServiceError.
+            words_per_sec: Optional; Speaking rate, which sets the audio length.
+            sample_rate: Optional; Sample rate of the audio.
+            seed: Optional; Seed for reproducible latencies and errors.
+        """
+        self.latency = latency
+        self.error_rate = error_rate
+        self.words_per_sec = words_per_sec
+        self.sample_rate = sample_rate
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def synthesize(self, text: str) -> bytes:
+        with self._lock:
+            maybe_fail(self._rng, self.error_rate, "synthesis")
+            latency = self.latency.sample(self._rng)
+        time.sleep(latency)
+        audio_sec = max(1, len(text.split())) / self.words_per_sec
+        return _silent_wav(audio_sec, self.sample_rate)
+
+
+def _silent_wav(audio_sec: float, sample_rate: int) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(bytes(int(audio_sec * sample_rate) * 2))
+    return buffer.getvalue()
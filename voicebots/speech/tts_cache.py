@@ -0,0 +1,199 @@
+"""Two-tier cache for synthesized speech.
+
+Bots repeat the same openings, closings and fillers constantly, and each TTS
+miss costs hundreds of milliseconds. Audio is cached in two tiers:
+
+- A bounded in-memory LRU of playable audio, for the hottest phrases.
+- A size-limited diskcache store, which survives restarts. Compressed
+  audio (e.g. OGG_OPUS) is stored as is, and decoded once when loaded into
+  the memory tier.
+
+Entries are keyed on the full synthesis config (text, voice, language,
+encoding, speaking rate, etc.), so changing any of them never serves stale
+audio.
+
+Usage:
+    cache = TTSCache("/tmp/tts_cache")
+    audio_bytes = google_speech.load_or_convert_text_to_speech(text="Hi!", cache=cache)
+    print(cache.stats)
+"""
+import json
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Union
+
+import diskcache
+
+from voicebots import text_utils
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DISK_SIZE_LIMIT = 2**30  # 1GB
+DEFAULT_MEMORY_SIZE_LIMIT = 64 * 2**20  # 64MB
+
+
+def get_synthesis_key(synthesis_config: Dict) -> str:
+    """Get a cache key for the given synthesis config.
+
+    Args:
+        synthesis_config: Keyword arguments passed to `convert_text_to_speech()`.
+
+    Returns:
+        str. Cache key.
+    """
+    canonical = json.dumps(synthesis_config, sort_keys=True, default=str)
+    return "tts:" + text_utils.hash_normalized_text(canonical, normalize=False)
+
+
+@dataclass
+class TTSCacheStats:
+    """Counters for the TTS cache.
+
+    Attributes:
+        memory_hits (int): Lookups served from the in-memory tier.
+        disk_hits (int): Lookups served from the disk tier.
+        misses (int): Lookups not found in either tier.
+        bytes_served (int): Audio bytes served from cache.
+        bytes_stored (int): Audio bytes added to the cache.
+    """
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+    bytes_served: int = 0
+    bytes_stored: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return hits / lookups if lookups else 0.0
+
+
+class TTSCache:
+    """In-memory LRU in front of a size-limited diskcache store. Thread-safe."""
+
+    def __init__(
+        self,
+        directory: Union[str, None] = None,
+        size_limit: int = DEFAULT_DISK_SIZE_LIMIT,
+        memory_size_limit: int = DEFAULT_MEMORY_SIZE_LIMIT,
+    ):
+        """Instantiate the TTSCache.
+
+        Args:
+            directory: Optional; Directory of the disk tier. If None, only the
+                in-memory tier is used.
+            size_limit: Max bytes in the disk tier. Least recently used
+                entries are evicted first.
+            memory_size_limit: Max bytes in the in-memory tier.
+        """
+        self._disk = None
+        if directory is not None:
+            self._disk = diskcache.Cache(
+                directory,
+                size_limit=size_limit,
+                eviction_policy="least-recently-used",
+            )
+        self.memory_size_limit = memory_size_limit
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self.stats = TTSCacheStats()
+
+    def get(
+        self, key: str, decode: Union[Callable[[bytes], bytes], None] = None
+    ) -> Union[bytes, None]:
+        """Get cached audio, or None if not cached.
+
+        Args:
+            key: See `get_synthesis_key`.
+            decode: Optional; Decodes audio stored compressed on disk to
+                playable audio, e.g. `audio_codecs.decode_to_wav`.
+        """
+        with self._lock:
+            audio_bytes = self._memory.get(key)
+            if audio_bytes is not None:
+                self._memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                self.stats.bytes_served += len(audio_bytes)
+                return audio_bytes
+
+        if self._disk is not None:
+            audio_bytes = self._disk.get(key)
+
+        if audio_bytes is None:
+            with self._lock:
+                self.stats.misses += 1
+            return None
+        num_bytes = len(audio_bytes)
+        if decode is not None:
+            audio_bytes = decode(audio_bytes)
+        with self._lock:
+            self.stats.disk_hits += 1
+            self.stats.bytes_served += num_bytes
+            self._set_memory(key, audio_bytes)
+        return audio_bytes
+
+    def set(
+        self,
+        key: str,
+        audio_bytes: bytes,
+        tag: Union[str, None] = None,
+        playable_bytes: Union[bytes, None] = None,
+    ):
+        """Add audio to both tiers.
+
+        Args:
+            key: See `get_synthesis_key`.
+            audio_bytes: Audio to cache.
+            tag: Optional; Stored with the disk entry, e.g. the text, for debugging.
+            playable_bytes: Optional; If `audio_bytes` is compressed, its decoded
+                audio, which is kept in the memory tier instead.
+        """
+        if self._disk is not None:
+            self._disk.set(key, audio_bytes, tag=tag)
+        with self._lock:
+            self.stats.bytes_stored += len(audio_bytes)
+            self._set_memory(
+                key, playable_bytes if playable_bytes is not None else audio_bytes
+            )
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            if key in self._memory:
+                return True
+        return self._disk is not None and key in self._disk
+
+    def volume(self) -> int:
+        """Approximate bytes used by the cache (disk tier, or memory tier if no disk)."""
+        if self._disk is not None:
+            return self._disk.volume()
+        return self._memory_size
+
+    def _set_memory(self, key: str, audio_bytes: bytes):
+        """Add to the in-memory LRU. Caller must hold the lock."""
+        if len(audio_bytes) > self.memory_size_limit:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous)
+        self._memory[key] = audio_bytes
+        self._memory_size += len(audio_bytes)
+        while self._memory_size > self.memory_size_limit:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+
+_caches: Dict[str, TTSCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_tts_cache(directory: str) -> TTSCache:
+    """Get a process-wide TTSCache for the given directory."""
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = TTSCache(directory)
+        return _caches[directory]
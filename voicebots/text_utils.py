@@ -1,5 +1,21 @@
 import hashlib
+import re
 import sys
+from typing import Iterable, Iterator, List
+
+# Sentence-ending punctuation and any closing quotes/brackets (group 1),
+# followed by whitespace
+SENTENCE_BOUNDARY_RE = re.compile(r"([.!?][\"')\]]*)\s+")
+
+# Closing quotes and brackets after the end of a sentence
+CLOSING_CHARS = "\"')]"
+
+# Don't split after these, e.g. "Dr. Smith"
+ABBREVIATIONS = {"mr.", "mrs.", "ms.", "dr.", "st.", "vs.", "e.g.", "i.e.", "etc."}
+
+# Sentences shorter than this are merged with the next one, so we don't
+# synthesize tiny fragments like "Hi." or "Mr." on their own.
+MIN_SENTENCE_CHARS = 20
 
 
 def normalize_text(text: str):
@@ -22,3 +38,57 @@ def hash_normalized_text(text, normalize=True):
         text = normalize_text(text)
     text = text.encode("utf-8")
     return hashlib.sha256(text).hexdigest()
+
+
+class SentenceChunker:
+    """Split a stream of text deltas into sentences.
+
+    Feed it token deltas as they arrive from the LLM. Each call to `feed`
+    returns the sentences completed so far, so they can be sent to TTS
+    while the rest of the completion is still being generated.
+
+    Usage:
+        chunker = SentenceChunker()
+        for delta in deltas:
+            for sentence in chunker.feed(delta):
+                speak(sentence)
+        if chunker.flush():
+            ...
+    """
+
+    def __init__(self, min_chars: int = MIN_SENTENCE_CHARS):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        """Add a text delta and return any completed sentences."""
+        self._buffer += delta
+        sentences = []
+        start = 0
+        for match in SENTENCE_BOUNDARY_RE.finditer(self._buffer):
+            sentence = self._buffer[start : match.end(1)].strip()
+            last_word = sentence.rsplit(maxsplit=1)[-1].lower() if sentence else ""
+            last_word = last_word.rstrip(CLOSING_CHARS)
+            if len(sentence) < self.min_chars or last_word in ABBREVIATIONS:
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self._buffer = self._buffer[start:]
+        return sentences
+
+    def flush(self) -> str:
+        """Return whatever text remains in the buffer."""
+        remainder, self._buffer = self._buffer.strip(), ""
+        return remainder
+
+
+def iter_sentences(
+    deltas: Iterable[str], min_chars: int = MIN_SENTENCE_CHARS
+) -> Iterator[str]:
+    """Yield sentences from a stream of text deltas as soon as they complete."""
+    chunker = SentenceChunker(min_chars=min_chars)
+    for delta in deltas:
+        yield from chunker.feed(delta)
+    remainder = chunker.flush()
+    if remainder:
+        yield remainder
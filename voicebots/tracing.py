@@ -0,0 +1,328 @@
+"""Lightweight per-turn latency tracing for ASR, LLM, TTS and playback.
+
+Each stage records a Span (turn id, stage, start/end, and attributes such as
+cache hits, bytes and tokens). Spans are appended to a JSONL file and/or
+aggregated into Prometheus metrics, served as text on a local endpoint.
+
+Tracing is off until `configure()` is called. When disabled, `span()`
+returns a shared no-op span, so instrumented code pays one attribute check.
+
+Usage:
+    tracing.configure(jsonl_path="/tmp/spans.jsonl", metrics_port=9464)
+    tracing.set_turn("my_chat:3")
+    with tracing.span("tts", voice="en-GB-Neural2-D") as span:
+        audio_bytes = synthesize(text)
+        span.set(bytes=len(audio_bytes), cache_hit=False)
+
+    curl localhost:9464/metrics
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Union
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets of stage durations (seconds)
+DURATION_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+METRICS_PREFIX = "voicebots"
+
+
+@dataclass
+class Span:
+    """Timing of one stage of a turn.
+
+    Attributes:
+        stage (str): E.g. "listen", "asr", "llm", "tts", "playback".
+        turn_id (str): Turn the stage belongs to, see `set_turn`.
+        start (float): Unix time the stage started.
+        end (float): Unix time the stage ended.
+        attributes (Dict): E.g. cache_hit, bytes, tokens, request_tag, error.
+    """
+
+    stage: str
+    turn_id: Union[str, None] = None
+    start: float = 0.0
+    end: float = 0.0
+    attributes: Dict = field(default_factory=dict)
+
+    @property
+    def duration_sec(self) -> float:
+        return self.end - self.start
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict:
+        span = asdict(self)
+        span["duration_ms"] = round(self.duration_sec * 1000, 3)
+        return span
+
+
+class _NoopSpan:
+    """Returned by `span()` when tracing is disabled."""
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class _ActiveSpan:
+    def __init__(self, tracer: "Tracer", span: Span):
+        self._tracer = tracer
+        self._span = span
+        self._start = 0.0
+
+    def __enter__(self) -> Span:
+        self._span.start = time.time()
+        self._start = time.perf_counter()
+        return self._span
+
+    def __exit__(self, type, value, traceback):
+        # Monotonic duration, anchored at the wall clock start time
+        self._span.end = self._span.start + time.perf_counter() - self._start
+        if type is GeneratorExit:
+            # The consumer stopped early, e.g. the user interrupted the bot
+            self._span.set(cancelled=True)
+        elif value is not None:
+            self._span.set(error=f"{type.__name__}: {value}")
+        self._tracer.record(self._span)
+        return False
+
+
+class JsonlExporter:
+    """Appends spans to a JSONL file, one span per line."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", buffering=1)  # Line buffered
+
+    def __call__(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class Metrics:
+    """Aggregates spans into Prometheus metrics."""
+
+    def __init__(self, buckets: List[float] = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._bucket_counts: Dict[str, List[int]] = defaultdict(
+            lambda: [0] * len(self.buckets)
+        )
+        self._counts: Dict[str, int] = defaultdict(int)
+        self._sums: Dict[str, float] = defaultdict(float)
+        self._errors: Dict[str, int] = defaultdict(int)
+        self._cache_hits: Dict[str, int] = defaultdict(int)
+        self._bytes: Dict[str, int] = defaultdict(int)
+        self._tokens: Dict[str, int] = defaultdict(int)
+
+    def __call__(self, span: Span):
+        stage = span.stage
+        duration_sec = span.duration_sec
+        attributes = span.attributes
+        with self._lock:
+            self._counts[stage] += 1
+            self._sums[stage] += duration_sec
+            for i, bound in enumerate(self.buckets):
+                if duration_sec <= bound:
+                    self._bucket_counts[stage][i] += 1
+            if "error" in attributes:
+                self._errors[stage] += 1
+            if attributes.get("cache_hit"):
+                self._cache_hits[stage] += 1
+            self._bytes[stage] += attributes.get("bytes") or 0
+            self._tokens[stage] += attributes.get("tokens") or 0
+
+    def render(self) -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        name = f"{METRICS_PREFIX}_stage_duration_seconds"
+        lines = [
+            f"# HELP {name} Duration of each stage of a turn.",
+            f"# TYPE {name} histogram",
+        ]
+        with self._lock:
+            for stage in sorted(self._counts):
+                for bound, count in zip(self.buckets, self._bucket_counts[stage]):
+                    lines.append(
+                        f'{name}_bucket{{stage="{stage}",le="{bound}"}} {count}'
+                    )
+                lines.append(
+                    f'{name}_bucket{{stage="{stage}",le="+Inf"}} {self._counts[stage]}'
+                )
+                lines.append(f'{name}_sum{{stage="{stage}"}} {self._sums[stage]:.6f}')
+                lines.append(f'{name}_count{{stage="{stage}"}} {self._counts[stage]}')
+            for counter, values, help_text in [
+                ("errors", self._errors, "Stages that raised an error."),
+                ("cache_hits", self._cache_hits, "Stages served from a cache."),
+                ("bytes", self._bytes, "Audio bytes processed."),
+                ("tokens", self._tokens, "LLM tokens used."),
+            ]:
+                name = f"{METRICS_PREFIX}_{counter}_total"
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for stage in sorted(self._counts):
+                    lines.append(f'{name}{{stage="{stage}"}} {values[stage]}')
+        return "\n".join(lines) + "\n"
+
+
+class Tracer:
+    """Records spans and passes them to exporters.
+
+    The current turn id is shared by all threads, since the voice loop runs
+    one call per process. Pass `turn_id` to `span()` to override it, e.g.
+    when serving several calls from one process.
+    """
+
+    def __init__(self, exporters: Union[List[Callable[[Span], None]], None] = None):
+        self.exporters = exporters or []
+        self.turn_id: Union[str, None] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    def set_turn(self, turn_id: Union[str, None]):
+        self.turn_id = turn_id
+
+    def span(self, stage: str, turn_id: Union[str, None] = None, **attributes):
+        """Time a stage. Use as a context manager, which yields the Span."""
+        if not self.exporters:
+            return _NOOP_SPAN
+        span = Span(
+            stage=stage,
+            turn_id=turn_id if turn_id is not None else self.turn_id,
+            attributes=attributes,
+        )
+        return _ActiveSpan(self, span)
+
+    def record_span(
+        self,
+        stage: str,
+        start: float,
+        end: float,
+        turn_id: Union[str, None] = None,
+        **attributes,
+    ):
+        """Record a stage timed by the caller, e.g. from an event to a result.
+
+        Args:
+            stage: E.g. "asr".
+            start: Unix time the stage started.
+            end: Unix time the stage ended.
+            turn_id: Optional; Defaults to the current turn.
+            attributes: Optional; Span attributes.
+        """
+        if not self.exporters:
+            return
+        self.record(
+            Span(
+                stage=stage,
+                turn_id=turn_id if turn_id is not None else self.turn_id,
+                start=start,
+                end=max(end, start),
+                attributes=attributes,
+            )
+        )
+
+    def record(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter(span)
+            except Exception:
+                logger.exception(f"Failed to export span {span.stage}")
+
+
+def serve_metrics(metrics: Metrics, port: int, host: str = "localhost"):
+    """Serve `metrics` as Prometheus text at http://host:port/metrics.
+
+    Returns:
+        The running ThreadingHTTPServer. Call `shutdown()` to stop it.
+    """
+
+    class _Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip("/") != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info(f"Serving metrics at http://{host}:{server.server_port}/metrics")
+    return server
+
+
+_tracer = Tracer()
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def configure(
+    jsonl_path: Union[str, None] = None,
+    metrics_port: Union[int, None] = None,
+) -> Tracer:
+    """Enable tracing on the default tracer.
+
+    Args:
+        jsonl_path: Optional; Append spans to this JSONL file.
+        metrics_port: Optional; Serve Prometheus metrics on this port.
+
+    Returns:
+        The default Tracer.
+    """
+    if jsonl_path is not None:
+        _tracer.exporters.append(JsonlExporter(jsonl_path))
+    if metrics_port is not None:
+        metrics = Metrics()
+        _tracer.exporters.append(metrics)
+        serve_metrics(metrics, metrics_port)
+    return _tracer
+
+
+def set_turn(turn_id: Union[str, None]):
+    """Set the turn id of spans recorded by the default tracer."""
+    _tracer.set_turn(turn_id)
+
+
+def span(stage: str, turn_id: Union[str, None] = None, **attributes):
+    """Time a stage with the default tracer. See `Tracer.span`."""
+    return _tracer.span(stage, turn_id=turn_id, **attributes)
+
+
+def record_span(
+    stage: str, start: float, end: float, turn_id: Union[str, None] = None, **attributes
+):
+    """Record a stage timed by the caller. See `Tracer.record_span`."""
+    _tracer.record_span(stage, start, end, turn_id=turn_id, **attributes)
@@ -0,0 +1,310 @@
+"""Full-duplex turn engine.
+
+Runs the voice loop as concurrent stages connected by queues:
+
+    listen (ASR) -> think (LLM) -> synthesize (TTS) -> speak (playback)
+
+so the next sentence is synthesized while the current one is playing.
+
+Unlike the sequential loop in `cli.chat`, the microphone stays open while the
+bot is speaking. If the user starts talking over the bot ("barge-in"), the
+in-flight LLM, TTS and playback work for the current reply is cancelled and
+the engine starts listening to the new utterance.
+
+Each stage is a plain callable, so the engine can be driven headlessly with
+fakes (see the `__main__` block below).
+
+NOTE: With speakers (rather than headphones) the microphone will hear the bot
+and may trigger barge-in on its own voice. Use headphones or a device with
+echo cancellation, or raise `barge_in_min_chars`.
+
+Usage:
+    engine = TurnEngine(
+        transcriber=GoogleTranscriber(single_utterance=False),
+        respond=lambda turns: chat_utils.chat_prompt_stream(turns, ...),
+        synthesize=google_speech.load_or_convert_text_to_speech,
+        play=lambda audio_bytes: (sink.write_wav(audio_bytes), sink.flush()),
+        stop_playback=sink.stop,
+    )
+    turns = engine.run()
+"""
+import logging
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, List, Union
+
+from voicebots.asr.transcriber import Transcriber
+
+logger = logging.getLogger(__name__)
+
+# Minimum interim transcript length that counts as the user talking over the bot
+BARGE_IN_MIN_CHARS = 3
+
+# How often idle stages wake up to check whether the engine has stopped
+POLL_INTERVAL_SEC = 0.1
+
+
+@dataclass
+class _Utterance:
+    text: str
+    generation: int
+
+
+@dataclass
+class _Sentence:
+    text: str
+    generation: int
+    end_of_reply: bool = False
+    audio_bytes: Union[bytes, None] = None
+
+
+class TurnEngine:
+    """Run listen, think, synthesize and speak as concurrent stages with barge-in.
+
+    Every user utterance starts a new "generation". Work items carry the
+    generation they were created for, and stages drop items from an older
+    generation. Barge-in simply bumps the generation, drains the queues and
+    stops playback.
+    """
+
+    def __init__(
+        self,
+        transcriber: Transcriber,
+        respond: Callable[[List[Dict]], Iterable[str]],
+        synthesize: Callable[[str], bytes],
+        play: Callable[[bytes], None],
+        stop_playback: Union[Callable[[], None], None] = None,
+        turns: Union[List[Dict], None] = None,
+        should_end_call: Union[Callable[[str], bool], None] = None,
+        on_user_text: Union[Callable[[str], None], None] = None,
+        on_agent_text: Union[Callable[[str], None], None] = None,
+        barge_in_min_chars: int = BARGE_IN_MIN_CHARS,
+    ):
+        """Instantiate the TurnEngine.
+
+        Args:
+            transcriber: Speech-to-text stage. `listen()` is called in a loop.
+            respond: LLM stage. Given the dialogue turns, returns an iterable of
+                reply sentences (e.g. `chat_utils.chat_prompt_stream`).
+            synthesize: TTS stage. Converts a sentence to audio bytes.
+            play: Playback stage. Plays audio bytes, blocking until done.
+            stop_playback: Optional; Interrupts `play` mid-sentence on barge-in.
+                Without it, barge-in takes effect after the current sentence.
+            turns: Optional; Dialogue history to continue from. Updated in place.
+            should_end_call: Optional; Returns True if the user's utterance ends the call.
+            on_user_text: Optional; Called with each final user utterance.
+            on_agent_text: Optional; Called with the text the agent actually spoke.
+            barge_in_min_chars: Minimum interim transcript length that interrupts the agent.
+        """
+        self.transcriber = transcriber
+        self.respond = respond
+        self.synthesize = synthesize
+        self.play = play
+        self.stop_playback = stop_playback
+        self.turns = turns if turns is not None else []
+        self.should_end_call = should_end_call
+        self.on_user_text = on_user_text
+        self.on_agent_text = on_agent_text
+        self.barge_in_min_chars = barge_in_min_chars
+
+        self.num_barge_ins = 0
+        self._generation = 0
+        self._reply_active = False
+        self._spoken: List[str] = []
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._utterances: queue.Queue = queue.Queue()
+        self._sentences: queue.Queue = queue.Queue()
+        self._audio: queue.Queue = queue.Queue()
+
+    def run(self) -> List[Dict]:
+        """Run the engine until the call ends.
+
+        Returns:
+            The dialogue turns, including the ones passed in.
+        """
+        stages = [
+            threading.Thread(target=self._listen_stage, name="listen", daemon=True),
+            threading.Thread(target=self._think_stage, name="think", daemon=True),
+            threading.Thread(
+                target=self._synthesize_stage, name="synthesize", daemon=True
+            ),
+            threading.Thread(target=self._speak_stage, name="speak", daemon=True),
+        ]
+        for stage in stages:
+            stage.start()
+        self._stopped.wait()
+        # The listen stage may be blocked on the microphone, so we don't join it.
+        for stage in stages[1:]:
+            stage.join()
+        with self._lock:
+            self._commit_agent_turn()
+        return self.turns
+
+    def stop(self):
+        """End the call. Stages exit after their current work item."""
+        self._stopped.set()
+        self._cancel_reply()
+
+    def barge_in(self):
+        """Cancel the agent's current reply because the user started talking."""
+        with self._lock:
+            if not self._reply_active:
+                return
+            logger.info("User barged in. Cancelling current reply.")
+            self.num_barge_ins += 1
+            self._generation += 1
+            self._commit_agent_turn()
+        self._cancel_reply()
+
+    def _cancel_reply(self):
+        _drain(self._sentences)
+        _drain(self._audio)
+        if self.stop_playback is not None:
+            self.stop_playback()
+
+    def _is_current(self, generation: int) -> bool:
+        return generation == self._generation and not self._stopped.is_set()
+
+    def _commit_agent_turn(self):
+        """Record what the agent has said so far for the current reply."""
+        self._reply_active = False
+        if not self._spoken:
+            return
+        agent_text = " ".join(self._spoken)
+        self._spoken = []
+        self.turns.append({"speaker": "agent", "text": agent_text})
+        if self.on_agent_text is not None:
+            self.on_agent_text(agent_text)
+
+    def _listen_stage(self):
+        while not self._stopped.is_set():
+            try:
+                for transcript in self.transcriber.listen():
+                    if self._stopped.is_set():
+                        return
+                    if transcript.deadline_exceeded:
+                        logger.info("No utterance detected. Ending call.")
+                        self.stop()
+                        return
+                    text = (transcript.text or "").strip()
+                    if len(text) >= self.barge_in_min_chars:
+                        self.barge_in()
+                    if transcript.is_final and text:
+                        self._handle_user_text(text)
+            except Exception:
+                logger.exception("Error in listen stage")
+
+    def _handle_user_text(self, text: str):
+        with self._lock:
+            self._commit_agent_turn()
+            self._generation += 1
+            self.turns.append({"speaker": "user", "text": text})
+            if self.on_user_text is not None:
+                self.on_user_text(text)
+            if self.should_end_call is not None and self.should_end_call(text):
+                self.stop()
+                return
+            self._reply_active = True
+            self._utterances.put(_Utterance(text, self._generation))
+
+    def _think_stage(self):
+        while not self._stopped.is_set():
+            try:
+                utterance = self._utterances.get(timeout=POLL_INTERVAL_SEC)
+            except queue.Empty:
+                continue
+            generation = utterance.generation
+            if not self._is_current(generation):
+                continue
+            try:
+                sentences = iter(self.respond(list(self.turns)))
+                for sentence in sentences:
+                    if not self._is_current(generation):
+                        # Stop generating, e.g. close the LLM stream
+                        getattr(sentences, "close", lambda: None)()
+                        break
+                    self._sentences.put(_Sentence(sentence, generation))
+            except Exception:
+                logger.exception("Error in think stage")
+            self._sentences.put(_Sentence("", generation, end_of_reply=True))
+
+    def _synthesize_stage(self):
+        while not self._stopped.is_set():
+            try:
+                sentence = self._sentences.get(timeout=POLL_INTERVAL_SEC)
+            except queue.Empty:
+                continue
+            if not self._is_current(sentence.generation):
+                continue
+            if not sentence.end_of_reply:
+                try:
+                    sentence.audio_bytes = self.synthesize(sentence.text)
+                except Exception:
+                    logger.exception("Error in synthesize stage")
+                    continue
+            if self._is_current(sentence.generation):
+                self._audio.put(sentence)
+
+    def _speak_stage(self):
+        while not self._stopped.is_set():
+            try:
+                sentence = self._audio.get(timeout=POLL_INTERVAL_SEC)
+            except queue.Empty:
+                continue
+            with self._lock:
+                if not self._is_current(sentence.generation):
+                    continue
+                if sentence.end_of_reply:
+                    self._commit_agent_turn()
+                    continue
+                self._spoken.append(sentence.text)
+            try:
+                self.play(sentence.audio_bytes)
+            except Exception:
+                logger.exception("Error in speak stage")
+
+
+def _drain(q: queue.Queue):
+    while True:
+        try:
+            q.get(block=False)
+        except queue.Empty:
+            return
+
+
+if __name__ == "__main__":
+    """Headless demo of the TurnEngine with fake ASR, LLM and TTS stages.
+
+    Usage:
+        python -m voicebots.turn_engine
+    """
+    import time
+
+    from voicebots.asr.transcriber import ScriptedTranscriber
+
+    logging.basicConfig(level=logging.INFO)
+
+    def fake_respond(turns):
+        for i in range(3):
+            time.sleep(0.2)
+            yield f"Reply to '{turns[-1]['text']}', sentence {i}."
+
+    def fake_play(audio_bytes):
+        time.sleep(0.3)
+
+    engine = TurnEngine(
+        transcriber=ScriptedTranscriber(
+            ["hello there", "tell me a story", "actually never mind", "goodbye"],
+            pause_sec=0.5,
+        ),
+        respond=fake_respond,
+        synthesize=lambda text: text.encode("utf-8"),
+        play=fake_play,
+        should_end_call=lambda text: "goodbye" in text,
+        on_user_text=lambda text: print(f"User: {text}"),
+        on_agent_text=lambda text: print(f"Agent: {text}"),
+    )
+    engine.run()
+    print(f"Barge-ins: {engine.num_barge_ins}")